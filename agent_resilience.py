@@ -0,0 +1,170 @@
+# agent_resilience.py - Deadlines, retries, hedging and circuit breaker on the agents' Gemini calls
+"""
+attach(coordinator) wraps the model of every agent of the tree in
+ResilientLlm. The wrapper applies the "model" policy of resilience.py to
+each call:
+
+- deadline: MODEL_DEADLINE_SECONDS for the whole call (all attempts, every
+  streamed chunk). It is also sent as the HTTP timeout of each attempt.
+- retries of transient errors (429, 5xx, timeouts), jittered and out of
+  the retry budget. A streamed call is only retried before its first chunk.
+- hedging: a non-streamed call still running after the p95 of the agent's
+  recent calls gets a duplicate, and the first answer wins.
+- circuit breaker: while Gemini is failing, calls fail at once.
+
+The genai client's own retries are off (retry_options(): one attempt), so
+they do not multiply with these.
+"""
+import asyncio
+import copy
+import time
+from typing import AsyncGenerator
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.genai import types
+
+import resilience
+from resilience import DeadlineExceeded
+
+
+def retry_options() -> types.HttpRetryOptions:
+    """HTTP retries of the genai client: none, ResilientLlm retries within the budget."""
+    return types.HttpRetryOptions(attempts=1)
+
+
+def _set_timeout(llm_request: LlmRequest, seconds: float):
+    """HTTP timeout of the next attempt (genai takes milliseconds)."""
+    config = llm_request.config
+    if config is None:
+        return
+    if config.http_options is None:
+        config.http_options = types.HttpOptions()
+    config.http_options.timeout = max(1, int(seconds * 1000))
+
+
+def _copy_request(llm_request: LlmRequest) -> LlmRequest:
+    """Request for a hedge: the model call adds to the contents and headers."""
+    return llm_request.model_copy(
+        update={
+            "contents": copy.deepcopy(llm_request.contents),
+            "config": llm_request.config.model_copy(deep=True) if llm_request.config else None,
+        }
+    )
+
+
+class ResilientLlm(BaseLlm):
+    """An agent's model, called under the "model" dependency policy."""
+
+    inner: BaseLlm
+    agent_name: str
+
+    async def _complete(self, llm_request: LlmRequest) -> list:
+        return [r async for r in self.inner.generate_content_async(llm_request, stream=False)]
+
+    async def _generate(self, dep, llm_request: LlmRequest, deadline: float) -> list:
+        """A non-streamed call, hedged after the agent's p95 latency."""
+        remaining = deadline - time.monotonic()
+        _set_timeout(llm_request, remaining)
+        first = asyncio.ensure_future(self._complete(llm_request))
+        tasks = [first]
+        try:
+            delay = dep.hedge_delay(self.agent_name)
+            if delay is not None and delay < remaining:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and dep.budget.try_spend():
+                    dep.count("hedge")
+                    hedge_request = _copy_request(llm_request)
+                    _set_timeout(hedge_request, deadline - time.monotonic())
+                    tasks.append(asyncio.ensure_future(self._complete(hedge_request)))
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, deadline - time.monotonic()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    dep.count("deadline_exceeded")
+                    raise DeadlineExceeded(f"model call of {self.agent_name}: deadline exceeded")
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            dep.count("hedge_win")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _stream(self, dep, llm_request: LlmRequest, deadline: float):
+        """A streamed call; the deadline applies to every chunk."""
+        _set_timeout(llm_request, deadline - time.monotonic())
+        responses = self.inner.generate_content_async(llm_request, stream=True)
+        try:
+            while True:
+                try:
+                    response = await asyncio.wait_for(
+                        responses.__anext__(), max(0.001, deadline - time.monotonic())
+                    )
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    dep.count("deadline_exceeded")
+                    raise DeadlineExceeded(f"model call of {self.agent_name}: deadline exceeded")
+                yield response
+        finally:
+            await responses.aclose()
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        dep = resilience.dependency("model")
+        dep.admit()
+        deadline = time.monotonic() + dep.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.monotonic()
+            yielded = False
+            try:
+                if stream:
+                    async for response in self._stream(dep, llm_request, deadline):
+                        yielded = True
+                        yield response
+                else:
+                    for response in await self._generate(dep, llm_request, deadline):
+                        yielded = True
+                        yield response
+            except Exception as e:
+                if not resilience.is_transient(e):
+                    dep.answered()
+                    raise
+                # Chunks already sent cannot be taken back
+                delay = None if yielded else dep.retry_delay(e, attempt, True, deadline)
+                if delay is None:
+                    dep.failed(e)
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            dep.succeeded(self.agent_name, time.monotonic() - started)
+            return
+
+    def connect(self, llm_request: LlmRequest):
+        return self.inner.connect(llm_request)
+
+
+def attach(agent):
+    """Wraps the model of `agent` and all its sub-agents."""
+    inner = agent.canonical_model
+    if isinstance(inner, ResilientLlm):
+        if inner.agent_name == agent.name:
+            return agent  # already attached
+        inner = inner.inner  # model inherited from the parent agent
+    agent.model = ResilientLlm(model=inner.model, inner=inner, agent_name=agent.name)
+    for sub_agent in getattr(agent, "sub_agents", None) or []:
+        attach(sub_agent)
+    return agent
@@ -0,0 +1,204 @@
+# agent_runtime.py - Lazy construction of the agents, runner and storage clients
+"""
+Importing this module is cheap: the Google ADK / genai SDKs, the five agents,
+the runner and the BigQuery / GCS clients (created when manual_store_gcp is
+imported) are only built on first use, or by warm_up() when the server starts.
+
+- get_runner() builds everything once, under a lock, and returns the runner.
+- warm_up() builds the runner, the storage clients and the search index and
+  records how long each component took; main.py runs it in the background
+  at startup so the worker accepts traffic (and answers liveness) right away.
+- readiness() reports which components are ready, for /health.
+"""
+import logging
+import sys
+import threading
+import time
+
+APP_NAME = "agents"
+
+log = logging.getLogger("agent_runtime")
+
+_runner = None
+_runner_lock = threading.Lock()
+_components: dict = {}  # name -> {"ready": bool, "ms": float, "error": str | None}
+_warmup_started_at = None
+
+
+def _record(name: str, started: float, error: Exception | None = None):
+    _components[name] = {
+        "ready": error is None,
+        "ms": round((time.perf_counter() - started) * 1000, 1),
+        "error": repr(error) if error is not None else None,
+    }
+
+
+def _build_runner():
+    from google.adk.artifacts import InMemoryArtifactService
+    from google.adk.memory import InMemoryMemoryService
+    from google.adk.runners import Runner
+
+    import agent_resilience
+    import cassettes
+    import context_budget
+    import session_store
+    import tracing
+    from agent_telemetry import TelemetryPlugin
+
+    from agents.coordinator import create_coordinator
+    from agents.data_agent import create_data_agent
+    from agents.generator_agent import create_generator_agent
+    from agents.manual_agent import create_manual_agent
+    from agents.search_agent import create_search_agent
+
+    # ADK's spans (agents, model and tool calls) go to this provider
+    tracing.setup()
+
+    # Retry options for agents: one HTTP attempt, ResilientLlm does the
+    # deadlines, budgeted retries and hedging (agent_resilience.py)
+    retry = agent_resilience.retry_options()
+
+    log.info("initializing agents")
+    manual_agent = create_manual_agent(retry)
+    log.info("agent initialized", extra={"agent": manual_agent.name})
+
+    data_agent = create_data_agent(retry)
+    log.info("agent initialized", extra={"agent": data_agent.name})
+
+    search_agent = create_search_agent(retry)
+    log.info("agent initialized", extra={"agent": search_agent.name})
+
+    generator_agent = create_generator_agent(retry)
+    log.info("agent initialized", extra={"agent": generator_agent.name})
+
+    coordinator = create_coordinator(
+        manual_agent, data_agent, search_agent, generator_agent, retry
+    )
+    log.info("agent initialized", extra={"agent": coordinator.name})
+
+    # Token budget for tool results and history, on every agent of the tree
+    context_budget.attach(coordinator)
+    # Deadline, retries, hedging and circuit breaker on every agent's model calls
+    agent_resilience.attach(coordinator)
+    # Record / replay of every agent's model calls (CASSETTE_MODE)
+    cassettes.attach(coordinator)
+
+    # The Runner is the engine that executes the agent.
+    # 'app_name' is used to namespace the sessions. Sessions are persistent
+    # and shared by the workers (session_store); artifacts stay in memory.
+    runner = Runner(
+        agent=coordinator,
+        app_name=APP_NAME,
+        session_service=session_store.create_session_service(),
+        artifact_service=InMemoryArtifactService(),
+        memory_service=InMemoryMemoryService(),
+        # Per-agent model / tool metrics (metrics.py, served at /metrics)
+        # Cassettes (record / replay) after telemetry, so replayed calls are measured too
+        plugins=[TelemetryPlugin(), *cassettes.plugins()],
+    )
+    log.info("runner initialized, all agents ready")
+    return runner
+
+
+def get_runner():
+    """Returns the runner, building the agents on first call (thread-safe)."""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                started = time.perf_counter()
+                try:
+                    _runner = _build_runner()
+                except Exception as e:
+                    log.exception("error initializing agents")
+                    _record("agents", started, e)
+                    raise
+                _record("agents", started)
+    return _runner
+
+
+def warm_up():
+    """
+    Builds every lazy component so the first request does not pay for it.
+    Failures are recorded (and reported by readiness()), never raised: a
+    component that failed here is built again on first use.
+    """
+    global _warmup_started_at
+    _warmup_started_at = time.time()
+
+    try:
+        get_runner()
+    except Exception:
+        pass  # logged and recorded by get_runner
+
+    started = time.perf_counter()
+    try:
+        import manual_store_async
+        import manual_store_gcp  # creates the BigQuery / GCS clients
+
+        manual_store_async._get_executor()
+        _record("storage", started)
+    except Exception as e:
+        log.exception("storage warm-up failed")
+        _record("storage", started, e)
+        return
+
+    started = time.perf_counter()
+    try:
+        import manual_index
+
+        manual_index.ensure_ready(manual_store_gcp.load_catalog)
+        _record("search_index", started)
+    except Exception as e:
+        log.exception("search index warm-up failed")
+        _record("search_index", started, e)
+
+
+def is_ready() -> bool:
+    """Ready = agents and storage are built (the search index is optional)."""
+    storage_ready = (
+        _components.get("storage", {}).get("ready") or "manual_store_gcp" in sys.modules
+    )
+    return _runner is not None and bool(storage_ready)
+
+
+def session_stats() -> dict | None:
+    """Hot-session cache stats (None until the runner is built)."""
+    if _runner is None:
+        return None
+    return _runner.session_service.stats()
+
+
+def tool_stats() -> dict | None:
+    """Per-turn tool memo totals (None until the runner is built)."""
+    if _runner is None:
+        return None
+    from agents import tools
+
+    return tools.stats()
+
+
+def context_stats() -> dict | None:
+    """Token counts before / after compaction (None until the runner is built)."""
+    if _runner is None:
+        return None
+    import context_budget
+
+    return context_budget.stats()
+
+
+def cassette_stats() -> dict | None:
+    """Record / replay counts (None until the runner is built, or when off)."""
+    if _runner is None:
+        return None
+    import cassettes
+
+    return cassettes.stats()
+
+
+def readiness() -> dict:
+    return {
+        "ready": is_ready(),
+        "warmup_started_at": _warmup_started_at,
+        "components": dict(_components),
+    }
@@ -0,0 +1,179 @@
+# agent_scheduler.py - Admission control for agent runs (/ask, /ask/stream)
+"""
+Caps how many agent runs execute at once in this worker and queues the rest.
+
+- At most ASK_MAX_CONCURRENT runs execute at the same time.
+- Waiting runs are queued per user and served round-robin, so one user
+  sending a burst cannot starve the others. Each user may have at most
+  ASK_MAX_QUEUE_PER_USER waiting runs, and ASK_MAX_QUEUE in total.
+- Deadline-aware rejection: the expected wait is estimated from the average
+  run time. If it is longer than ASK_MAX_WAIT_SECONDS (or the queue is
+  full), the request is rejected right away with SchedulerBusy, which the
+  endpoints turn into 429 + Retry-After. A request that does wait and hits
+  ASK_MAX_WAIT_SECONDS is rejected the same way.
+- stats() reports queue depth, running runs and wait-time percentiles.
+
+The scheduler runs on the event loop (no locks); each worker has its own.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+from settings import (
+    ASK_MAX_CONCURRENT,
+    ASK_MAX_QUEUE,
+    ASK_MAX_QUEUE_PER_USER,
+    ASK_MAX_WAIT_SECONDS,
+)
+
+
+class SchedulerBusy(Exception):
+    """The run was not admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AgentScheduler:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: int,
+        max_queue_per_user: int,
+        max_wait_seconds: float,
+        initial_run_seconds: float = 10.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait_seconds = max_wait_seconds
+        self._running = 0
+        # user -> waiting futures; the order of the users is the round-robin
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._queued = 0
+        # moving average of how long a run holds its slot
+        self._avg_run_seconds = initial_run_seconds
+        self._waits = deque(maxlen=1000)
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def estimated_wait(self, ahead: int) -> float:
+        """Seconds until a new run would start with `ahead` runs queued before it."""
+        if self._running < self.max_concurrent and not ahead:
+            return 0.0
+        return (ahead + 1) / self.max_concurrent * self._avg_run_seconds
+
+    def _reject(self, reason: str, retry_after: float):
+        self.rejected += 1
+        raise SchedulerBusy(reason, retry_after)
+
+    async def acquire(self, user: str):
+        """Waits for a slot (or raises SchedulerBusy). Pair with release()."""
+        started = time.monotonic()
+        if self._running < self.max_concurrent and not self._queued:
+            self._running += 1
+            self._admit(started)
+            return
+
+        if self._queued >= self.max_queue:
+            self._reject("queue full", self.estimated_wait(self._queued))
+        queue = self._queues.get(user)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            self._reject("too many queued requests for this user", self.estimated_wait(self._queued))
+        estimate = self.estimated_wait(self._queued)
+        if estimate > self.max_wait_seconds:
+            self._reject("expected wait exceeds the deadline", estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(user, deque()).append(future)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait_seconds)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up: pass it on
+                self.release()
+            else:
+                self._forget(user, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timed_out += 1
+                self._reject("deadline exceeded while queued", self.estimated_wait(self._queued))
+            raise
+        self._admit(started)
+
+    def _admit(self, started: float):
+        self.admitted += 1
+        self._waits.append(time.monotonic() - started)
+
+    def _forget(self, user: str, future):
+        queue = self._queues.get(user)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._queues[user]
+
+    def release(self, run_seconds: float | None = None):
+        """Frees a slot and hands it to the next user in round-robin order."""
+        if run_seconds is not None:
+            self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * run_seconds
+        self._running -= 1
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            if future.done():
+                continue  # its request already gave up
+            self._running += 1
+            future.set_result(None)
+            break
+
+    @asynccontextmanager
+    async def slot(self, user: str):
+        await self.acquire(user)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        waits = list(self._waits)
+        return {
+            "running": self._running,
+            "max_concurrent": self.max_concurrent,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "queued_users": len(self._queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_run_seconds": round(self._avg_run_seconds, 3),
+            "wait_seconds": {
+                "avg": round(sum(waits) / len(waits), 4) if waits else 0.0,
+                "p50": round(_percentile(waits, 0.50), 4),
+                "p95": round(_percentile(waits, 0.95), 4),
+                "max": round(max(waits), 4) if waits else 0.0,
+            },
+        }
+
+
+scheduler = AgentScheduler(
+    ASK_MAX_CONCURRENT, ASK_MAX_QUEUE, ASK_MAX_QUEUE_PER_USER, ASK_MAX_WAIT_SECONDS
+)
@@ -0,0 +1,147 @@
+# agent_telemetry.py - ADK plugin that measures every agent's model and tool calls
+"""
+A Runner plugin sees the callbacks of every agent in the tree (coordinator
+and sub-agents), so one object measures all of them:
+
+- model calls: latency and token usage (prompt / output / cached /
+  thoughts) per agent and model, and failed calls;
+- tool calls: duration per agent and tool. Errors count tools that raised
+  and tools that answered with a status other than "ok" / "not_found".
+
+The plugin only observes: every callback returns None, so the agents'
+own callbacks (context_budget) still run and nothing is changed.
+"""
+import time
+from collections import OrderedDict
+
+from google.adk.plugins.base_plugin import BasePlugin
+
+import metrics
+from log_config import get_logger
+
+log = get_logger("agent_telemetry")
+
+# Tool results that are answers, not failures
+_OK_STATUSES = {None, "ok", "not_found"}
+# Calls in flight remembered at most (a cancelled run never ends its calls)
+_MAX_IN_FLIGHT = 1024
+
+
+def _remember(calls: OrderedDict, key, value):
+    calls[key] = value
+    while len(calls) > _MAX_IN_FLIGHT:
+        calls.popitem(last=False)
+
+
+def _model_name(callback_context, llm_request=None) -> str:
+    model = getattr(llm_request, "model", None)
+    if model:
+        return model
+    agent = getattr(callback_context, "_invocation_context", None)
+    agent = getattr(agent, "agent", None)
+    model = getattr(agent, "model", None)
+    return model if isinstance(model, str) else getattr(model, "model", "") or ""
+
+
+class TelemetryPlugin(BasePlugin):
+    def __init__(self):
+        super().__init__(name="telemetry")
+        # (invocation id, agent) -> (started, model) of the model call in flight
+        self._model_calls = OrderedDict()
+        # function call id -> started
+        self._tool_calls = OrderedDict()
+
+    # -- model calls --------------------------------------------------
+
+    async def before_model_callback(self, *, callback_context, llm_request):
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        _remember(
+            self._model_calls, key, (time.perf_counter(), _model_name(callback_context, llm_request))
+        )
+        return None
+
+    async def after_model_callback(self, *, callback_context, llm_response):
+        if llm_response.partial:
+            return None  # streamed chunk: the call ends with the final response
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        started, model = self._model_calls.pop(key, (None, ""))
+        agent = callback_context.agent_name
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            metrics.model_duration.observe(elapsed, agent=agent, model=model)
+        else:
+            elapsed = None
+
+        usage = llm_response.usage_metadata
+        tokens = {}
+        if usage is not None:
+            tokens = {
+                "prompt": usage.prompt_token_count or 0,
+                "output": usage.candidates_token_count or 0,
+                "cached": usage.cached_content_token_count or 0,
+                "thoughts": usage.thoughts_token_count or 0,
+            }
+            for kind, count in tokens.items():
+                if count:
+                    metrics.model_tokens.inc(count, agent=agent, model=model, kind=kind)
+        if llm_response.error_code:
+            metrics.model_errors.inc(agent=agent, model=model)
+        log.debug(
+            "model call",
+            extra={
+                "agent": agent,
+                "model": model,
+                "seconds": round(elapsed, 3) if elapsed is not None else None,
+                **{f"{k}_tokens": v for k, v in tokens.items()},
+            },
+        )
+        return None
+
+    async def on_model_error_callback(self, *, callback_context, llm_request, error):
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        started, model = self._model_calls.pop(key, (None, _model_name(callback_context, llm_request)))
+        agent = callback_context.agent_name
+        if started is not None:
+            metrics.model_duration.observe(time.perf_counter() - started, agent=agent, model=model)
+        metrics.model_errors.inc(agent=agent, model=model)
+        log.warning("model call failed", extra={"agent": agent, "model": model, "error": repr(error)})
+        return None
+
+    # -- tool calls ---------------------------------------------------
+
+    async def before_tool_callback(self, *, tool, tool_args, tool_context):
+        _remember(self._tool_calls, tool_context.function_call_id, time.perf_counter())
+        return None
+
+    def _end_tool(self, tool, tool_context, failed: bool) -> float | None:
+        started = self._tool_calls.pop(tool_context.function_call_id, None)
+        labels = {"agent": tool_context.agent_name, "tool": tool.name}
+        elapsed = None
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            metrics.tool_duration.observe(elapsed, **labels)
+        if failed:
+            metrics.tool_errors.inc(**labels)
+        return elapsed
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context, result):
+        status = result.get("status") if isinstance(result, dict) else None
+        elapsed = self._end_tool(tool, tool_context, failed=status not in _OK_STATUSES)
+        log.debug(
+            "tool call",
+            extra={
+                "agent": tool_context.agent_name,
+                "tool": tool.name,
+                "status": status,
+                "seconds": round(elapsed, 3) if elapsed is not None else None,
+            },
+        )
+        return None
+
+    async def on_tool_error_callback(self, *, tool, tool_args, tool_context, error):
+        self._end_tool(tool, tool_context, failed=True)
+        log.warning(
+            "tool call failed",
+            extra={"agent": tool_context.agent_name, "tool": tool.name, "error": repr(error)},
+        )
+        return None
@@ -1,25 +1,89 @@
-# agents/generator_agent.py
-from google.adk.agents import LlmAgent
-from google.adk.models.google_llm import Gemini
-from google.genai import types
-
-
-def create_generator_agent(retry: types.HttpRetryOptions) -> LlmAgent:
-### Operational Checklist
-- ...
-
-### Suggested Communication Message
-...
-
-Don't invent steps that don't appear in the source content if
-the request is only to summarize or simplify.
-"""
-
-    agent = LlmAgent(
-        model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry),
-        name="generator_agent",
-        description="Agent that summarizes, simplifies, and generates checklists from manuals.",
-        instruction=instruction,
-    )
-
-    return agent
+# agents/generator_agent.py
+from google.adk.agents import LlmAgent
+from google.adk.models.google_llm import Gemini
+from google.genai import types
+from typing import Dict, Any
+import logging
+
+import manual_store_async
+
+log = logging.getLogger("agents.generator_agent")
+
+
+async def get_manual_artifacts_tool(manual_id: str) -> Dict[str, Any]:
+    """
+    Returns the stored summary, operational checklist and communication
+    message of a manual's latest version. They are generated once, when the
+    manual is saved; if they don't exist yet they are generated now. Right
+    after a save they may still be in progress (status "pending").
+
+    Args:
+        manual_id: Manual ID, for example "MAN-1a2b3c4d".
+
+    Returns:
+        {
+          "status": "ok",
+          "manual_id": "...",
+          "version": 3,
+          "summary": "...",
+          "checklist": "- [ ] ...",
+          "message": "...",
+          "source": "stored" | "live"
+        }
+        or
+        {
+          "status": "pending" | "not_found",
+          "manual_id": "MAN-xxxx"
+        }
+    """
+    derived = await manual_store_async.get_derivations(manual_id)
+    if derived is None:
+        log.info("manual not found", extra={"manual_id": manual_id})
+        return {"status": "not_found", "manual_id": manual_id}
+    if derived["source"] == "pending":
+        log.info("manual artifacts pending", extra={"manual_id": manual_id})
+        return {"status": "pending", "manual_id": manual_id}
+
+    log.info("manual artifacts", extra={"manual_id": manual_id, "source": derived["source"]})
+    return {
+        "status": "ok",
+        "manual_id": manual_id,
+        "version": derived.get("version"),
+        "summary": derived.get("summary"),
+        "checklist": derived.get("checklist"),
+        "message": derived.get("message"),
+        "source": derived["source"],
+    }
+
+
+# Added to the instruction: stored artifacts first, live generation otherwise
+STORED_ARTIFACTS_INSTRUCTION = """
+
+When the request is the summary, checklist or communication message of a
+saved manual and you know its manual_id, call `get_manual_artifacts_tool`
+first and use what it returns (you may shorten or translate it). Only write
+them yourself when the tool returns not_found or pending, or the user asks
+for something different (another format, audience or a rewrite).
+"""
+
+
+def create_generator_agent(retry: types.HttpRetryOptions) -> LlmAgent:
+### Operational Checklist
+- ...
+
+### Suggested Communication Message
+...
+
+Don't invent steps that don't appear in the source content if
+the request is only to summarize or simplify.
+"""
+
+    agent = LlmAgent(
+        model=Gemini(model="gemini-2.5-flash-lite", retry_options=retry),
+        name="generator_agent",
+        description="Agent that summarizes, simplifies, and generates checklists from manuals.",
+        instruction=instruction + STORED_ARTIFACTS_INSTRUCTION,
+        tools=[get_manual_artifacts_tool],
+    )
+
+    return agent
@@ -1,71 +1,60 @@
-# agents/search_agent.py
-from typing import Dict, Any
-from google.adk.agents import LlmAgent
-from google.genai import types
-
-from manual_store_gcp import search_manuals, get_manual
-
-
-def search_manuals_tool(text_query: str, limit: int = 10) -> Dict[str, Any]:
-    """
-    Searches for manuals by text using the dictionary table (BigQuery).
-
-    Args:
-        text_query: Free text, for example "load data cube python".
-        limit: Maximum results to return (currently ignored, lets
-               search_manuals apply its own internal limit).
-    """
-    # If empty, send empty string to get "most recent"
-    results = search_manuals(text_query or "")
-
-    print("\n[SEARCH_AGENT] Manual search:")
-    print(f"  query: {text_query}")
-    print(f"  found: {len(results)}")
-    for r in results:
-        print(f"   - {r['manual_id']} | {r['title']} | {r.get('business_area', '-')}")
-    print("-------------------------------------------------\n")
-
-    return {
-        "status": "ok",
-        "results": results,
-    }
-
-
-def get_manual_tool(manual_id: str) -> Dict[str, Any]:
-    """
-    Returns the complete detail of a manual (metadata + steps + files).
-
-    Args:
-        manual_id: Manual ID, for example "MAN-1a2b3c4d".
-
-    Returns:
-        {
-          "status": "ok",
-          "manual": {...}
-        }
-        or
-        {
-          "status": "not_found",
-          "manual_id": "MAN-xxxx"
-        }
-    """
-    manual = get_manual(manual_id)
-    if not manual:
-        print(f"[SEARCH_AGENT] Manual not found: {manual_id}")
-        return {
-            "status": "not_found",
-            "manual_id": manual_id,
-        }
-
-    print(f"\n[SEARCH_AGENT] Manual found: {manual_id} - {manual.get('title')}")
-    print(f"  Area: {manual.get('business_area')}")
-    print(f"  Steps: {len(manual.get('steps', []))}")
-    print("-------------------------------------------------\n")
-
-    return {
-        "status": "ok",
-        "manual": manual,
-    }
-
-    )
-    return agent
+# agents/search_agent.py
+from typing import Dict, Any
+import logging
+from google.adk.agents import LlmAgent
+from google.genai import types
+
+import manual_store_async
+import manual_vectors
+from agents.tools import get_manual_tool, search_manuals_tool
+
+log = logging.getLogger("agents.search_agent")
+
+
+async def semantic_search_tool(text_query: str, limit: int = 5) -> Dict[str, Any]:
+    """
+    Semantic search: finds the manuals and individual steps whose meaning is
+    closest to the question, even if they don't share the exact words.
+    Use it when search_manuals_tool finds nothing or the question is loose,
+    for example "how do I give a new hire access to the systems".
+
+    Args:
+        text_query: Natural language question or description.
+        limit: Maximum results to return.
+
+    Returns:
+        {
+          "status": "ok",
+          "results": [
+            {"manual_id", "title", "kind": "manual" | "step",
+             "step_number", "step_title", "score"}
+          ]
+        }
+    """
+    # Lazy: importing the store creates the BigQuery / GCS clients
+    from manual_store_gcp import load_catalog
+
+    results = (
+        await manual_store_async.run_blocking(
+            manual_vectors.semantic_search,
+            [text_query or ""],
+            load_catalog,
+            k=max(1, min(limit, 50)),
+        )
+    )[0]
+
+    log.info("semantic search", extra={"query": text_query, "found": len(results)})
+    for r in results:
+        log.debug(
+            "semantic search result",
+            extra={"manual_id": r["manual_id"], "kind": r["kind"], "score": r["score"]},
+        )
+
+    return {
+        "status": "ok",
+        "results": results,
+    }
+
+    )
+    agent.tools.append(semantic_search_tool)
+    return agent
@@ -0,0 +1,327 @@
+# agents/tools.py - Manual tools shared by the agents (search, fetch, save)
+"""
+One implementation of the manual tools, used by every agent that needs them
+(manual_agent, data_agent, search_agent), instead of a copy per agent.
+
+Within one turn (one runner invocation, across agent transfers) the
+coordinator's sub-agents often repeat the same search or fetch. Calls are
+memoized per turn, keyed by the ADK invocation id from `tool_context`:
+
+- Identical search_manuals / get_manual calls in one turn hit storage once;
+  a call issued while the same one is still running waits for it
+  (singleflight) instead of running again.
+- save_manual_tool forgets what the turn has read, so a fetch after a save
+  sees the new version (the record returned by the store, no read-back).
+- Each turn counts its tool calls, storage calls and deduplicated calls;
+  main.py collects them with finish_turn() when the run ends, and stats()
+  reports the totals for /health.
+
+Without a tool_context (a tool called directly) nothing is memoized.
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from google.adk.tools.tool_context import ToolContext
+
+import context_budget
+import manual_store_async
+
+log = logging.getLogger("agents.tools")
+
+# Turns kept in memory if a run ends without finish_turn (crash, client gone)
+_MAX_OPEN_TURNS = 256
+
+
+class ToolTurn:
+    """Memo, in-flight calls and counters of one turn."""
+
+    def __init__(self):
+        self.results: Dict[tuple, asyncio.Future] = {}
+        self.calls: Dict[str, int] = {}
+        self.storage_calls = 0
+        self.deduped = 0
+
+    def summary(self) -> dict:
+        return {
+            "calls": sum(self.calls.values()),
+            "storage_calls": self.storage_calls,
+            "deduped": self.deduped,
+            "by_tool": dict(self.calls),
+        }
+
+
+_turns: "OrderedDict[str, ToolTurn]" = OrderedDict()
+_lock = threading.Lock()
+_totals = {"turns": 0, "calls": 0, "storage_calls": 0, "deduped": 0}
+
+
+def _turn(tool_context: Optional[ToolContext]) -> Optional[ToolTurn]:
+    invocation_id = getattr(tool_context, "invocation_id", None)
+    if not invocation_id:
+        return None
+    with _lock:
+        turn = _turns.get(invocation_id)
+        if turn is None:
+            turn = _turns[invocation_id] = ToolTurn()
+            while len(_turns) > _MAX_OPEN_TURNS:
+                _turns.popitem(last=False)
+        return turn
+
+
+def finish_turn(invocation_id: Optional[str]) -> dict:
+    """Drops the memo of a finished turn and returns its tool counts."""
+    with _lock:
+        turn = _turns.pop(invocation_id, None) if invocation_id else None
+        if turn is None:
+            return ToolTurn().summary()
+        summary = turn.summary()
+        _totals["turns"] += 1
+        for name in ("calls", "storage_calls", "deduped"):
+            _totals[name] += summary[name]
+        return summary
+
+
+def stats() -> dict:
+    with _lock:
+        turns = _totals["turns"]
+        return {
+            **_totals,
+            "open_turns": len(_turns),
+            "dedup_rate": round(_totals["deduped"] / _totals["calls"], 4)
+            if _totals["calls"]
+            else 0.0,
+            "avg_calls_per_turn": round(_totals["calls"] / turns, 2) if turns else 0.0,
+        }
+
+
+async def _shared(turn: Optional[ToolTurn], tool: str, key: tuple, load):
+    """
+    Result of `load()` for `key`, run at most once per turn. Failures are not
+    remembered, so a later call in the turn tries again.
+    """
+    if turn is None:
+        return await load()
+
+    turn.calls[tool] = turn.calls.get(tool, 0) + 1
+    future = turn.results.get(key)
+    if future is not None:
+        turn.deduped += 1
+        return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    turn.results[key] = future
+    turn.storage_calls += 1
+    try:
+        result = await load()
+    except BaseException as e:
+        turn.results.pop(key, None)
+        if not isinstance(e, Exception):
+            future.cancel()
+        else:
+            future.set_exception(e)
+            future.exception()  # retrieved: no "never retrieved" warning if nobody waits
+        raise
+    future.set_result(result)
+    return result
+
+
+def _agent_name(tool_context: Optional[ToolContext]) -> str:
+    return getattr(tool_context, "agent_name", None) or "tools"
+
+
+def normalize_manual(manual: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Normalizes a manual built by the LLM to the format expected by
+    manual_store_gcp (keywords as a list, step field names and types).
+    """
+    # Normalize keywords
+    keywords = manual.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = [k.strip() for k in keywords.split(",") if k.strip()]
+    manual["keywords"] = keywords
+
+    # Normalize steps to the format expected by manual_store_gcp
+    normalized_steps = []
+    for idx, step in enumerate(manual.get("steps", []), start=1):
+        normalized_steps.append(
+            {
+                "step_number": step.get("step_number", idx),
+                "step_title": step.get("step_title") or step.get("title") or "",
+                "step_description": step.get("step_description") or step.get("description") or "",
+                "expected_output": step.get("expected_output") or "",
+                "required_tools": step.get("required_tools") or "",
+                # accept both "estimated_time" and "estimated_time_minutes"
+                "estimated_time": step.get("estimated_time")
+                                 or step.get("estimated_time_minutes")
+                                 or "",
+                "is_critical": bool(step.get("is_critical")),
+            }
+        )
+    manual["steps"] = normalized_steps
+    return manual
+
+
+async def search_manuals_tool(
+    text_query: str, limit: int = 10, tool_context: ToolContext = None
+) -> Dict[str, Any]:
+    """
+    Searches for manuals by text using the dictionary table (BigQuery).
+    Returns at most 'limit' manuals (the store caps it at 500).
+
+    Args:
+        text_query: Free text, for example "load data cube python".
+        limit: Maximum results to return.
+    """
+    turn = _turn(tool_context)
+    # If empty, send empty string to get "most recent"
+    query = text_query or ""
+    results = await _shared(
+        turn,
+        "search_manuals_tool",
+        ("search", query.strip(), limit),
+        lambda: manual_store_async.search_manuals(query, limit=limit),
+    )
+
+    agent = _agent_name(tool_context)
+    log.info("manual search", extra={"agent": agent, "query": text_query, "found": len(results)})
+    for r in results:
+        log.debug(
+            "manual search result",
+            extra={"agent": agent, "manual_id": r["manual_id"], "title": r["title"]},
+        )
+
+    return {
+        "status": "ok",
+        "results": results,
+    }
+
+
+async def get_manual_tool(manual_id: str, tool_context: ToolContext = None) -> Dict[str, Any]:
+    """
+    Returns the complete detail of a manual (metadata + steps + files).
+
+    Args:
+        manual_id: Manual ID, for example "MAN-1a2b3c4d".
+
+    Returns:
+        {
+          "status": "ok",
+          "manual": {...}
+        }
+        or
+        {
+          "status": "not_found",
+          "manual_id": "MAN-xxxx"
+        }
+    """
+    turn = _turn(tool_context)
+    manual = await _shared(
+        turn,
+        "get_manual_tool",
+        ("manual", manual_id),
+        lambda: manual_store_async.get_manual(manual_id),
+    )
+
+    agent = _agent_name(tool_context)
+    if not manual:
+        log.info("manual not found", extra={"agent": agent, "manual_id": manual_id})
+        return {
+            "status": "not_found",
+            "manual_id": manual_id,
+        }
+
+    log.info(
+        "manual found",
+        extra={
+            "agent": agent,
+            "manual_id": manual_id,
+            "title": manual.get("title"),
+            "steps": len(manual.get("steps", [])),
+        },
+    )
+
+    return {
+        "status": "ok",
+        "manual": manual,
+    }
+
+
+async def save_manual_tool(
+    manual: Dict[str, Any], tool_context: ToolContext = None
+) -> Dict[str, Any]:
+    """
+    Saves or updates a manual in the configured storage (GCP).
+
+    - Accepts incomplete manuals (fields may be missing).
+    - Normalizes the step structure to the format expected by manual_store_gcp.
+    - Idempotent: saving the same content again shortly after is a no-op
+      that returns the same manual_id.
+    - Rejects a manual copied from a shortened tool result (steps or texts
+      cut to fit the model context), which would overwrite the stored one
+      with less content.
+    """
+    agent = _agent_name(tool_context)
+    log.debug("save_manual_tool called", extra={"agent": agent, "title": manual.get("title")})
+
+    if context_budget.is_truncated(manual):
+        log.warning(
+            "truncated manual not saved",
+            extra={"agent": agent, "manual_id": manual.get("manual_id")},
+        )
+        return {
+            "status": "error",
+            "error": (
+                "The manual contains parts shortened to fit the context "
+                "('truncated', '..._omitted' or '... [N more characters]'). "
+                "Saving it would lose steps or text. Send the complete "
+                "manual, without those marks."
+            ),
+        }
+
+    turn = _turn(tool_context)
+    saved = await manual_store_async.save_manual(normalize_manual(manual))
+    manual_id = saved.get("manual_id")
+    # The store returns the record as written: no read-back
+    stored = saved["manual"]
+
+    if turn is not None:
+        turn.calls["save_manual_tool"] = turn.calls.get("save_manual_tool", 0) + 1
+        if saved.get("deduplicated"):
+            turn.deduped += 1
+        else:
+            turn.storage_calls += 1
+        # What the turn read before the save is stale now; a fetch of the
+        # saved manual gets the stored record
+        turn.results.clear()
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(stored)
+        turn.results[("manual", manual_id)] = future
+
+    log.info(
+        "manual saved",
+        extra={
+            "agent": agent,
+            "manual_id": manual_id,
+            "version": saved.get("version"),
+            "title": stored.get("title"),
+            "steps": len(stored.get("steps", [])),
+            "deduplicated": bool(saved.get("deduplicated")),
+        },
+    )
+
+    file_path = None
+    files = stored.get("files", [])
+    if files:
+        file_path = files[0].get("file_path")
+
+    return {
+        "status": "ok",
+        "manual_id": manual_id,
+        "title": stored.get("title"),
+        "file_path": file_path,
+        "steps_count": len(stored.get("steps", [])),
+        "version": saved.get("version"),
+    }
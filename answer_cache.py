@@ -0,0 +1,179 @@
+# answer_cache.py - Cache of complete /ask answers for repeated questions
+"""
+Many questions repeat ("list the onboarding manuals", "summarize manual X").
+A cached answer skips the whole coordinator -> sub-agent -> Gemini chain.
+
+- Key: the normalized question (accent-folded, lower-case, punctuation and
+  extra spaces removed). Only the first turn of a conversation is cached or
+  served: later turns depend on the conversation so far.
+- Each entry records the route (agents that ran) and the manuals it read,
+  with their manual_cache generation at read time; search tools depend on
+  the whole catalog. save_manual bumps those generations, so an entry is
+  dropped as soon as one of its manuals (or, for searches, any manual) changes.
+  Generations are taken when the tool is called, before it reads: a run
+  during which a manual was saved is not cached, as its answer may come
+  from the data before the save.
+- Runs that call a tool not known to be read-only (save_manual_tool, ...)
+  or go through a writing agent (manual_agent, data_agent) are never cached.
+- stats() reports hit rate and the agent time saved by hits.
+"""
+import re
+import threading
+
+import manual_cache
+from manual_index import fold
+from settings import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS
+
+# Tools that only read; any other tool call makes the run uncacheable
+READ_ONLY_TOOLS = {
+    "search_manuals_tool",
+    "get_manual_tool",
+    "semantic_search_tool",
+    "get_manual_artifacts_tool",
+    "transfer_to_agent",
+}
+# Tools whose result depends on the whole catalog
+CATALOG_TOOLS = {"search_manuals_tool", "semantic_search_tool"}
+# Agents whose answers may be reused (the others write or run interviews)
+CACHEABLE_AGENTS = {"coordinator", "search_agent", "generator_agent"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(question: str) -> str:
+    return " ".join(_TOKEN_RE.findall(fold(question)))
+
+
+def _manual_ids(value, found: set):
+    """Collects every "manual_id" found in a tool call / result payload."""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k == "manual_id" and isinstance(v, str) and v:
+                found.add(v)
+            else:
+                _manual_ids(v, found)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _manual_ids(v, found)
+
+
+class RunRecorder:
+    """Watches the events of one run to decide if (and how) it can be cached."""
+
+    def __init__(self):
+        self.route = []
+        self.deps = {}  # manual_id | CATALOG -> generation when it was read
+        self.cacheable = True
+        self.reason = None
+        # function call id -> CATALOG generation when the call was issued
+        self._catalog_at_call = {}
+
+    def _depend(self, name: str, gen: int | None = None):
+        if gen is None:
+            gen = manual_cache.generation(name)
+        self.deps[name] = min(self.deps.get(name, gen), gen)
+
+    def _refuse(self, reason: str):
+        if self.cacheable:
+            self.cacheable, self.reason = False, reason
+
+    def observe(self, event):
+        author = event.author
+        if author and author != "user":
+            if not self.route or self.route[-1] != author:
+                self.route.append(author)
+            if author not in CACHEABLE_AGENTS:
+                self._refuse(f"agent {author}")
+
+        for call in event.get_function_calls():
+            if call.name not in READ_ONLY_TOOLS:
+                self._refuse(f"tool {call.name}")
+            if not self.cacheable:
+                continue
+            # The call event is observed before the tool runs, so this is the
+            # generation before its read; every save bumps CATALOG
+            before = manual_cache.generation(manual_cache.CATALOG)
+            self._catalog_at_call[call.id] = before
+            if call.name in CATALOG_TOOLS:
+                self._depend(manual_cache.CATALOG, before)
+        for response in event.get_function_responses():
+            if not self.cacheable:
+                continue
+            ids = set()
+            _manual_ids(response.response, ids)
+            if not ids:
+                continue
+            before = self._catalog_at_call.get(response.id)
+            if before is None or manual_cache.generation(manual_cache.CATALOG) != before:
+                # A save landed while the tool ran: the result may predate it
+                self._refuse("manual saved during the run")
+                continue
+            for manual_id in ids:
+                self._depend(manual_id)
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self._entries = manual_cache.TTLCache(max_entries, ttl_seconds)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stores = 0
+        self.uncacheable = 0
+        self.saved_seconds = 0.0
+
+    def get(self, question: str) -> dict | None:
+        """Cached entry {answer, route, deps, elapsed} if all its manuals are unchanged."""
+        key = normalize(question)
+        found, entry = self._entries.get(key) if key else (False, None)
+        if found and any(
+            manual_cache.generation(name) != gen for name, gen in entry["deps"].items()
+        ):
+            self._entries.delete(key)
+            found = False
+            with self._lock:
+                self.stale += 1
+        with self._lock:
+            if not found:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry["elapsed"]
+        return entry
+
+    def put(self, question: str, recorder: RunRecorder, answer: str, elapsed: float) -> bool:
+        key = normalize(question)
+        if not key or not recorder.cacheable:
+            with self._lock:
+                self.uncacheable += 1
+            return False
+        self._entries.set(
+            key,
+            {
+                "answer": answer,
+                "route": list(recorder.route),
+                "deps": dict(recorder.deps),
+                "elapsed": elapsed,
+            },
+        )
+        with self._lock:
+            self.stores += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": self._entries.stats()["entries"],
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "stores": self.stores,
+                "uncacheable": self.uncacheable,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "latency_saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS)
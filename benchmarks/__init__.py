@@ -0,0 +1 @@
+# benchmarks - Offline load tests of the server (python -m benchmarks.run)
@@ -0,0 +1,580 @@
+# benchmarks/fakes.py - In-process stand-ins for Gemini, BigQuery and GCS
+"""
+The benchmark runs the real server code (main, the agents, ADK, the store)
+against these fakes, so what it measures is the server's own overhead plus
+the latencies configured here. No network call is made.
+
+- FakeGenai replaces google.genai.Client: ADK's Gemini model of every agent,
+  manual_derivations and the Gemini embedder all get it. Its answers follow
+  a fixed agent policy (FakeGenai.plan): the coordinator transfers to a
+  sub-agent chosen by keywords, the sub-agent calls one of its tools, and
+  it answers with text once it has the tool result. The same question
+  always gives the same call graph.
+- FakeBigQuery replaces `bq_client` in manual_store_gcp. It keeps the
+  tables in memory and answers the queries the store issues (latest
+  version per manual, nested manual query, keyset page, catalog export).
+- FakeBucket replaces `bucket`: blobs in a dict.
+
+Each fake sleeps for a Latency (mean ± uniform jitter) per call: the model
+asynchronously, the storage clients blocking, as the real clients do.
+install() swaps them in; it must run before the runner is built.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+# Agent the coordinator hands a question to, by keyword (first match wins)
+DEFAULT_ROUTES = (
+    (r"\b(save|store|guarda\w*|persist)\b", "data_agent"),
+    (r"\b(create|write|draft|crea\w*|escrib\w*|document)\b", "manual_agent"),
+    (r"\b(summar\w*|checklist|resum\w*|message)\b", "generator_agent"),
+    (r".", "search_agent"),
+)
+# Tools a sub-agent prefers, in order; the first whose arguments can be
+# built from the question is called
+_TOOL_PREFERENCE = (
+    "get_manual_artifacts_tool",
+    "get_manual_tool",
+    "save_manual_tool",
+    "search_manuals_tool",
+    "semantic_search_tool",
+)
+_MANUAL_ID_RE = re.compile(r"\bMAN-[0-9a-fA-F]{6,}\b")
+_SAVE_RE = re.compile(DEFAULT_ROUTES[0][0], re.IGNORECASE)
+_WORD_RE = re.compile(r"[a-záéíóúñ0-9]{4,}", re.IGNORECASE)
+_STOP_WORDS = {"which", "what", "manual", "manuals", "explains", "about", "there", "have", "with", "from", "team"}
+
+
+class Latency:
+    """`mean_ms` ± `jitter_ms` (uniform), seeded for repeatable runs."""
+
+    def __init__(self, mean_ms: float = 0.0, jitter_ms: float = 0.0, seed: int | None = None):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Seconds."""
+        if self.mean_ms <= 0 and self.jitter_ms <= 0:
+            return 0.0
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.mean_ms + jitter) / 1000
+
+    def sleep(self):
+        seconds = self.sample()
+        if seconds:
+            time.sleep(seconds)
+
+    async def asleep(self):
+        seconds = self.sample()
+        if seconds:
+            await asyncio.sleep(seconds)
+
+
+class _Calls:
+    """Thread-safe call counters of a fake."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+# ------------------------------------------------------------
+# Gemini
+# ------------------------------------------------------------
+
+def _agent_name(config) -> str:
+    instruction = getattr(config, "system_instruction", None) or ""
+    if not isinstance(instruction, str):
+        parts = getattr(instruction, "parts", None) or []
+        instruction = " ".join(p.text or "" for p in parts)
+    match = re.search(r'internal name is "([^"]+)"', instruction)
+    return match.group(1) if match else ""
+
+
+def _tool_names(config) -> list:
+    names = []
+    for tool in getattr(config, "tools", None) or []:
+        for declaration in getattr(tool, "function_declarations", None) or []:
+            names.append(declaration.name)
+    return names
+
+
+def _question(contents) -> str:
+    """The last message the user typed (ADK's "For context:" notes skipped)."""
+    for content in reversed(contents or []):
+        if content.role != "user":
+            continue
+        texts = [p.text for p in content.parts or [] if p.text]
+        if texts and texts[0] != "For context:":
+            return " ".join(texts)
+    return ""
+
+
+def _text_tokens(contents) -> int:
+    chars = 0
+    for content in contents or []:
+        for part in content.parts or []:
+            chars += len(part.text or "")
+            if part.function_response is not None:
+                chars += len(str(part.function_response.response))
+    return chars // 4 + 1
+
+
+class FakeGenai:
+    """
+    google.genai.Client stand-in. `latency` is the time to the (first)
+    response; streamed answers add `chunk_latency` per further chunk.
+    """
+
+    vertexai = False
+
+    def __init__(
+        self,
+        latency: Latency | None = None,
+        chunk_latency: Latency | None = None,
+        root_agent: str = "coordinator",
+        routes=DEFAULT_ROUTES,
+    ):
+        self.latency = latency or Latency()
+        self.chunk_latency = chunk_latency or Latency()
+        self.root_agent = root_agent
+        self.routes = [(re.compile(p, re.IGNORECASE), agent) for p, agent in routes]
+        self.calls = _Calls()
+        self.models = _Models(self)
+        self.aio = SimpleNamespace(models=_AsyncModels(self))
+
+    def __call__(self, *args, **kwargs):
+        """Used as the Client class: every "new client" is this fake."""
+        return self
+
+    # -- policy -------------------------------------------------------
+
+    def plan(self, contents, config) -> list:
+        """The parts the model answers with for this request."""
+        from google.genai import types
+
+        if getattr(config, "response_mime_type", None) == "application/json":
+            return [types.Part(text=json.dumps(self._derivations(_question(contents))))]
+
+        agent = _agent_name(config)
+        tools = _tool_names(config)
+        question = _question(contents)
+        last = contents[-1] if contents else None
+        results = [p.function_response for p in (last.parts or []) if p.function_response] if last else []
+        if results:
+            return [types.Part(text=self._answer(agent, question, results))]
+
+        if agent == self.root_agent and "transfer_to_agent" in tools:
+            target = next((a for pattern, a in self.routes if pattern.search(question)), None)
+            if target and target != agent:
+                return [self._call("transfer_to_agent", {"agent_name": target})]
+
+        for name in _TOOL_PREFERENCE:
+            if name in tools:
+                args = self._tool_args(name, question)
+                if args is not None:
+                    return [self._call(name, args)]
+        return [types.Part(text=f"{agent or 'agent'}: {question}")]
+
+    @staticmethod
+    def _call(name: str, args: dict):
+        from google.genai import types
+
+        return types.Part(function_call=types.FunctionCall(name=name, args=args))
+
+    @staticmethod
+    def _tool_args(name: str, question: str) -> dict | None:
+        words = [w for w in _WORD_RE.findall(question.lower()) if w not in _STOP_WORDS]
+        manual_id = _MANUAL_ID_RE.search(question)
+        if name in ("search_manuals_tool", "semantic_search_tool"):
+            return {"text_query": " ".join(words[:3]), "limit": 5}
+        if name in ("get_manual_tool", "get_manual_artifacts_tool"):
+            return {"manual_id": manual_id.group(0)} if manual_id else None
+        if name == "save_manual_tool" and _SAVE_RE.search(question):
+            title = " ".join(words[:6]).capitalize() or "Benchmark manual"
+            return {"manual": benchmark_manual(title, question)}
+        return None
+
+    @staticmethod
+    def _answer(agent: str, question: str, results) -> str:
+        lines = [f"{agent}: answer to \"{question}\""]
+        for result in results:
+            response = result.response or {}
+            found = response.get("results") if isinstance(response, dict) else None
+            if isinstance(found, list):
+                lines += [f"- {r.get('title')} ({r.get('manual_id')})" for r in found if isinstance(r, dict)]
+            else:
+                lines.append(f"- {result.name}: {response.get('status', 'done')}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _derivations(text: str) -> dict:
+        return {
+            "summary": f"Summary: {text[:200]}",
+            "checklist": "- [ ] Prepare\n- [ ] Execute\n- [ ] Verify",
+            "message": "The manual was updated.",
+        }
+
+    def response(self, contents, config, parts=None):
+        from google.genai import types
+
+        parts = parts if parts is not None else self.plan(contents, config)
+        output = sum(len(p.text or "") for p in parts) // 4 + 1
+        prompt = _text_tokens(contents)
+        return types.GenerateContentResponse(
+            candidates=[
+                types.Candidate(
+                    content=types.Content(role="model", parts=parts),
+                    finish_reason=types.FinishReason.STOP,
+                )
+            ],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt,
+                candidates_token_count=output,
+                total_token_count=prompt + output,
+            ),
+        )
+
+    def chunks(self, contents, config) -> list:
+        """A streamed answer: text in three chunks, the last one with usage."""
+        from google.genai import types
+
+        parts = self.plan(contents, config)
+        text = parts[0].text if len(parts) == 1 and parts[0].text else None
+        if text is None or len(text) < 3:
+            return [self.response(contents, config, parts)]
+        size = len(text) // 3 + 1
+        pieces = [text[i : i + size] for i in range(0, len(text), size)]
+        chunks = [
+            types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=p)]))]
+            )
+            for p in pieces[:-1]
+        ]
+        chunks.append(self.response(contents, config, [types.Part(text=pieces[-1])]))
+        return chunks
+
+    def embeddings(self, contents, config):
+        dim = getattr(config, "output_dimensionality", None) or 768
+        texts = [contents] if isinstance(contents, str) else list(contents)
+        values = []
+        for text in texts:
+            rng = random.Random(str(text))
+            values.append(SimpleNamespace(values=[rng.uniform(-1, 1) for _ in range(dim)]))
+        return SimpleNamespace(embeddings=values)
+
+
+class _Models:
+    def __init__(self, fake: FakeGenai):
+        self._fake = fake
+
+    def generate_content(self, *, model, contents, config=None):
+        self._fake.calls.add("generate_content")
+        self._fake.latency.sleep()
+        if isinstance(contents, str):
+            from google.genai import types
+
+            contents = [types.Content(role="user", parts=[types.Part(text=contents)])]
+        return self._fake.response(contents, config)
+
+    def embed_content(self, *, model, contents, config=None):
+        self._fake.calls.add("embed_content")
+        self._fake.latency.sleep()
+        return self._fake.embeddings(contents, config)
+
+
+class _AsyncModels:
+    def __init__(self, fake: FakeGenai):
+        self._fake = fake
+
+    async def generate_content(self, *, model, contents, config=None):
+        self._fake.calls.add("generate_content")
+        await self._fake.latency.asleep()
+        return self._fake.response(contents, config)
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        self._fake.calls.add("generate_content_stream")
+        chunks = self._fake.chunks(contents, config)
+
+        async def stream():
+            await self._fake.latency.asleep()
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await self._fake.chunk_latency.asleep()
+                yield chunk
+
+        return stream()
+
+
+def benchmark_manual(title: str, context: str = "", steps: int = 5) -> dict:
+    """A manual in the shape save_manual_tool / save_manual accept."""
+    return {
+        "title": title,
+        "business_area": "Operations",
+        "requester": "benchmark",
+        "context": context or f"How to {title.lower()}.",
+        "requirements": "Access to the internal systems.",
+        "permissions": "Operator",
+        "outputs": "A completed procedure.",
+        "keywords": [w for w in title.lower().split()[:4]],
+        "steps": [
+            {
+                "step_number": n,
+                "step_title": f"{title} - step {n}",
+                "step_description": f"Do part {n} of {title.lower()} and check the result.",
+                "expected_output": f"Part {n} done",
+                "required_tools": "Browser",
+                "estimated_time": "5 min",
+                "is_critical": n == 1,
+            }
+            for n in range(1, steps + 1)
+        ],
+    }
+
+
+# ------------------------------------------------------------
+# BigQuery
+# ------------------------------------------------------------
+
+_TIMESTAMP_FIELDS = ("created_at", "last_updated")
+
+
+def _to_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _row(record: dict):
+    from google.cloud.bigquery.table import Row
+
+    return Row(tuple(record.values()), {k: i for i, k in enumerate(record)})
+
+
+class _FakeJob:
+    def __init__(self, client: "FakeBigQuery", rows: list, affected: int | None = None):
+        self._client = client
+        self._rows = rows
+        self.num_dml_affected_rows = affected
+        self.job_id = f"fake-{id(self):x}"
+
+    def result(self, page_size: int | None = None, **kwargs):
+        self._client.query_latency.sleep()
+        return [_row(r) for r in self._rows]
+
+
+class FakeBigQuery:
+    """bigquery.Client stand-in with in-memory tables (by table suffix)."""
+
+    def __init__(self, query_latency: Latency | None = None, insert_latency: Latency | None = None):
+        self.query_latency = query_latency or Latency()
+        self.insert_latency = insert_latency or Latency()
+        self.calls = _Calls()
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def _table(self, name: str) -> list:
+        key = name.strip("`").rsplit(".", 1)[-1]
+        return self._tables.setdefault(key, [])
+
+    def insert_rows_json(self, table, json_rows, **kwargs):
+        self.calls.add("insert_rows_json")
+        self.insert_latency.sleep()
+        rows = []
+        for r in json_rows:
+            r = dict(r)
+            for field in _TIMESTAMP_FIELDS:
+                if field in r:
+                    r[field] = _to_datetime(r[field])
+            rows.append(r)
+        with self._lock:
+            self._table(str(table)).extend(rows)
+        return []
+
+    def query(self, query, job_config=None, **kwargs):
+        self.calls.add("query")
+        params = {}
+        for p in getattr(job_config, "query_parameters", None) or []:
+            params[p.name] = p.values if hasattr(p, "values") else p.value
+        with self._lock:
+            if query.lstrip().upper().startswith("DELETE"):
+                return _FakeJob(self, [], affected=0)
+            if "manual_derivations" in query:
+                rows = [
+                    d for d in self._table("manual_derivations")
+                    if d["record_hash"] == params.get("record_hash")
+                ]
+                rows.sort(key=lambda d: d["created_at"], reverse=True)
+                return _FakeJob(self, rows[:1])
+            latest = self._latest(params.get("manual_ids"))
+            if "SELECT manual_id, version, record_hash" in query:
+                rows = [
+                    {"manual_id": m["manual_id"], "version": m["version"], "record_hash": m["record_hash"]}
+                    for m in latest
+                ]
+            elif "AS steps" in query:
+                rows = [self._nested(m) for m in latest]
+            else:
+                rows = self._page(latest, params) if "@limit" in query else self._ordered(latest)
+        return _FakeJob(self, rows)
+
+    def _latest(self, ids=None) -> list:
+        wanted = set(ids) if ids is not None else None
+        best = {}
+        for m in self._table("manuals_dict"):
+            if wanted is not None and m["manual_id"] not in wanted:
+                continue
+            current = best.get(m["manual_id"])
+            if current is None or (m["version"] or 0, m["last_updated"]) > (
+                current["version"] or 0,
+                current["last_updated"],
+            ):
+                best[m["manual_id"]] = m
+        return list(best.values())
+
+    def _nested(self, m: dict) -> dict:
+        steps = sorted(
+            (
+                {k: v for k, v in s.items() if k not in ("manual_id", "version", "record_hash")}
+                for s in self._table("manual_steps")
+                if s["manual_id"] == m["manual_id"]
+                and s.get("version") == m.get("version")
+                and s.get("record_hash") == m.get("record_hash")
+            ),
+            key=lambda s: s["step_number"] or 0,
+        )
+        files = sorted(
+            (f for f in self._table("manual_files") if f["manual_id"] == m["manual_id"]),
+            key=lambda f: f.get("version") or 0,
+            reverse=True,
+        )
+        return {**m, "steps": steps, "files": files}
+
+    @staticmethod
+    def _ordered(manuals: list) -> list:
+        return sorted(manuals, key=lambda m: (m["last_updated"], m["manual_id"]), reverse=True)
+
+    def _page(self, manuals: list, params: dict) -> list:
+        q = params.get("q")
+        if q:
+            manuals = [
+                m for m in manuals
+                if any(q in (m.get(f) or "").lower() for f in ("title", "context", "outputs"))
+                or any(q in k.lower() for k in m.get("keywords") or [])
+            ]
+        if "after_ts" in params:
+            ts, after_id = _to_datetime(params["after_ts"]), params["after_id"]
+            manuals = [
+                m for m in manuals
+                if m["last_updated"] < ts or (m["last_updated"] == ts and m["manual_id"] < after_id)
+            ]
+        return self._ordered(manuals)[: params.get("limit")]
+
+    def row_counts(self) -> dict:
+        with self._lock:
+            return {name: len(rows) for name, rows in self._tables.items()}
+
+
+# ------------------------------------------------------------
+# Cloud Storage
+# ------------------------------------------------------------
+
+class _FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self._bucket = bucket
+        self.name = name
+        self.content_encoding = None
+        self.cache_control = None
+
+    def exists(self, **kwargs) -> bool:
+        self._bucket.calls.add("exists")
+        self._bucket.latency.sleep()
+        with self._bucket._lock:
+            return self.name in self._bucket.blobs
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self._bucket.calls.add("upload")
+        self._bucket.latency.sleep()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._bucket._lock:
+            self._bucket.blobs[self.name] = data
+
+    def download_as_bytes(self, **kwargs) -> bytes:
+        from google.api_core.exceptions import NotFound
+
+        self._bucket.calls.add("download")
+        self._bucket.latency.sleep()
+        with self._bucket._lock:
+            if self.name not in self._bucket.blobs:
+                raise NotFound(f"{self.name} not found")
+            return self._bucket.blobs[self.name]
+
+
+class FakeBucket:
+    """storage.Bucket stand-in: blobs kept in a dict."""
+
+    def __init__(self, name: str = "benchmark", latency: Latency | None = None):
+        self.name = name
+        self.latency = latency or Latency()
+        self.calls = _Calls()
+        self.blobs = {}
+        self._lock = threading.Lock()
+
+    def blob(self, name: str) -> _FakeBlob:
+        return _FakeBlob(self, name)
+
+
+class _FakeStorageClient:
+    def __init__(self, bucket: FakeBucket):
+        self._bucket = bucket
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self._bucket
+
+
+# ------------------------------------------------------------
+# Installation
+# ------------------------------------------------------------
+
+def install(genai: FakeGenai, bq: FakeBigQuery, bucket: FakeBucket):
+    """
+    Swaps the fakes in for this process. The Google client classes are
+    replaced before manual_store_gcp is imported (it creates its clients at
+    import time), and its `bq_client` / `bucket` are then set explicitly.
+    """
+    import google.genai
+    from google.adk.models import google_llm
+    from google.cloud import bigquery, storage
+
+    google.genai.Client = genai
+    google_llm.Client = genai
+
+    real_bq, real_storage = bigquery.Client, storage.Client
+    bigquery.Client = lambda *args, **kwargs: bq
+    storage.Client = lambda *args, **kwargs: _FakeStorageClient(bucket)
+    try:
+        import manual_store_gcp
+    finally:
+        bigquery.Client, storage.Client = real_bq, real_storage
+    manual_store_gcp.bq_client = bq
+    manual_store_gcp.bucket = bucket
+
+    import manual_derivations
+
+    manual_derivations._client = None
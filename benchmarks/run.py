@@ -0,0 +1,390 @@
+# benchmarks/run.py - Load test of the server against in-process fakes
+"""
+Drives the real server code (main.app through an in-process ASGI client,
+and the async store API) with Gemini, BigQuery and GCS replaced by the
+fakes in benchmarks/fakes.py. The numbers are the server's own overhead
+plus the configured latencies, comparable across commits.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --scenarios ask,manuals --requests 500 --concurrency 16
+    python -m benchmarks.run --model-ms 800 --bq-ms 300 --out bench.json
+    python -m benchmarks.run --out new.json --compare bench.json
+    python -m benchmarks.run --cassettes .cache/cassettes --cassette-latency zero
+
+Scenarios:
+- ask:        POST /ask, a distinct question each time (coordinator ->
+              search_agent -> search tool -> answer; no answer-cache hits)
+- ask_stream: the same through POST /ask/stream
+- manuals:    GET /manuals, newest first and filtered by text (alternating)
+- save:       manual_store_async.save_manual of a new manual
+- search:     manual_store_async.search_manuals by topic
+- conversations (only with --cassettes): each call replays one recorded
+              conversation (cassettes.py) turn by turn through POST /ask.
+              Model and tool calls come from the cassette, so every run
+              takes the recorded call graph.
+
+Each scenario makes `--warmup` unmeasured calls, then `--requests` calls
+with `--concurrency` in flight. It reports p50 / p95 / p99 / mean latency
+(ms, successful calls), errors, throughput (successful calls per second),
+the process peak RSS, and the calls each fake received. With
+--trace-memory it also reports the tracemalloc peak, which slows the run.
+
+The run is isolated: in-memory sessions, caches in a temporary directory,
+no tracing, WARNING logs and no background derivations. Any of those can
+be overridden with the usual environment variables.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("ask", "ask_stream", "manuals", "save", "search")
+REPLAY_SCENARIOS = ("conversations",)
+TOPICS = (
+    "payroll closing", "vendor onboarding", "expense approval", "access request",
+    "month end report", "invoice matching", "customer refund", "laptop setup",
+)
+
+
+def _isolate(workdir: str, args):
+    """Environment for the run (before settings is imported)."""
+    if args.cassettes:
+        # Every turn through the agents, as when the cassettes were recorded
+        os.environ.update(
+            CASSETTE_MODE="replay",
+            CASSETTE_DIR=args.cassettes,
+            CASSETTE_LATENCY=args.cassette_latency,
+            FAST_ROUTER_ENABLED="false",
+            ANSWER_CACHE_TTL_SECONDS="0",
+        )
+    defaults = {
+        "SESSION_DB_URL": "",
+        "MANUAL_CACHE_SHARED_PATH": "",
+        "MANUAL_HTML_CACHE_DIR": os.path.join(workdir, "manual_html"),
+        "MANUAL_VECTOR_DIR": os.path.join(workdir, "manual_vectors"),
+        "MANUAL_DERIVED_CACHE_DIR": os.path.join(workdir, "manual_derived"),
+        "MANUAL_DERIVATIONS_ENABLED": "false",
+        "TRACING_EXPORTER": "none",
+        "LOG_LEVEL": "WARNING",
+        "WARMUP_ON_STARTUP": "false",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", help="comma-separated (default: all; conversations with --cassettes)")
+    parser.add_argument("--requests", type=int, default=200, help="measured calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="calls in flight")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured calls per scenario")
+    parser.add_argument("--catalog", type=int, default=200, help="manuals stored before the run")
+    parser.add_argument("--model-ms", type=float, default=400, help="model latency to the first chunk")
+    parser.add_argument("--model-jitter-ms", type=float, default=100)
+    parser.add_argument("--chunk-ms", type=float, default=20, help="latency per further streamed chunk")
+    parser.add_argument("--bq-ms", type=float, default=150, help="BigQuery query latency")
+    parser.add_argument("--bq-insert-ms", type=float, default=80, help="BigQuery streaming insert latency")
+    parser.add_argument("--gcs-ms", type=float, default=40, help="GCS request latency")
+    parser.add_argument("--storage-jitter-ms", type=float, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--cassettes", help="directory of recorded conversations to replay")
+    parser.add_argument("--cassette-latency", choices=("original", "zero"), default="original")
+    parser.add_argument("--trace-memory", action="store_true", help="also report the tracemalloc peak")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare with")
+    args = parser.parse_args(argv)
+    # Replay answers every model call from a cassette: the other scenarios
+    # (new questions) have none, so the two kinds do not mix
+    allowed = REPLAY_SCENARIOS if args.cassettes else SCENARIOS
+    args.scenarios = args.scenarios or ",".join(allowed)
+    unknown = set(args.scenarios.split(",")) - set(allowed)
+    if unknown:
+        parser.error(
+            f"scenarios {', '.join(sorted(unknown))} not available"
+            + (" with --cassettes" if args.cassettes else " (conversations needs --cassettes)")
+        )
+    return args
+
+
+def _percentile(ordered: list, q: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), int(round(q * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        import psutil
+
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+
+
+def _git_commit() -> dict:
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, timeout=10, cwd=REPO_DIR
+        ).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain"))}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": None, "dirty": None}
+
+
+class Bench:
+    def __init__(self, args):
+        from benchmarks import fakes
+
+        self.args = args
+        # No latency while the catalog is seeded; the configured one after
+        self.genai = fakes.FakeGenai()
+        self.bq = fakes.FakeBigQuery()
+        self.bucket = fakes.FakeBucket()
+        fakes.install(self.genai, self.bq, self.bucket)
+
+    def set_latencies(self):
+        from benchmarks.fakes import Latency
+
+        a = self.args
+        self.genai.latency = Latency(a.model_ms, a.model_jitter_ms, a.seed)
+        self.genai.chunk_latency = Latency(a.chunk_ms, 0, a.seed + 1)
+        self.bq.query_latency = Latency(a.bq_ms, a.storage_jitter_ms, a.seed + 2)
+        self.bq.insert_latency = Latency(a.bq_insert_ms, a.storage_jitter_ms, a.seed + 3)
+        self.bucket.latency = Latency(a.gcs_ms, a.storage_jitter_ms, a.seed + 4)
+
+    def seed_catalog(self):
+        import manual_store_gcp
+        from benchmarks.fakes import benchmark_manual
+
+        manuals = [
+            benchmark_manual(f"{TOPICS[i % len(TOPICS)].capitalize()} {i}")
+            for i in range(self.args.catalog)
+        ]
+        for start in range(0, len(manuals), 50):
+            manual_store_gcp.save_manuals(manuals[start : start + 50])
+
+    def load_conversations(self):
+        """The user turns of each cassette that can be replayed from its first message."""
+        import glob
+
+        self.conversations = []
+        for path in sorted(glob.glob(os.path.join(self.args.cassettes, "*.json"))):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            turns = [t["message"] for t in data.get("turns", [])]
+            # Conversations whose first turn was answered without the agents
+            # (fast path, answer cache) have no recording of it
+            if turns and turns[0] == data.get("first_message"):
+                self.conversations.append(turns)
+            else:
+                print(f"skipped {os.path.basename(path)}: its first turn was not recorded")
+        if not self.conversations:
+            raise SystemExit(f"no replayable cassettes in {self.args.cassettes}")
+
+    def calls(self) -> dict:
+        return {
+            "model": sum(self.genai.calls.counts.values()),
+            "bq_query": self.bq.calls.counts.get("query", 0),
+            "bq_insert": self.bq.calls.counts.get("insert_rows_json", 0),
+            "gcs": sum(self.bucket.calls.counts.values()),
+        }
+
+    # -- scenarios ----------------------------------------------------
+
+    def scenario(self, name: str, client):
+        import manual_store_async
+        from benchmarks.fakes import benchmark_manual
+
+        def topic(i):
+            return TOPICS[i % len(TOPICS)]
+
+        def question(i):
+            # Distinct per scenario and call: no answer-cache or fast-path hits
+            return f"Which manual explains {topic(i)} for the finance team? ({name} #{i})"
+
+        async def ask(i):
+            r = await client.post("/ask", json={"question": question(i)})
+            r.raise_for_status()
+
+        async def ask_stream(i):
+            r = await client.post("/ask/stream", json={"question": question(i)})
+            r.raise_for_status()
+            if "event: final" not in r.text:
+                raise RuntimeError("stream ended without a final event")
+
+        async def manuals(i):
+            params = {"limit": 50, **({"q": topic(i).split()[0]} if i % 2 else {})}
+            r = await client.get("/manuals", params=params)
+            r.raise_for_status()
+
+        async def save(i):
+            await manual_store_async.save_manual(
+                benchmark_manual(f"{topic(i).capitalize()} run {i} {time.time_ns()}")
+            )
+
+        async def search(i):
+            await manual_store_async.search_manuals(topic(i), limit=10)
+
+        async def conversations(i):
+            recorded = self.conversations[i % len(self.conversations)]
+            session_id = None
+            for turn in recorded:
+                r = await client.post("/ask", json={"question": turn, "session_id": session_id})
+                r.raise_for_status()
+                session_id = r.json()["session_id"]
+
+        return {
+            "ask": ask,
+            "ask_stream": ask_stream,
+            "manuals": manuals,
+            "save": save,
+            "search": search,
+            "conversations": conversations,
+        }[name]
+
+    async def run_scenario(self, name: str, call) -> dict:
+        a = self.args
+        for i in range(a.warmup):
+            try:
+                await call(-1 - i)
+            except Exception:
+                pass
+
+        pending = iter(range(a.requests))
+        latencies, errors = [], {}
+        calls_before = self.calls()
+        if a.trace_memory:
+            tracemalloc.reset_peak()
+
+        async def worker():
+            for i in pending:
+                started = time.perf_counter()
+                try:
+                    await call(i)
+                except Exception as e:
+                    key = type(e).__name__
+                    errors[key] = errors.get(key, 0) + 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(a.concurrency)))
+        wall = time.perf_counter() - started
+
+        ordered = sorted(latencies)
+        calls_after = self.calls()
+        result = {
+            "requests": a.requests,
+            "concurrency": a.concurrency,
+            "ok": len(ordered),
+            "errors": errors,
+            "p50_ms": round(_percentile(ordered, 0.50), 2),
+            "p95_ms": round(_percentile(ordered, 0.95), 2),
+            "p99_ms": round(_percentile(ordered, 0.99), 2),
+            "mean_ms": round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+            "max_ms": round(ordered[-1], 2) if ordered else 0.0,
+            "throughput_rps": round(len(ordered) / wall, 2) if wall else 0.0,
+            "wall_s": round(wall, 3),
+            "peak_rss_mb": _peak_rss_mb(),
+            "fake_calls_per_request": {
+                k: round((calls_after[k] - calls_before[k]) / max(1, a.requests), 2)
+                for k in calls_after
+            },
+        }
+        if a.trace_memory:
+            result["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        return result
+
+    async def run(self) -> dict:
+        import httpx
+
+        import agent_runtime
+        import main
+
+        a = self.args
+        if a.trace_memory:
+            tracemalloc.start()
+        await asyncio.to_thread(self.seed_catalog)
+        # Same warm-up as the server's startup hook (runner, clients, index)
+        await asyncio.to_thread(agent_runtime.warm_up)
+        self.set_latencies()
+        if a.cassettes:
+            self.load_conversations()
+
+        results = {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name in a.scenarios.split(","):
+                results[name] = await self.run_scenario(name, self.scenario(name, client))
+                _print_result(name, results[name])
+        return results
+
+
+def _print_result(name: str, r: dict):
+    errors = sum(r["errors"].values())
+    print(
+        f"{name:<13} p50 {r['p50_ms']:>9.1f} ms  p95 {r['p95_ms']:>9.1f} ms  "
+        f"p99 {r['p99_ms']:>9.1f} ms  {r['throughput_rps']:>8.1f} req/s  "
+        f"errors {errors:>4}  rss {r['peak_rss_mb']} MB"
+    )
+
+
+def _print_comparison(current: dict, baseline: dict):
+    print(f"\nvs {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')}):")
+    for name, r in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        deltas = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"):
+            old, new = base.get(metric), r.get(metric)
+            if old and new is not None:
+                deltas.append(f"{metric} {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+        print(f"  {name:<13} " + "  ".join(deltas))
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="manual-bench-")
+    _isolate(workdir, args)
+
+    bench = Bench(args)
+    scenarios = asyncio.run(bench.run())
+    output = {
+        "meta": {
+            **_git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+        },
+        "scenarios": scenarios,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2)
+        print(f"\nResults written to {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            _print_comparison(output, json.load(f))
+    return output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+# cassettes.py - Record / replay of the agents' model and tool calls
+"""
+Which sub-agent and tools a turn uses depends on live Gemini output, so
+two runs of the same conversation rarely take the same path. With
+CASSETTE_MODE:
+
+- "record": every model request / response of the coordinator and the
+  sub-agents, and every tool result, is written to a cassette: one JSON
+  file per conversation in CASSETTE_DIR, named after its first user
+  message. Streamed responses are kept chunk by chunk, with their timing.
+- "replay": the same conversation is answered from its cassette. No model
+  or tool call leaves the process, so the agents, tools and call graph are
+  the ones recorded. CASSETTE_LATENCY chooses the pace: "original" waits
+  as long as the recorded calls took, "zero" answers at once.
+- "off" (default): nothing is installed.
+
+attach(coordinator) wraps the model of every agent of the tree
+(CassetteLlm), and CassettePlugin (a Runner plugin) serves tool results
+and picks the conversation's cassette when a run starts. Only the app's
+own tools (agents/) are recorded and served; ADK built-ins such as
+transfer_to_agent run as usual, so their actions (the hand-off to a
+sub-agent) still happen on replay. The agents' own callbacks
+(context_budget) and the telemetry plugin still run on replay.
+
+Replay is strict about the call graph and lenient about content:
+- Model calls are served in recorded order per agent.
+- Tool calls are matched by agent, tool and arguments.
+- A call with nothing left to serve fails with CassetteMiss.
+- A model request that differs from the recorded one is served anyway,
+  and counted in stats() as a mismatch.
+Answers from the answer cache and the fast path do not run the agents, so
+they are not part of a cassette.
+"""
+import asyncio
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+from google.adk.plugins.base_plugin import BasePlugin
+
+from settings import CASSETTE_DIR, CASSETTE_LATENCY, CASSETTE_MODE
+
+log = logging.getLogger("cassettes")
+
+FORMAT_VERSION = 1
+# Conversations kept in memory at most (oldest first out)
+_MAX_CONVERSATIONS = 1024
+# Tool calls in flight remembered at most (a cancelled run never ends its calls)
+_MAX_IN_FLIGHT = 1024
+
+# Cassette of the run in progress (set by the plugin when a run starts)
+_current: contextvars.ContextVar[Optional["Cassette"]] = contextvars.ContextVar(
+    "cassette", default=None
+)
+
+_lock = threading.Lock()
+_conversations: "OrderedDict[str, Cassette]" = OrderedDict()
+_stats = {"recorded": 0, "replayed": 0, "mismatches": 0, "misses": 0}
+
+
+class CassetteMiss(LookupError):
+    """Replay asked for a call the cassette does not have."""
+
+
+def enabled() -> bool:
+    return CASSETTE_MODE in ("record", "replay")
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _stats[name] += n
+
+
+def stats() -> dict | None:
+    if not enabled():
+        return None
+    with _lock:
+        return {
+            "mode": CASSETTE_MODE,
+            "latency": CASSETTE_LATENCY,
+            "conversations": len(_conversations),
+            **_stats,
+        }
+
+
+# ------------------------------------------------------------
+# Cassette files
+# ------------------------------------------------------------
+
+def conversation_key(first_message: str) -> str:
+    """File name (without .json) of the conversation that starts with `first_message`."""
+    normalized = " ".join(first_message.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:24]
+
+
+def _path(key: str) -> str:
+    return os.path.join(CASSETTE_DIR, f"{key}.json")
+
+
+def _strip_call_ids(value):
+    """ADK gives function calls random IDs; they are left out of digests."""
+    if isinstance(value, dict):
+        return {
+            k: _strip_call_ids(v)
+            for k, v in value.items()
+            if not (k == "id" and "name" in value and ("args" in value or "response" in value))
+        }
+    if isinstance(value, list):
+        return [_strip_call_ids(v) for v in value]
+    return value
+
+
+def _digest(value) -> str:
+    text = json.dumps(_strip_call_ids(value), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _jsonable(value):
+    return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+
+class Cassette:
+    """The recorded calls of one conversation, in the order they happened."""
+
+    def __init__(self, key: str, first_message: str, data: dict | None = None):
+        self.key = key
+        self.data = data or {
+            "version": FORMAT_VERSION,
+            "key": key,
+            "first_message": first_message,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "turns": [],
+            "calls": [],
+        }
+        self._lock = threading.Lock()
+        # Replay cursors: next model call per agent, tool calls served
+        self._next_model: Dict[str, int] = {}
+        self._served_tools: set = set()
+
+    @classmethod
+    def load(cls, key: str) -> Optional["Cassette"]:
+        try:
+            with open(_path(key), encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        if data.get("version") != FORMAT_VERSION:
+            raise ValueError(f"cassette {key}: unsupported version {data.get('version')}")
+        return cls(key, data["first_message"], data)
+
+    def save(self):
+        os.makedirs(CASSETTE_DIR, exist_ok=True)
+        path = _path(self.key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            text = json.dumps(self.data, ensure_ascii=False, indent=1)
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    # -- record -------------------------------------------------------
+
+    def add_turn(self, invocation_id: str, message: str):
+        with self._lock:
+            self.data["turns"].append({"invocation_id": invocation_id, "message": message})
+
+    def add_call(self, call: dict):
+        with self._lock:
+            call["turn"] = len(self.data["turns"]) - 1
+            self.data["calls"].append(call)
+        _count("recorded")
+
+    # -- replay -------------------------------------------------------
+
+    def next_model_call(self, agent: str) -> dict:
+        with self._lock:
+            calls = [c for c in self.data["calls"] if c["kind"] == "model" and c["agent"] == agent]
+            index = self._next_model.get(agent, 0)
+            if index >= len(calls):
+                raise CassetteMiss(
+                    f"cassette {self.key}: {agent} made {len(calls)} model calls when recorded"
+                )
+            self._next_model[agent] = index + 1
+            return calls[index]
+
+    def tool_call(self, agent: str, tool: str, args: dict) -> dict:
+        """The first unserved call of `tool` by `agent`, preferring equal arguments."""
+        args_digest = _digest(args)
+        with self._lock:
+            candidates = [
+                (i, c)
+                for i, c in enumerate(self.data["calls"])
+                if c["kind"] == "tool"
+                and c["agent"] == agent
+                and c["tool"] == tool
+                and i not in self._served_tools
+            ]
+            if not candidates:
+                raise CassetteMiss(f"cassette {self.key}: no recorded {tool} call left for {agent}")
+            index, call = next(
+                ((i, c) for i, c in candidates if c["args_digest"] == args_digest), candidates[0]
+            )
+            self._served_tools.add(index)
+        if call["args_digest"] != args_digest:
+            _count("mismatches")
+            log.warning(
+                "replayed tool call with different arguments",
+                extra={"cassette": self.key, "agent": agent, "tool": tool},
+            )
+        return call
+
+
+async def _wait_until(started: float, offset_ms: float):
+    """Sleeps until `offset_ms` after `started` (no wait with CASSETTE_LATENCY=zero)."""
+    if CASSETTE_LATENCY != "original":
+        return
+    delay = started + offset_ms / 1000 - time.perf_counter()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def _error_info(error: Exception) -> dict:
+    return {
+        "type": type(error).__name__,
+        "message": str(error),
+        "code": getattr(error, "code", None),
+        "status": getattr(error, "status", None),
+    }
+
+
+def _replayed_error(info: dict) -> Exception:
+    """The recorded exception, rebuilt (genai API errors keep their type and code)."""
+    from google.genai import errors
+
+    error_type = getattr(errors, info["type"], None)
+    if isinstance(error_type, type) and issubclass(error_type, errors.APIError) and info["code"]:
+        return error_type(
+            info["code"],
+            {"error": {"code": info["code"], "message": info["message"], "status": info["status"]}},
+        )
+    return RuntimeError(f"{info['type']}: {info['message']}")
+
+
+# ------------------------------------------------------------
+# Model calls
+# ------------------------------------------------------------
+
+class CassetteLlm(BaseLlm):
+    """
+    Stands in for an agent's model: records the calls to `inner`, or
+    answers them from the cassette of the run in progress.
+    """
+
+    inner: BaseLlm
+    agent_name: str
+
+    def _request(self, llm_request: LlmRequest, stream: bool) -> dict:
+        config = llm_request.config
+        contents = [c.model_dump(mode="json", exclude_none=True) for c in llm_request.contents]
+        instruction = config.system_instruction if config else None
+        if instruction is not None and not isinstance(instruction, str):
+            instruction = _jsonable(
+                instruction.model_dump(mode="json", exclude_none=True)
+                if hasattr(instruction, "model_dump")
+                else instruction
+            )
+        tools = sorted(llm_request.tools_dict)
+        return {
+            "model": llm_request.model,
+            "stream": stream,
+            "digest": _digest([contents, instruction, tools]),
+            "system_instruction": instruction,
+            "tools": tools,
+            "contents": contents,
+        }
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        cassette = _current.get()
+        if cassette is None:
+            # Outside a runner run (nothing to record into)
+            async for response in self.inner.generate_content_async(llm_request, stream=stream):
+                yield response
+            return
+
+        request = self._request(llm_request, stream)
+        if CASSETTE_MODE == "replay":
+            async for response in self._replay(cassette, request, stream):
+                yield response
+            return
+
+        started = time.perf_counter()
+        responses = []
+        call = {"kind": "model", "agent": self.agent_name, "request": request, "responses": responses}
+        try:
+            async for response in self.inner.generate_content_async(llm_request, stream=stream):
+                responses.append(
+                    {
+                        "at_ms": round((time.perf_counter() - started) * 1000, 1),
+                        "response": response.model_dump(mode="json", exclude_none=True),
+                    }
+                )
+                yield response
+        except Exception as e:
+            call["error"] = {"at_ms": round((time.perf_counter() - started) * 1000, 1), **_error_info(e)}
+            cassette.add_call(call)
+            cassette.save()  # the run ends here, before the plugin can save it
+            raise
+        cassette.add_call(call)
+
+    async def _replay(self, cassette: Cassette, request: dict, stream: bool):
+        started = time.perf_counter()
+        call = cassette.next_model_call(self.agent_name)
+        if call["request"]["digest"] != request["digest"]:
+            _count("mismatches")
+            log.warning(
+                "replayed model call with a different request",
+                extra={"cassette": cassette.key, "agent": self.agent_name},
+            )
+        _count("replayed")
+        for recorded in call["responses"]:
+            response = LlmResponse.model_validate(recorded["response"])
+            if response.partial and not stream:
+                continue  # recorded streaming, replayed without
+            await _wait_until(started, recorded["at_ms"])
+            yield response
+        if "error" in call:
+            await _wait_until(started, call["error"]["at_ms"])
+            raise _replayed_error(call["error"])
+
+    def connect(self, llm_request: LlmRequest):
+        return self.inner.connect(llm_request)
+
+
+def attach(agent):
+    """Wraps the model of `agent` and all its sub-agents (no-op when off)."""
+    if not enabled():
+        return agent
+    inner = agent.canonical_model
+    if isinstance(inner, CassetteLlm):
+        if inner.agent_name == agent.name:
+            return agent  # already attached
+        inner = inner.inner  # model inherited from the parent agent
+    agent.model = CassetteLlm(model=inner.model, inner=inner, agent_name=agent.name)
+    for sub_agent in getattr(agent, "sub_agents", None) or []:
+        attach(sub_agent)
+    return agent
+
+
+# ------------------------------------------------------------
+# Runs and tool calls
+# ------------------------------------------------------------
+
+def _text(content) -> str:
+    parts = content.parts if content and content.parts else []
+    return "".join(p.text for p in parts if p.text)
+
+
+def _is_app_tool(tool) -> bool:
+    """True for the agents' own function tools; ADK built-ins set actions and must run."""
+    func = getattr(tool, "func", None)
+    return func is not None and not func.__module__.startswith("google.")
+
+
+def _remember(key: str, cassette: Cassette):
+    with _lock:
+        _conversations[key] = cassette
+        _conversations.move_to_end(key)
+        while len(_conversations) > _MAX_CONVERSATIONS:
+            _conversations.popitem(last=False)
+
+
+def _conversation(invocation_context) -> Cassette:
+    """
+    The cassette of the session being run: in memory, on disk, or new
+    (record). Kept in memory under the same key as its file; a new
+    conversation always starts from the file (replay) or afresh (record).
+    """
+    session = invocation_context.session
+    user_events = [e for e in session.events if e.author == "user" and _text(e.content)]
+    first_message = (
+        _text(user_events[0].content) if user_events else _text(invocation_context.user_content)
+    )
+    key = conversation_key(first_message)
+    earlier = any(e.invocation_id != invocation_context.invocation_id for e in session.events)
+    if earlier:
+        with _lock:
+            cassette = _conversations.get(key)
+        if cassette is not None:
+            return cassette
+    # A new conversation is recorded afresh; a continued one (e.g. after a
+    # restart, or after turns answered without the agents) extends its file
+    cassette = Cassette.load(key) if CASSETTE_MODE == "replay" or earlier else None
+    if cassette is None:
+        if CASSETTE_MODE == "replay":
+            _count("misses")
+            raise CassetteMiss(f"no cassette for the conversation starting {first_message[:80]!r}")
+        cassette = Cassette(key, first_message)
+    _remember(key, cassette)
+    return cassette
+
+
+class CassettePlugin(BasePlugin):
+    """Picks the run's cassette, and records / serves its tool results."""
+
+    def __init__(self):
+        super().__init__(name="cassettes")
+        # function call id -> started (record)
+        self._tool_calls: "OrderedDict[str, float]" = OrderedDict()
+
+    async def before_run_callback(self, *, invocation_context):
+        cassette = await asyncio.to_thread(_conversation, invocation_context)
+        _current.set(cassette)
+        if CASSETTE_MODE == "record":
+            cassette.add_turn(invocation_context.invocation_id, _text(invocation_context.user_content))
+        return None
+
+    async def after_run_callback(self, *, invocation_context):
+        cassette = _current.get()
+        if cassette is not None and CASSETTE_MODE == "record":
+            await asyncio.to_thread(cassette.save)
+        return None
+
+    async def before_tool_callback(self, *, tool, tool_args, tool_context):
+        cassette = _current.get()
+        if cassette is None or not _is_app_tool(tool):
+            return None
+        if CASSETTE_MODE == "record":
+            self._tool_calls[tool_context.function_call_id] = time.perf_counter()
+            while len(self._tool_calls) > _MAX_IN_FLIGHT:
+                self._tool_calls.popitem(last=False)
+            return None
+
+        started = time.perf_counter()
+        call = cassette.tool_call(tool_context.agent_name, tool.name, tool_args)
+        _count("replayed")
+        await _wait_until(started, call["elapsed_ms"])
+        if "error" in call:
+            raise _replayed_error(call["error"])
+        return copy.deepcopy(call["result"])
+
+    def _record_tool(self, tool, tool_args, tool_context, **outcome) -> Optional[Cassette]:
+        cassette = _current.get()
+        if cassette is None or CASSETTE_MODE != "record" or not _is_app_tool(tool):
+            return None
+        started = self._tool_calls.pop(tool_context.function_call_id, None)
+        elapsed = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+        cassette.add_call(
+            {
+                "kind": "tool",
+                "agent": tool_context.agent_name,
+                "tool": tool.name,
+                "args": _jsonable(tool_args),
+                "args_digest": _digest(tool_args),
+                "elapsed_ms": round(elapsed, 1),
+                **outcome,
+            }
+        )
+        return cassette
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context, result):
+        self._record_tool(tool, tool_args, tool_context, result=_jsonable(result))
+        return None
+
+    async def on_tool_error_callback(self, *, tool, tool_args, tool_context, error):
+        cassette = self._record_tool(tool, tool_args, tool_context, error=_error_info(error))
+        if cassette is not None:
+            await asyncio.to_thread(cassette.save)
+        return None
+
+
+def plugins() -> List[Any]:
+    """The Runner plugins to add (none when off)."""
+    return [CassettePlugin()] if enabled() else []
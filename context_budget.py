@@ -0,0 +1,374 @@
+# context_budget.py - Per-request token budget for the agents' model context
+"""
+get_manual_tool put the entire manual (every step, every file version)
+into the model context, and the conversation history was sent whole on
+every model call. Both grow with the manuals and the sessions, and so
+does the latency and cost of each turn. attach(coordinator) installs a
+before_model_callback (compact_request) on every agent of the tree:
+
+- Tool results in the request are projected to the fields the agents use
+  (no file versions, hashes or empty fields). If a result is still over
+  CONTEXT_TOOL_RESULT_TOKENS, long texts are cut and long step / result
+  lists keep their first and last items, with a count of what was left out
+  (`truncated`, `<list>_omitted`, "... [N more characters]").
+- If the request is over CONTEXT_TOKEN_BUDGET, the older history is rolled
+  into one short summary, put in front of the first user message that is
+  kept (no second user turn in a row). The cut is always at a user message,
+  so a tool call never loses its result. The most recent turns stay verbatim.
+  If that is not enough, large tool payloads of older contents are
+  truncated.
+
+Only the request sent to the model changes: tool results are stored whole
+in the session, so a later turn that edits and saves a manual starts from
+the full record. save_manual_tool rejects a manual that carries the marks
+of truncation (is_truncated). Tokens are estimated (JSON characters / 4,
+no tokenizer call). stats() reports the tokens before and after compaction
+for /health.
+"""
+import json
+import logging
+import re
+import threading
+
+from settings import (
+    CONTEXT_BUDGET_ENABLED,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_TOOL_RESULT_TOKENS,
+)
+
+log = logging.getLogger("context_budget")
+
+# Share of the budget kept as verbatim recent history; the rest is for
+# the summary, the instruction and the answer
+_RECENT_SHARE = 0.6
+# Longest summary of the older history (tokens)
+_SUMMARY_TOKENS = 800
+# Characters kept of one line of the summary / one long text field
+_SUMMARY_LINE_CHARS = 200
+_TEXT_FIELD_CHARS = 600
+# Shrink levels tried in order until a tool result fits its budget:
+# (characters kept per text field, items kept at the head / tail of a list)
+_SHRINK_LEVELS = ((600, 12, 3), (250, 8, 2), (100, 4, 1))
+_CUT_TEXT_RE = re.compile(r"\.\.\. \[\d+ more characters\]$")
+
+# Fields of a manual the agents need; the rest (files, hashes) is dropped
+_MANUAL_FIELDS = (
+    "manual_id", "title", "business_area", "requester", "created_by",
+    "last_updated", "context", "requirements", "permissions", "outputs",
+    "keywords", "version", "steps",
+)
+_STEP_FIELDS = (
+    "step_number", "step_title", "step_description", "expected_output",
+    "required_tools", "estimated_time", "is_critical",
+)
+
+_lock = threading.Lock()
+_stats = {
+    "model_requests": 0,
+    "compacted_requests": 0,
+    "request_tokens_before": 0,
+    "request_tokens_after": 0,
+    "tool_results": 0,
+    "tool_tokens_before": 0,
+    "tool_tokens_after": 0,
+}
+
+
+def estimate_tokens(value) -> int:
+    """Rough token count of any JSON-able value (or pydantic model)."""
+    if hasattr(value, "model_dump_json"):
+        raw = value.model_dump_json(exclude_none=True)
+    else:
+        raw = json.dumps(value, default=str, ensure_ascii=False)
+    return len(raw) // 4 + 1
+
+
+def _add(**counts):
+    with _lock:
+        for name, n in counts.items():
+            _stats[name] += n
+
+
+def stats() -> dict:
+    with _lock:
+        s = dict(_stats)
+    before = s["request_tokens_before"] + s["tool_tokens_before"]
+    after = s["request_tokens_after"] + s["tool_tokens_after"]
+    return {
+        "enabled": CONTEXT_BUDGET_ENABLED,
+        "token_budget": CONTEXT_TOKEN_BUDGET,
+        "tool_result_budget": CONTEXT_TOOL_RESULT_TOKENS,
+        **s,
+        "saved_ratio": round(1 - after / before, 4) if before else 0.0,
+    }
+
+
+# ------------------------------------------------------------
+# Tool results
+# ------------------------------------------------------------
+
+def _clean(d: dict, fields) -> dict:
+    return {k: d[k] for k in fields if d.get(k) not in (None, "", [])}
+
+
+def _project_manual(manual: dict) -> dict:
+    projected = _clean(manual, _MANUAL_FIELDS)
+    if "steps" in projected:
+        projected["steps"] = [_clean(s, _STEP_FIELDS) for s in projected["steps"]]
+    return projected
+
+
+def _cut_text(value, limit: int = _TEXT_FIELD_CHARS):
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + f"... [{len(value) - limit} more characters]"
+    return value
+
+
+def _shrink(value, level=_SHRINK_LEVELS[0]):
+    """Cuts long strings and long lists, recursively."""
+    chars, head, tail = level
+    if isinstance(value, str):
+        return _cut_text(value, chars)
+    if isinstance(value, dict):
+        out = {k: _shrink(v, level) for k, v in value.items()}
+        for k, v in value.items():
+            if isinstance(v, list) and len(v) > head + tail:
+                out[f"{k}_omitted"] = len(v) - head - tail
+        return out
+    if isinstance(value, list):
+        if len(value) > head + tail:
+            value = value[:head] + value[-tail:]
+        return [_shrink(v, level) for v in value]
+    return value
+
+
+def project_tool_result(tool_name: str, result: dict) -> dict:
+    """The part of a tool result the model needs, within the tool budget."""
+    if not isinstance(result, dict):
+        return result
+    projected = dict(result)
+    if isinstance(projected.get("manual"), dict):
+        projected["manual"] = _project_manual(projected["manual"])
+    if isinstance(projected.get("results"), list):
+        projected["results"] = [
+            {k: v for k, v in r.items() if v not in (None, "", [])}
+            if isinstance(r, dict) else r
+            for r in projected["results"]
+        ]
+    if estimate_tokens(projected) <= CONTEXT_TOOL_RESULT_TOKENS:
+        return projected
+    for level in _SHRINK_LEVELS:
+        shrunk = _shrink(projected, level)
+        if estimate_tokens(shrunk) <= CONTEXT_TOOL_RESULT_TOKENS:
+            break
+    shrunk["truncated"] = True
+    return shrunk
+
+
+def is_truncated(value) -> bool:
+    """True if `value` carries a mark left by the shrinking above."""
+    if isinstance(value, str):
+        return bool(_CUT_TEXT_RE.search(value))
+    if isinstance(value, dict):
+        return any(
+            k == "truncated" or k.endswith("_omitted") or is_truncated(v)
+            for k, v in value.items()
+        )
+    if isinstance(value, list):
+        return any(is_truncated(v) for v in value)
+    return False
+
+
+def project_contents(contents: list) -> list:
+    """
+    Copies of the contents with every tool result projected; contents
+    without tool results are passed through as they are.
+    """
+    from google.genai import types
+
+    projected = []
+    for content in contents:
+        parts = content.parts or []
+        if not any(p.function_response for p in parts):
+            projected.append(content)
+            continue
+        new_parts = []
+        for part in parts:
+            response = part.function_response
+            if response is not None and isinstance(response.response, dict):
+                before = estimate_tokens(response.response)
+                result = project_tool_result(response.name, response.response)
+                after = estimate_tokens(result)
+                _add(tool_results=1, tool_tokens_before=before, tool_tokens_after=after)
+                if result.get("truncated"):
+                    log.debug(
+                        "tool result truncated",
+                        extra={"tool": response.name, "tokens_before": before, "tokens_after": after},
+                    )
+                part = types.Part(
+                    function_response=types.FunctionResponse(
+                        id=response.id, name=response.name, response=result
+                    )
+                )
+            new_parts.append(part)
+        projected.append(types.Content(role=content.role, parts=new_parts))
+    return projected
+
+
+# ------------------------------------------------------------
+# Model requests (history)
+# ------------------------------------------------------------
+
+def _is_user_message(content) -> bool:
+    parts = content.parts or []
+    return (
+        content.role == "user"
+        and any(p.text for p in parts)
+        and not any(p.function_response for p in parts)
+    )
+
+
+def _summary_line(content) -> str:
+    pieces = []
+    for part in content.parts or []:
+        if part.text and not part.thought:
+            pieces.append(" ".join(part.text.split()))
+        elif part.function_call:
+            pieces.append(f"(called {part.function_call.name})")
+        elif part.function_response:
+            response = part.function_response.response or {}
+            manual = response.get("manual") if isinstance(response, dict) else None
+            if isinstance(manual, dict):
+                detail = f"manual {manual.get('manual_id')} '{manual.get('title')}'"
+            elif isinstance(response, dict) and isinstance(response.get("results"), list):
+                detail = f"{len(response['results'])} results"
+            else:
+                detail = "done"
+            pieces.append(f"({part.function_response.name}: {detail})")
+    text = " ".join(pieces)
+    if len(text) > _SUMMARY_LINE_CHARS:
+        text = text[:_SUMMARY_LINE_CHARS] + "..."
+    return f"- {content.role}: {text}" if text else ""
+
+
+def summarize_history(contents) -> str:
+    """Short, deterministic summary of older contents (most recent lines kept)."""
+    lines = [line for line in (_summary_line(c) for c in contents) if line]
+    kept, size = [], 0
+    for line in reversed(lines):
+        size += len(line) // 4 + 1
+        if size > _SUMMARY_TOKENS:
+            kept.append(f"- ... ({len(lines) - len(kept)} earlier messages omitted)")
+            break
+        kept.append(line)
+    return (
+        "[Summary of the earlier conversation; the recent messages follow verbatim]\n"
+        + "\n".join(reversed(kept))
+    )
+
+
+def _truncate_payloads(content):
+    """Copy of a content with long texts and tool payloads cut."""
+    from google.genai import types
+
+    parts = []
+    for part in content.parts or []:
+        if part.text and len(part.text) > _TEXT_FIELD_CHARS:
+            part = types.Part(text=_cut_text(part.text))
+        elif part.function_response and estimate_tokens(part.function_response.response) > _SUMMARY_TOKENS:
+            response = _shrink(part.function_response.response or {})
+            response["truncated"] = True
+            part = types.Part(
+                function_response=types.FunctionResponse(
+                    id=part.function_response.id,
+                    name=part.function_response.name,
+                    response=response,
+                )
+            )
+        parts.append(part)
+    return types.Content(role=content.role, parts=parts)
+
+
+def compact_contents(contents: list) -> list:
+    """The contents to send, within CONTEXT_TOKEN_BUDGET when possible."""
+    from google.genai import types
+
+    sizes = [estimate_tokens(c) for c in contents]
+    if sum(sizes) <= CONTEXT_TOKEN_BUDGET:
+        return contents
+
+    # Oldest content kept verbatim: the recent ones that fit in the share,
+    # moved forward to the next user message
+    keep_budget = CONTEXT_TOKEN_BUDGET * _RECENT_SHARE
+    cut, size = len(contents), 0
+    while cut > 0 and size + sizes[cut - 1] <= keep_budget:
+        cut -= 1
+        size += sizes[cut]
+    while cut < len(contents) and not _is_user_message(contents[cut]):
+        cut += 1
+    if cut >= len(contents):
+        # The last turn alone is too big: keep it all from its user message
+        cut = max(
+            (i for i, c in enumerate(contents) if _is_user_message(c)), default=0
+        )
+
+    compacted = list(contents[cut:])
+    if cut > 0:
+        # contents[cut] is a user message: the summary opens it
+        first = compacted[0]
+        compacted[0] = types.Content(
+            role=first.role,
+            parts=[types.Part(text=summarize_history(contents[:cut]))] + list(first.parts),
+        )
+
+    if sum(estimate_tokens(c) for c in compacted) > CONTEXT_TOKEN_BUDGET:
+        # Still too big: cut the payloads of all but the newest content
+        compacted = [_truncate_payloads(c) for c in compacted[:-1]] + compacted[-1:]
+    return compacted
+
+
+def compact_request(callback_context, llm_request):
+    """before_model_callback: keeps the request within the token budget."""
+    if not CONTEXT_BUDGET_ENABLED or not llm_request.contents:
+        return None
+    before = sum(estimate_tokens(c) for c in llm_request.contents)
+    # New contents: the session's events are not touched
+    projected = project_contents(llm_request.contents)
+    contents = compact_contents(projected)
+    after = sum(estimate_tokens(c) for c in contents)
+    _add(
+        model_requests=1,
+        compacted_requests=int(contents is not projected),
+        request_tokens_before=before,
+        request_tokens_after=after,
+    )
+    if contents is not projected:
+        log.info(
+            "history compacted",
+            extra={
+                "agent": callback_context.agent_name,
+                "tokens_before": before,
+                "tokens_after": after,
+                "messages_before": len(llm_request.contents),
+                "messages_after": len(contents),
+            },
+        )
+    llm_request.contents = contents
+    return None
+
+
+def attach(agent):
+    """Installs the callback on `agent` and all its sub-agents."""
+    if not CONTEXT_BUDGET_ENABLED:
+        return agent
+    current = agent.before_model_callback
+    if current is None:
+        agent.before_model_callback = compact_request
+    elif isinstance(current, list):
+        if compact_request not in current:
+            current.append(compact_request)
+    elif current is not compact_request:
+        agent.before_model_callback = [current, compact_request]
+    for sub_agent in getattr(agent, "sub_agents", None) or []:
+        attach(sub_agent)
+    return agent
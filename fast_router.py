@@ -0,0 +1,250 @@
+# fast_router.py - Deterministic fast path for list / search / open requests
+"""
+"Show me all manuals", "search manuals about payroll" or "open manual
+MAN-1a2b3c4d" used to go through the coordinator LLM and then a sub-agent
+LLM before a single tool ran. This router recognizes those requests with
+rules and answers them straight from the store, with no model call:
+
+- list:   "show me all manuals", "search manuals", "lista los manuales"
+- search: "find manuals about payroll", "find the onboarding manual", "manuales sobre onboarding"
+- open:   "open manual MAN-1a2b3c4d", "look up MAN-1a2b3c4d", "open the manual Payroll closing"
+
+It is deliberately conservative. The whole question must match one
+pattern; a search with extra instructions ("... and summarize them"), a
+search with no results, or a title that does not match a manual exactly
+is escalated to the agents (classify/answer return None).
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import List, Optional
+
+import manual_store_async
+from manual_index import fold
+from settings import FAST_ROUTER_ENABLED, FAST_ROUTER_LIST_LIMIT
+
+log = logging.getLogger("fast_router")
+
+# Courtesy phrases stripped before matching (they don't change the intent)
+_POLITE_RE = re.compile(
+    r"^(?:(?:please|pls|hi|hello|hey|hola|por favor|can you|could you|would you|"
+    r"i want to|i would like to|i'd like to|puedes|podrias|quiero|me gustaria)\s+)+"
+    r"|(?:\s+(?:please|pls|por favor|thanks|thank you|gracias))+$"
+)
+
+_LIST_PATTERNS = [
+    re.compile(
+        r"(?:show|list|display|give|see|view|get|search|find|look for|look up)"
+        r"(?: me)?(?: all| every)?(?: the| our)?"
+        r"(?: existing| available| saved| current)? manuals"
+        r"(?: available| we have| there are| saved| in the system)?"
+    ),
+    re.compile(r"(?:what|which) manuals (?:are there|do we have|exist|are available|are saved)"),
+    re.compile(r"(?:all )?(?:the )?manuals"),
+    re.compile(
+        r"(?:muestra|muestrame|mostrar|mostrame|lista|listar|listame|ver|dame|busca|buscar)"
+        r"(?: todos)?(?: los)? manuales(?: disponibles| guardados| existentes)?"
+    ),
+    re.compile(r"(?:que|cuales) manuales (?:hay|tenemos|existen)"),
+    re.compile(r"(?:todos )?(?:los )?manuales"),
+]
+
+_SEARCH_PATTERNS = [
+    re.compile(
+        r"(?:search|find|look for|look up|show|list|get|give)(?: me)?(?: for)?(?: all)?(?: the)?"
+        r" (?:manuals?|procedures?|docs?)"
+        r" (?:about|on|for|related to|regarding|that mention|mentioning) (?P<query>.+)"
+    ),
+    re.compile(r"(?:search|find|look for|look up) (?:manuals? )?(?:for )?(?P<query>.+)"),
+    re.compile(r"manuals? (?:about|on|for|related to|regarding) (?P<query>.+)"),
+    re.compile(
+        r"(?:busca|buscar|buscame|encuentra|encontrar|muestra|muestrame|dame)(?: los)?"
+        r" (?:manuales?|procedimientos?)"
+        r" (?:de|sobre|para|acerca de|relacionados con|que mencionen) (?P<query>.+)"
+    ),
+    re.compile(r"manuales? (?:de|sobre|acerca de|relacionados con) (?P<query>.+)"),
+]
+
+_MANUAL_ID = r"(?P<manual_id>man-[0-9a-f]{6,})"
+_OPEN_PATTERNS = [
+    re.compile(
+        r"(?:open|show|get|display|view|read|find|fetch|look up|pull up|abre|abrir|"
+        r"muestra|muestrame|dame|ver|busca|buscar)"
+        r"(?: me)?(?: the| el)?(?: manual)? " + _MANUAL_ID
+    ),
+    re.compile(r"(?:manual )?" + _MANUAL_ID),
+    re.compile(
+        r"(?:open|show|display|view|read|abre|abrir|muestra|muestrame|ver)"
+        r"(?: me)?(?: the| el)? manual (?:called |named |titled |llamado |titulado )?"
+        r"(?P<title>.+)"
+    ),
+]
+
+# Words that ask for more than listing / opening: the agents handle those
+_ESCALATE_RE = re.compile(
+    r"\b(?:summar\w*|checklist|create|write|draft|save|update|edit|change|modify|"
+    r"compare|explain|translate|delete|generate|new|resum\w*|crea\w*|escrib\w*|"
+    r"guarda\w*|actualiz\w*|modific\w*|compar\w*|explic\w*|traduc\w*|borra\w*|"
+    r"genera\w*|nuevo|nueva|and|y|then|luego|how|como|why|por que)\b"
+)
+# Articles and "manual" nouns around a search query ("find the onboarding
+# manual" searches "onboarding")
+_QUERY_FILLER_RE = re.compile(
+    r"^(?:(?:the|a|an|any|our|my|el|la|los|las|un|una|nuestros?|mis?)\s+)+"
+    r"|(?:\s+(?:manuals?|procedures?|docs?|documents?|manuales?|procedimientos?))+$"
+)
+# Longest search query still considered a plain search (words)
+_MAX_QUERY_WORDS = 6
+
+
+@dataclass
+class Intent:
+    kind: str  # "list" | "search" | "open"
+    query: str = ""
+    manual_id: Optional[str] = None
+
+
+_lock = threading.Lock()
+_counts = {"list": 0, "search": 0, "open": 0, "escalated": 0, "errors": 0}
+
+
+def _count(name: str):
+    with _lock:
+        _counts[name] += 1
+
+
+def stats() -> dict:
+    with _lock:
+        routed = _counts["list"] + _counts["search"] + _counts["open"]
+        total = routed + _counts["escalated"]
+        return {
+            "enabled": FAST_ROUTER_ENABLED,
+            **_counts,
+            "fast_path_rate": round(routed / total, 4) if total else 0.0,
+        }
+
+
+def _normalize(question: str) -> str:
+    text = fold(question)
+    text = re.sub(r"[^a-z0-9\-' ]+", " ", text)
+    text = " ".join(text.split())
+    return _POLITE_RE.sub("", text).strip()
+
+
+def classify(question: str) -> Optional[Intent]:
+    """The intent of an obvious list / search / open request, or None."""
+    text = _normalize(question)
+    if not text:
+        return None
+
+    for pattern in _OPEN_PATTERNS:
+        match = pattern.fullmatch(text)
+        if match:
+            manual_id = match.groupdict().get("manual_id")
+            if manual_id:
+                return Intent("open", manual_id="MAN-" + manual_id[4:])
+            title = match.group("title")
+            if not _ESCALATE_RE.search(title):
+                return Intent("open", query=title)
+            return None
+
+    for pattern in _LIST_PATTERNS:
+        if pattern.fullmatch(text):
+            return Intent("list")
+
+    for pattern in _SEARCH_PATTERNS:
+        match = pattern.fullmatch(text)
+        if match:
+            query = _QUERY_FILLER_RE.sub("", match.group("query")).strip()
+            if not query:
+                return Intent("list")
+            if len(query.split()) > _MAX_QUERY_WORDS or _ESCALATE_RE.search(query):
+                return None
+            return Intent("search", query=query)
+    return None
+
+
+def _manual_line(m: dict) -> str:
+    area = f" - {m['business_area']}" if m.get("business_area") else ""
+    return f"- **{m.get('title') or 'Untitled'}** (`{m['manual_id']}`){area}"
+
+
+def _format_list(manuals: List[dict], heading: str) -> str:
+    return "\n".join([heading, ""] + [_manual_line(m) for m in manuals])
+
+
+def _format_manual(manual: dict) -> str:
+    lines = [f"# {manual.get('title') or manual['manual_id']}", ""]
+    lines.append(f"`{manual['manual_id']}`")
+    for label, field in (
+        ("Area", "business_area"),
+        ("Context", "context"),
+        ("Requirements", "requirements"),
+        ("Permissions", "permissions"),
+        ("Outputs", "outputs"),
+    ):
+        if manual.get(field):
+            lines.append(f"- **{label}:** {manual[field]}")
+    steps = manual.get("steps") or []
+    if steps:
+        lines += ["", "## Steps"]
+        for idx, step in enumerate(steps, start=1):
+            critical = " (critical)" if step.get("is_critical") else ""
+            title = step.get("step_title") or f"Step {idx}"
+            lines.append(f"{step.get('step_number', idx)}. **{title}**{critical}")
+            if step.get("step_description"):
+                lines.append(f"   {step['step_description']}")
+    if manual.get("keywords"):
+        lines += ["", "Keywords: " + ", ".join(manual["keywords"])]
+    return "\n".join(lines)
+
+
+async def _answer(intent: Intent) -> Optional[str]:
+    if intent.kind == "list":
+        manuals = await manual_store_async.search_manuals("", limit=FAST_ROUTER_LIST_LIMIT)
+        if not manuals:
+            return "There are no saved manuals yet."
+        return _format_list(manuals, f"Latest manuals ({len(manuals)}):")
+
+    if intent.kind == "search":
+        manuals = await manual_store_async.search_manuals(
+            intent.query, limit=FAST_ROUTER_LIST_LIMIT
+        )
+        if not manuals:
+            return None  # the search agent can still try semantic search
+        return _format_list(manuals, f"Manuals about \"{intent.query}\":")
+
+    manual_id = intent.manual_id
+    if manual_id is None:
+        # By title: only an exact (accent / case-insensitive) title match counts
+        candidates = await manual_store_async.search_manuals(intent.query, limit=5)
+        exact = [m for m in candidates if fold(m.get("title") or "").strip() == intent.query]
+        if len(exact) != 1:
+            return None
+        manual_id = exact[0]["manual_id"]
+    manual = await manual_store_async.get_manual(manual_id)
+    if manual is None:
+        return None if intent.manual_id is None else f"Manual `{manual_id}` was not found."
+    return _format_manual(manual)
+
+
+async def answer(question: str) -> Optional[tuple]:
+    """(intent kind, Markdown answer) for an obvious request, or None to escalate."""
+    if not FAST_ROUTER_ENABLED:
+        return None
+    intent = classify(question)
+    if intent is None:
+        _count("escalated")
+        return None
+    try:
+        text = await _answer(intent)
+    except Exception as e:
+        log.warning("fast path failed, escalating to the agents", extra={"error": repr(e)})
+        _count("errors")
+        text = None
+    if text is None:
+        _count("escalated")
+        return None
+    _count(intent.kind)
+    return intent.kind, text
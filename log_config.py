@@ -0,0 +1,92 @@
+# log_config.py - Structured, levelled logging for the server hot paths
+"""
+The request path (main.py, the agent tools, the store) used to print().
+It now logs through the standard logging module, configured once here:
+
+- LOG_LEVEL: DEBUG / INFO / WARNING / ERROR (default INFO). Per-result
+  detail (each manual found by a search) is DEBUG.
+- LOG_FORMAT: "text" (default) prints `time LEVEL logger message key=value`;
+  "json" prints one JSON object per line for log collectors.
+
+Fields passed with `extra={...}` become key=value pairs / JSON keys, so
+`log.info("manual saved", extra={"manual_id": ...})` can be filtered by
+manual_id. Lines written inside a traced request get its trace_id.
+"""
+import json
+import logging
+import sys
+import time
+
+import tracing
+from settings import LOG_FORMAT, LOG_LEVEL
+
+# Attributes every LogRecord has; anything else came from `extra`
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+_configured = False
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS}
+
+
+class TraceIdFilter(logging.Filter):
+    """Adds the active trace ID (tracing.py) to the record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace_id = tracing.current_trace_id()
+        if trace_id and not hasattr(record, "trace_id"):
+            record.trace_id = trace_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class KeyValueFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+        return line
+
+
+def setup_logging():
+    """Configures the root logger once (uvicorn's own loggers are left alone)."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else KeyValueFormatter())
+    if tracing.enabled():
+        handler.addFilter(TraceIdFilter())
+    root = logging.getLogger()
+    root.handlers = [h for h in root.handlers if not isinstance(h, logging.StreamHandler)]
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
+    return logging.getLogger(name)
@@ -1,25 +1,61 @@
 # main.py - FastAPI Server for Manuel El Manual
-from fastapi import FastAPI, HTTPException
+import time
+
+# Import-time budget: everything below must stay cheap. The Google SDKs,
+# the agents and the storage clients are built lazily (agent_runtime).
+_IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from google.genai import types
-from google.adk.runners import InMemoryRunner
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from typing import Optional
 import uvicorn
 import os
 import asyncio
+import json
+import gzip
+
+import agent_runtime
+from agent_scheduler import SchedulerBusy, scheduler
+from answer_cache import RunRecorder, answer_cache
+import fast_router
+import manual_store_async
+import manual_cache
+import metrics
+import resilience
+import tracing
+from log_config import get_logger
+from settings import IMPORT_TIME_BUDGET_MS, WARMUP_ON_STARTUP
+
+log = get_logger("main")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up in the background: the worker accepts traffic (and answers
+    # /health/live) immediately; /health/ready turns true when it finishes.
+    if WARMUP_ON_STARTUP:
+        app.state.warmup = asyncio.create_task(asyncio.to_thread(agent_runtime.warm_up))
+    yield
+    # Spans still buffered go out before the worker exits
+    await asyncio.to_thread(tracing.shutdown)
 
-from agents.coordinator import create_coordinator
-from agents.manual_agent import create_manual_agent
-from agents.data_agent import create_data_agent
-from agents.search_agent import create_search_agent
-from agents.generator_agent import create_generator_agent
-from manual_store_gcp import search_manuals
 
 app = FastAPI(
     title="Manuel El Manual",
     description="AI-powered manual creation and management system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS configuration
@@ -31,44 +67,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Retry options for agents
-retry = types.HttpRetryOptions()
 
-print("🚀 Initializing AI agents...")
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    """Counts and times every request by route template (not raw path)."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        labels = {
+            "method": request.method,
+            "route": getattr(route, "path", "unmatched"),
+            "status": status,
+        }
+        metrics.http_requests.inc(**labels)
+        metrics.http_duration.observe(time.perf_counter() - started, **labels)
 
-# Initialize agents
-try:
-    manual_agent = create_manual_agent(retry)
-    print("✅ Manual Agent (Italo) initialized")
-    
-    data_agent = create_data_agent(retry)
-    print("✅ Data Agent (Lorena) initialized")
-    
-    search_agent = create_search_agent(retry)
-    print("✅ Search Agent (Sofia) initialized")
-    
-    generator_agent = create_generator_agent(retry)
-    print("✅ Generator Agent (Emilio) initialized")
-    
-    coordinator = create_coordinator(
-        manual_agent, data_agent, search_agent, generator_agent, retry
-    )
-    print("✅ Coordinator Agent (Manuel) initialized")
-    
-    # Initialize runner with app_name matching the package directory
-    # The Runner is the engine that executes the agent.
-    # We use InMemoryRunner for development, which stores session state in RAM.
-    # 'app_name' is used to namespace the sessions.
-    runner = InMemoryRunner(agent=coordinator, app_name="agents")
-    print("✅ Runner initialized")
-    print("🎉 All agents ready!\n")
-except Exception as e:
-    print(f"❌ Error initializing agents: {e}")
-    raise
+
+def _observe_ask(endpoint: str, route: str, received: float, span=None):
+    """End-to-end time of one /ask or /ask/stream, by how it was answered."""
+    metrics.ask_duration.observe(time.perf_counter() - received, endpoint=endpoint, route=route)
+    tracing.set_attributes(span, {"ask.route": route})
 
 
 class QuestionRequest(BaseModel):
     question: str
+    # Conversation ID chosen by the client; reuse it to continue a conversation
+    session_id: Optional[str] = Field(None, max_length=128)
 
 
 @app.get("/")
@@ -79,8 +108,219 @@ async def serve_index():
     return FileResponse("index.html")
 
 
+async def _ensure_session(runner, session_id: Optional[str]) -> str:
+    """
+    Returns the session to use, creating it if it does not exist.
+    The client sends its session ID to continue a conversation; without one
+    we start a new session. Sessions are persistent and shared by all
+    workers (session_store).
+    """
+    import uuid
+
+    session_id = session_id or f"session_{uuid.uuid4().hex}"
+
+    # The Runner needs the session to exist in the SessionService.
+    session = await runner.session_service.get_session(
+        app_name=agent_runtime.APP_NAME,
+        user_id="default_user",
+        session_id=session_id
+    )
+    if session is None:
+        from google.adk.errors.already_exists_error import AlreadyExistsError
+
+        try:
+            session = await runner.session_service.create_session(
+                app_name=agent_runtime.APP_NAME,
+                user_id="default_user",
+                session_id=session_id
+            )
+        except AlreadyExistsError:
+            # another worker created it at the same time
+            session = await runner.session_service.get_session(
+                app_name=agent_runtime.APP_NAME,
+                user_id="default_user",
+                session_id=session_id
+            )
+    return session
+
+
+async def _append_turn(runner, session, question: str, answer: str):
+    """Adds a turn answered without the agents to the session."""
+    from google.adk.events import Event
+    from google.genai import types
+    import uuid
+
+    invocation_id = f"e-{uuid.uuid4()}"
+    for author, role, text in (
+        ("user", "user", question),
+        (runner.agent.name, "model", answer),
+    ):
+        await runner.session_service.append_event(
+            session,
+            Event(
+                invocation_id=invocation_id,
+                author=author,
+                content=types.Content(role=role, parts=[types.Part(text=text)]),
+            ),
+        )
+
+
+async def _cached_answer(question: str, session_id: Optional[str]):
+    """
+    Answer from answer_cache for the first turn of a conversation, or None.
+    On a hit the question and answer are added to the session, so the
+    conversation can continue from there. Returns (session_id, entry).
+    """
+    if session_id:
+        runner = await asyncio.to_thread(agent_runtime.get_runner)
+        session = await _ensure_session(runner, session_id)
+        if session.events:
+            return None  # follow-up turn: depends on the conversation
+
+    entry = answer_cache.get(question)
+    if entry is None:
+        return None
+
+    runner = await asyncio.to_thread(agent_runtime.get_runner)
+    session = await _ensure_session(runner, session_id)
+    await _append_turn(runner, session, question, entry["answer"])
+    log.info("answer from cache", extra={"route": " > ".join(entry["route"])})
+    return session.id, entry
+
+
+async def _fast_answer(question: str, session_id: Optional[str]):
+    """
+    Answer from fast_router for obvious list / search / open requests (no
+    model call) on the first turn of a conversation, or None to run the
+    agents. Returns (session_id, intent, answer).
+    """
+    if session_id:
+        runner = await asyncio.to_thread(agent_runtime.get_runner)
+        session = await _ensure_session(runner, session_id)
+        if session.events:
+            return None  # follow-up turn: the active agent answers in context
+
+    routed = await fast_router.answer(question)
+    if routed is None:
+        return None
+    intent, answer = routed
+
+    runner = await asyncio.to_thread(agent_runtime.get_runner)
+    session = await _ensure_session(runner, session_id)
+    await _append_turn(runner, session, question, answer)
+    log.info("fast path answer", extra={"intent": intent})
+    return session.id, intent, answer
+
+
+async def _agent_events(question: str, session_id: Optional[str], streaming: bool):
+    """
+    Runs the coordinator on the runner's async event stream (no thread) and
+    yields simple dicts as events arrive:
+    - {"type": "session", "session_id"}: first, always
+    - {"type": "token", "text", "author"}: partial text (only if `streaming`)
+    - {"type": "tool_call", "name", "author"} / {"type": "tool_result", "name", "author"}
+    - {"type": "final", "answer", "tools"}: last, the complete answer and the
+      turn's tool counts (agents.tools)
+    First turns through read-only agents and tools are stored in answer_cache.
+    """
+    from google.adk.agents.run_config import RunConfig, StreamingMode
+    from google.genai import types
+
+    from agents import tools as agent_tools
+
+    # Built on first use if the startup warm-up has not finished yet
+    runner = await asyncio.to_thread(agent_runtime.get_runner)
+    session = await _ensure_session(runner, session_id)
+    session_id = session.id
+    yield {"type": "session", "session_id": session_id}
+
+    # Only first turns can be cached: later ones depend on the conversation
+    recorder = RunRecorder() if not session.events else None
+    started = time.monotonic()
+
+    # Create a proper Content object for the message
+    # The ADK expects a 'types.Content' object, not a raw string.
+    message = types.Content(
+        role="user",
+        parts=[types.Part(text=question)]
+    )
+    run_config = RunConfig(
+        streaming_mode=StreamingMode.SSE if streaming else StreamingMode.NONE
+    )
+
+    final_response = ""
+    invocation_id = None
+    # Events can be:
+    # - Partial text (token chunks, with SSE streaming)
+    # - Tool calls (agent asking to run a function) and their results
+    # - Complete responses (the last one is the text to show the user)
+    try:
+        async for event in runner.run_async(
+            user_id="default_user",
+            session_id=session_id,
+            new_message=message,
+            run_config=run_config,
+        ):
+            invocation_id = invocation_id or event.invocation_id
+            parts = event.content.parts if event.content and event.content.parts else []
+            text = "".join(p.text for p in parts if p.text and not p.thought)
+
+            if event.partial:
+                if text:
+                    yield {"type": "token", "text": text, "author": event.author}
+                continue
+
+            if recorder is not None:
+                recorder.observe(event)
+            for call in event.get_function_calls():
+                yield {"type": "tool_call", "name": call.name, "author": event.author}
+            for response in event.get_function_responses():
+                yield {"type": "tool_result", "name": response.name, "author": event.author}
+            if text and event.is_final_response():
+                final_response = text
+    finally:
+        # Frees the turn's memoized tool results (also on errors)
+        tool_counts = agent_tools.finish_turn(invocation_id)
+
+    if tool_counts["calls"]:
+        log.info(
+            "tools this turn",
+            extra={k: tool_counts[k] for k in ("calls", "storage_calls", "deduped")},
+        )
+
+    if recorder is not None and final_response:
+        answer_cache.put(question, recorder, final_response, time.monotonic() - started)
+    yield {
+        "type": "final",
+        "answer": final_response or "No response generated",
+        "tools": tool_counts,
+    }
+
+
+def _user_key(http_request: Request, request: QuestionRequest) -> str:
+    """Who the run is queued for: X-User-Id, else the session, else the client IP."""
+    return (
+        http_request.headers.get("x-user-id")
+        or request.session_id
+        or (http_request.client.host if http_request.client else "anonymous")
+    )
+
+
+async def _admit(user: str):
+    """Waits for an agent-run slot; 429 + Retry-After if the scheduler is busy."""
+    try:
+        await scheduler.acquire(user)
+    except SchedulerBusy as e:
+        log.warning("ask rejected", extra={"user": user, "reason": e.reason})
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server busy ({e.reason}), retry in {e.retry_after} s",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+
 @app.post("/ask")
-async def ask_question(request: QuestionRequest):
+async def ask_question(request: QuestionRequest, http_request: Request):
     """
     Process user questions through the coordinator agent.
     
@@ -89,113 +329,330 @@ async def ask_question(request: QuestionRequest):
     - Data Agent (Lorena): For saving to GCP
     - Search Agent (Sofia): For finding existing manuals
     - Generator Agent (Emilio): For summaries and checklists
+
+    Returns the complete answer at the end; /ask/stream sends it as it arrives.
+    Runs go through the scheduler (agent_scheduler): 429 when it is busy.
+    Repeated first questions are answered from answer_cache, and obvious
+    list / search / open requests by fast_router, both without a slot.
+
+    Each request is one trace (tracing.py); its ID is returned as `trace_id`
+    (and as the X-Trace-Id header of an error).
     """
+    received = time.perf_counter()
+    span = tracing.start_span("ask", {"ask.endpoint": "/ask", "session.id": request.session_id})
+    trace_id = tracing.trace_id(span)
     try:
-        print(f"\n💬 User question: {request.question}")
-        
-        # Create a proper Content object for the message
-        # The ADK expects a 'types.Content' object, not a raw string.
-        message = types.Content(
-            role="user",
-            parts=[types.Part(text=request.question)]
-        )
-        
-        # Generate a unique session ID for each request
-        # In a real app, this would come from the client (e.g., cookie or header)
-        import uuid
-        session_id = f"session_{uuid.uuid4().hex[:8]}"
-        
-        # Create session explicitly before running
-        # This fixes the "Session not found" error.
-        # The Runner needs a session to exist in the SessionService before it can attach to it.
-        await runner.session_service.create_session(
-            app_name="agents",
-            user_id="default_user",
-            session_id=session_id
-        )
+        with tracing.use_span(span):
+            result = await _ask(request, http_request, received, span)
+    except HTTPException as e:
+        if trace_id:
+            e.headers = {**(e.headers or {}), "X-Trace-Id": trace_id}
+        raise
+    return {**result, "trace_id": trace_id}
 
-        # Run the agent in a separate thread to avoid blocking the event loop
-        # Note: runner.run is synchronous, so we use to_thread
-        # BUT we need to consume the generator, so we define a helper
-        def run_agent():
-            final_response = ""
-            # The runner.run method returns a generator of events.
-            # We must iterate through ALL events to let the agent complete its work.
-            # Events can be:
-            # - Thought updates (agent thinking)
-            # - Tool calls (agent asking to run a function)
-            # - Final response (the text to show the user)
-            for event in runner.run(
-                user_id="default_user",
-                session_id=session_id,
-                new_message=message
-            ):
-                # The final event typically contains the response
-                if hasattr(event, 'text'):
-                    final_response = event.text
-                elif hasattr(event, 'content'):
-                    final_response = str(event.content)
-                elif hasattr(event, 'message'):
-                    final_response = str(event.message)
-            return final_response
-        
-        # Execute the agent logic in a thread pool to keep the server responsive
-        answer = await asyncio.to_thread(run_agent)
-        
-        # Fallback if no response found
-        if not answer:
-            answer = "No response generated"
-        
-        print(f"🤖 Agent response: {answer}\n")
-        
-        return {"answer": answer}
+
+async def _ask(request: QuestionRequest, http_request: Request, received: float, span):
+    """Body of /ask, inside the request's span."""
+    cached = await _cached_answer(request.question, request.session_id)
+    if cached is not None:
+        session_id, entry = cached
+        _observe_ask("ask", "cached", received, span)
+        return {"answer": entry["answer"], "session_id": session_id, "cached": True}
+
+    fast = await _fast_answer(request.question, request.session_id)
+    if fast is not None:
+        session_id, intent, answer = fast
+        _observe_ask("ask", "fast_path", received, span)
+        return {
+            "answer": answer,
+            "session_id": session_id,
+            "cached": False,
+            "fast_path": intent,
+        }
+
+    try:
+        await _admit(_user_key(http_request, request))
+    except HTTPException:
+        _observe_ask("ask", "rejected", received, span)
+        raise
+    started = time.monotonic()
+    try:
+        log.info("user question", extra={"question": request.question})
+
+        answer, session_id, tools = "", request.session_id, None
+        async for item in _agent_events(request.question, request.session_id, streaming=False):
+            if item["type"] == "session":
+                session_id = item["session_id"]
+            elif item["type"] == "final":
+                answer, tools = item["answer"], item["tools"]
+
+        log.info("agent response", extra={"session_id": session_id, "answer": answer})
+        tracing.set_attributes(span, {"session.id": session_id})
+
+        return {"answer": answer, "session_id": session_id, "cached": False, "tools": tools}
         
+    except resilience.CircuitOpenError as e:
+        # Gemini / BigQuery / GCS is failing: fail fast, the client can retry later
+        log.warning("dependency unavailable", extra={"dependency": e.dependency})
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
-        print(f"❌ Error processing request: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("error processing request")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    finally:
+        scheduler.release(time.monotonic() - started)
+        _observe_ask("ask", "agents", received, span)
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest, http_request: Request):
+    """
+    Same as /ask, streamed as Server-Sent Events while the agents work:
+    `session`, then `token` (partial text), `tool_call` / `tool_result`
+    (progress), and finally `final` with the complete answer (or `error`).
+    The `session` event carries the request's `trace_id`.
+    """
+    received = time.perf_counter()
+    span = tracing.start_span(
+        "ask", {"ask.endpoint": "/ask/stream", "session.id": request.session_id}
+    )
+    trace_id = tracing.trace_id(span)
+    # The span ends when the stream does (release), not when this returns
+    with tracing.use_span(span, end_on_exit=False):
+        cached = await _cached_answer(request.question, request.session_id)
+        fast = None if cached is not None else await _fast_answer(
+            request.question, request.session_id
+        )
+    if cached is not None or fast is not None:
+        if cached is not None:
+            session_id, entry = cached
+            final = {"type": "final", "answer": entry["answer"], "cached": True}
+        else:
+            session_id, intent, answer = fast
+            final = {"type": "final", "answer": answer, "fast_path": intent}
+        events = ({"type": "session", "session_id": session_id, "trace_id": trace_id}, final)
+        _observe_ask("ask_stream", "cached" if cached is not None else "fast_path", received, span)
+        tracing.end_span(span)
+        return StreamingResponse(
+            (f"event: {e['type']}\ndata: {json.dumps(e)}\n\n" for e in events),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    try:
+        await _admit(_user_key(http_request, request))
+    except HTTPException as e:
+        _observe_ask("ask_stream", "rejected", received, span)
+        tracing.end_span(span)
+        if trace_id:
+            e.headers = {**(e.headers or {}), "X-Trace-Id": trace_id}
+        raise
+    started = time.monotonic()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            scheduler.release(time.monotonic() - started)
+            _observe_ask("ask_stream", "agents", received, span)
+            tracing.end_span(span)
+
+    log.info("user question (stream)", extra={"question": request.question})
+
+    async def event_stream():
+        try:
+            with tracing.use_span(span, end_on_exit=False):
+                async for item in _agent_events(
+                    request.question, request.session_id, streaming=True
+                ):
+                    if item["type"] == "session":
+                        item["trace_id"] = trace_id
+                        tracing.set_attributes(span, {"session.id": item["session_id"]})
+                    elif item["type"] == "final":
+                        log.info("agent response", extra={"answer": item["answer"]})
+                    yield f"event: {item['type']}\ndata: {json.dumps(item)}\n\n"
+        except Exception as e:
+            log.exception("error processing request")
+            error = {"type": "error", "detail": f"Error processing request: {str(e)}"}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+        finally:
+            release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # no proxy buffering: each event must reach the browser right away
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # also frees the slot if the client left before the stream started
+        background=BackgroundTask(release),
+    )
 
 
 @app.get("/manuals")
-async def get_manuals():
+async def get_manuals(
+    q: str = "",
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
     """
-    Get all manuals from BigQuery.
+    Get manuals from BigQuery, newest first (or ranked, if `q` is given).
     Returns a list of manual metadata (without full step details).
+
+    - `limit` / `cursor`: pagination; pass `next_cursor` back to get the next page.
+    - `fields`: comma-separated columns to return, e.g. `manual_id,title`.
+    - `format=ndjson`: streams the whole catalog, one JSON object per line.
     """
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
     try:
-        print("\n📚 Fetching all manuals...")
-        
-        # Empty query returns all manuals sorted by last_updated DESC
-        results = search_manuals("")
-        
-        print(f"✅ Found {len(results)} manuals\n")
-        
-        return {"results": results}
-        
+        if format == "ndjson":
+            log.info("exporting catalog as NDJSON")
+            rows = await manual_store_async.iter_manuals(columns)
+            return StreamingResponse(
+                (json.dumps(row, default=str) + "\n" for row in rows),
+                media_type="application/x-ndjson",
+            )
+
+
+        # Empty query returns manuals sorted by last_updated DESC
+        page = await manual_store_async.search_manuals_page(
+            q, limit=limit, cursor=cursor, columns=columns
+        )
+
+        log.info("manuals fetched", extra={"q": q, "count": len(page["results"])})
+
+        return page
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"❌ Error fetching manuals: {e}")
+        log.exception("error fetching manuals")
         raise HTTPException(
             status_code=500, 
             detail=f"Error fetching manuals: {str(e)}"
         )
 
 
+@app.get("/manuals/{manual_id}/html")
+async def get_manual_html_page(manual_id: str, request: Request):
+    """
+    Rendered HTML of the latest version of a manual.
+    Served precompressed (brotli/gzip) from the local disk cache, with ETag / 304.
+    """
+    try:
+        page = await manual_store_async.get_manual_html(manual_id)
+    except Exception as e:
+        log.exception("error fetching manual HTML", extra={"manual_id": manual_id})
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching manual HTML: {str(e)}"
+        )
+    if page is None:
+        raise HTTPException(status_code=404, detail=f"Manual {manual_id} not found")
+
+    etag = f'"{page["content_hash"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    accept = request.headers.get("accept-encoding", "")
+    variants = page["variants"]
+    if "br" in accept and "br" in variants:
+        headers["Content-Encoding"] = "br"
+        return FileResponse(variants["br"], media_type="text/html; charset=utf-8", headers=headers)
+    if "gzip" in accept:
+        headers["Content-Encoding"] = "gzip"
+        return FileResponse(variants["gz"], media_type="text/html; charset=utf-8", headers=headers)
+
+    with open(variants["gz"], "rb") as f:
+        return HTMLResponse(gzip.decompress(f.read()), headers=headers)
+
+
+@app.get("/manuals/{manual_id}/derived")
+async def get_manual_derived(manual_id: str):
+    """
+    Summary, operational checklist and communication message of the latest
+    version of a manual. Served from storage (generated in the background
+    when the manual was saved); generated live only if they don't exist yet.
+    Answers 202 with source "pending" while they are being generated.
+    """
+    try:
+        derived = await manual_store_async.get_derivations(manual_id)
+    except Exception as e:
+        log.exception("error fetching manual derivations", extra={"manual_id": manual_id})
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching manual derivations: {str(e)}"
+        )
+    if derived is None:
+        raise HTTPException(status_code=404, detail=f"Manual {manual_id} not found")
+    if derived["source"] == "pending":
+        # Being generated right now (the manual was just saved)
+        return JSONResponse(derived, status_code=202, headers={"Retry-After": "5"})
+    return derived
+
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """
+    Health check endpoint.
+    `status` is liveness (the process answers); `ready` says whether the
+    agents and storage clients are built (see /health/ready).
+    """
     return {
         "status": "healthy",
+        "ready": agent_runtime.is_ready(),
+        "import_ms": IMPORT_MS,
+        "startup": agent_runtime.readiness(),
         "agents": {
             "coordinator": "Manuel",
             "manual_agent": "Italo",
             "data_agent": "Lorena",
             "search_agent": "Sofia",
             "generator_agent": "Emilio"
-        }
+        },
+        "cache": manual_cache.stats(),
+        "sessions": agent_runtime.session_stats(),
+        "tools": agent_runtime.tool_stats(),
+        "scheduler": scheduler.stats(),
+        "answer_cache": answer_cache.stats(),
+        "fast_router": fast_router.stats(),
+        "context": agent_runtime.context_stats(),
+        "cassettes": agent_runtime.cassette_stats(),
+        "dependencies": resilience.stats(),
     }
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics of this worker (see metrics.py for the list)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and the event loop answers."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 503 until the warm-up has built agents and clients."""
+    state = agent_runtime.readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
+
+
+IMPORT_MS = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+if IMPORT_MS > IMPORT_TIME_BUDGET_MS:
+    log.warning(
+        "main imported over budget",
+        extra={"import_ms": IMPORT_MS, "budget_ms": IMPORT_TIME_BUDGET_MS},
+    )
+
+
 if __name__ == "__main__":
     print("\n" + "="*60)
     print("🎯 Starting Manuel El Manual Server")
@@ -1,14 +1,17 @@
 # main_simple.py - Simplified FastAPI Server WITHOUT Runner
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 from google import genai
 from google.genai import types
 import uvicorn
 import os
+import json
+import gzip
 
-from manual_store_gcp import search_manuals
+import manual_store_async
 
 app = FastAPI(
     title="Manuel El Manual",
@@ -48,8 +51,8 @@ async def ask_question(request: QuestionRequest):
     try:
         print(f"\n💬 User question: {request.question}")
         
-        # Direct Gemini API call
-        response = client.models.generate_content(
+        # Direct Gemini API call (async client: doesn't block the event loop)
+        response = await client.aio.models.generate_content(
             model='gemini-2.0-flash-exp',
             contents=request.question
         )
@@ -68,21 +71,44 @@ async def ask_question(request: QuestionRequest):
 
 
 @app.get("/manuals")
-async def get_manuals():
+async def get_manuals(
+    q: str = "",
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
     """
-    Get all manuals from BigQuery.
+    Get manuals from BigQuery, newest first (or ranked, if `q` is given).
     Returns a list of manual metadata (without full step details).
+
+    - `limit` / `cursor`: pagination; pass `next_cursor` back to get the next page.
+    - `fields`: comma-separated columns to return, e.g. `manual_id,title`.
+    - `format=ndjson`: streams the whole catalog, one JSON object per line.
     """
+    columns = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
     try:
-        print("\n📚 Fetching all manuals...")
-        
-        # Empty query returns all manuals sorted by last_updated DESC
-        results = search_manuals("")
-        
-        print(f"✅ Found {len(results)} manuals\n")
-        
-        return {"results": results}
-        
+        if format == "ndjson":
+            print("\n📚 Exporting catalog as NDJSON...")
+            rows = await manual_store_async.iter_manuals(columns)
+            return StreamingResponse(
+                (json.dumps(row, default=str) + "\n" for row in rows),
+                media_type="application/x-ndjson",
+            )
+
+        print("\n📚 Fetching manuals...")
+
+        # Empty query returns manuals sorted by last_updated DESC
+        page = await manual_store_async.search_manuals_page(
+            q, limit=limit, cursor=cursor, columns=columns
+        )
+
+        print(f"✅ Found {len(page['results'])} manuals\n")
+
+        return page
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"❌ Error fetching manuals: {e}")
         raise HTTPException(
@@ -91,6 +117,41 @@ async def get_manuals():
         )
 
 
+@app.get("/manuals/{manual_id}/html")
+async def get_manual_html_page(manual_id: str, request: Request):
+    """
+    Rendered HTML of the latest version of a manual.
+    Served precompressed (brotli/gzip) from the local disk cache, with ETag / 304.
+    """
+    try:
+        page = await manual_store_async.get_manual_html(manual_id)
+    except Exception as e:
+        print(f"❌ Error fetching manual HTML: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching manual HTML: {str(e)}"
+        )
+    if page is None:
+        raise HTTPException(status_code=404, detail=f"Manual {manual_id} not found")
+
+    etag = f'"{page["content_hash"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    accept = request.headers.get("accept-encoding", "")
+    variants = page["variants"]
+    if "br" in accept and "br" in variants:
+        headers["Content-Encoding"] = "br"
+        return FileResponse(variants["br"], media_type="text/html; charset=utf-8", headers=headers)
+    if "gzip" in accept:
+        headers["Content-Encoding"] = "gzip"
+        return FileResponse(variants["gz"], media_type="text/html; charset=utf-8", headers=headers)
+
+    with open(variants["gz"], "rb") as f:
+        return HTMLResponse(gzip.decompress(f.read()), headers=headers)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,298 @@
+# manual_cache.py - Read-through cache for manual_store_gcp
+"""
+Two-level cache in front of get_manual / search_manuals.
+
+- Level 1: in-process LRU with TTL (one per server process).
+- Level 2 (optional): SQLite file shared by every process on the host,
+  enabled with MANUAL_CACHE_SHARED_PATH.
+
+Invalidation is version-aware: each manual has a generation counter that
+save_manual bumps. Entries remember the generation they were loaded at, so
+a save in one process invalidates the copies held by every other process
+that shares the level-2 file.
+
+The same two tiers remember recent saves by idempotency key for
+SAVE_DEDUP_WINDOW_SECONDS (recent_save / remember_save), so a repeated save
+is recognized in any process on the host.
+"""
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from settings import (
+    MANUAL_CACHE_MAX_ENTRIES,
+    MANUAL_CACHE_SHARED_PATH,
+    MANUAL_CACHE_TTL_SECONDS,
+    SAVE_DEDUP_WINDOW_SECONDS,
+)
+
+log = logging.getLogger("manual_cache")
+
+# Search results depend on the whole catalog, so they share one generation
+CATALOG = "catalog"
+
+
+class TTLCache:
+    """Bounded LRU with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns (found, value)."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl_seconds if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class SharedCache:
+    """Cache shared between processes, stored in a SQLite file (WAL mode)."""
+
+    def __init__(self, path: str, ttl_seconds: float):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " name TEXT PRIMARY KEY, gen INTEGER NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, json.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + self.ttl_seconds),
+        )
+        # Limpieza oportunista de entradas vencidas
+        conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def generation(self, name: str) -> int:
+        row = self._conn().execute(
+            "SELECT gen FROM generations WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name: str) -> int:
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO generations (name, gen) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET gen = gen + 1",
+            (name,),
+        )
+        return self.generation(name)
+
+    def stats(self) -> dict:
+        return {"path": self.path, "hits": self.hits, "misses": self.misses}
+
+
+_local_cache = TTLCache(MANUAL_CACHE_MAX_ENTRIES, MANUAL_CACHE_TTL_SECONDS)
+_shared_cache = (
+    SharedCache(MANUAL_CACHE_SHARED_PATH, MANUAL_CACHE_TTL_SECONDS)
+    if MANUAL_CACHE_SHARED_PATH
+    else None
+)
+_local_saves = TTLCache(MANUAL_CACHE_MAX_ENTRIES, max(SAVE_DEDUP_WINDOW_SECONDS, 1))
+_shared_saves = (
+    SharedCache(MANUAL_CACHE_SHARED_PATH, SAVE_DEDUP_WINDOW_SECONDS)
+    if MANUAL_CACHE_SHARED_PATH and SAVE_DEDUP_WINDOW_SECONDS > 0
+    else None
+)
+_local_generations: dict = {}
+_gen_lock = threading.Lock()
+
+
+def generation(name: str) -> int:
+    """Current generation of a manual_id (or CATALOG)."""
+    if _shared_cache is not None:
+        try:
+            return _shared_cache.generation(name)
+        except sqlite3.Error as e:
+            log.warning("shared tier unavailable", extra={"error": repr(e)})
+    return _local_generations.get(name, 0)
+
+
+def _entry_key(kind: str, key: str) -> str:
+    return f"{kind}:{key}"
+
+
+def get(kind: str, key: str, version_of: str):
+    """
+    Looks up `kind:key` in level 1 and then level 2.
+    `version_of` is the generation the entry depends on (a manual_id or CATALOG).
+    Returns (found, value); values are copies, callers may mutate them.
+    """
+    entry_key = _entry_key(kind, key)
+    gen = generation(version_of)
+
+    found, item = _local_cache.get(entry_key)
+    if found and item[0] == gen:
+        return True, copy.deepcopy(item[1])
+
+    if _shared_cache is not None:
+        try:
+            found, item = _shared_cache.get(entry_key)
+        except sqlite3.Error as e:
+            log.warning("shared tier unavailable", extra={"error": repr(e)})
+            found = False
+        if found and item["gen"] == gen:
+            _local_cache.set(entry_key, (gen, item["value"]))
+            return True, copy.deepcopy(item["value"])
+
+    return False, None
+
+
+def put(kind: str, key: str, value, version_of: str, gen: int | None = None):
+    """
+    Stores a value loaded from BigQuery. Pass the `gen` read *before* loading
+    so a save that races with the load does not get masked.
+    """
+    entry_key = _entry_key(kind, key)
+    if gen is None:
+        gen = generation(version_of)
+    _local_cache.set(entry_key, (gen, copy.deepcopy(value)))
+    if _shared_cache is not None:
+        try:
+            _shared_cache.set(entry_key, {"gen": gen, "value": value})
+        except sqlite3.Error as e:
+            log.warning("shared tier unavailable", extra={"error": repr(e)})
+
+
+def invalidate_manual(manual_id: str):
+    """Called after save_manual writes `manual_id`: drops it and every search."""
+    with _gen_lock:
+        for name in (manual_id, CATALOG):
+            _local_generations[name] = _local_generations.get(name, 0) + 1
+    _local_cache.delete(_entry_key("manual", manual_id))
+
+    if _shared_cache is not None:
+        try:
+            _shared_cache.delete(_entry_key("manual", manual_id))
+            _shared_cache.bump(manual_id)
+            _shared_cache.bump(CATALOG)
+        except sqlite3.Error as e:
+            log.warning("shared tier unavailable", extra={"error": repr(e)})
+
+
+def recent_save(idempotency_key: str) -> dict | None:
+    """
+    Result of a save with this idempotency key made within the dedup window,
+    or None. A result is only valid while its manual has not been saved again.
+    """
+    if SAVE_DEDUP_WINDOW_SECONDS <= 0:
+        return None
+    entry_key = _entry_key("save", idempotency_key)
+    found, item = _local_saves.get(entry_key)
+    if not found and _shared_saves is not None:
+        try:
+            found, item = _shared_saves.get(entry_key)
+        except sqlite3.Error as e:
+            log.warning("shared tier unavailable", extra={"error": repr(e)})
+            found = False
+    if not found or item["gen"] != generation(item["value"]["manual_id"]):
+        return None
+    return copy.deepcopy(item["value"])
+
+
+def remember_save(idempotency_key: str, result: dict):
+    """Called after a save (and its invalidate_manual) succeeded."""
+    if SAVE_DEDUP_WINDOW_SECONDS <= 0:
+        return
+    entry_key = _entry_key("save", idempotency_key)
+    item = {"gen": generation(result["manual_id"]), "value": copy.deepcopy(result)}
+    _local_saves.set(entry_key, item)
+    if _shared_saves is not None:
+        try:
+            _shared_saves.set(entry_key, item)
+        except sqlite3.Error as e:
+            log.warning("shared tier unavailable", extra={"error": repr(e)})
+
+
+def clear():
+    _local_cache.clear()
+
+
+def stats() -> dict:
+    return {
+        "local": _local_cache.stats(),
+        "shared": _shared_cache.stats() if _shared_cache is not None else None,
+        "recent_saves": _local_saves.stats(),
+        "ttl_seconds": MANUAL_CACHE_TTL_SECONDS,
+    }
@@ -0,0 +1,222 @@
+# manual_derivations.py - Summary, checklist and message generated once per manual version
+"""
+The generator agent used to write a manual's summary, operational checklist
+and communication message on every request, although for the same version
+the result is the same. They are now derived once, in the background, when
+save_manual finishes:
+
+- schedule(manual) queues the derivation on a single background thread and
+  returns at once; the save does not wait for Gemini.
+- derive(manual) calls Gemini once (JSON output with the three fields) and
+  stores the result with manual_store_gcp.save_derivations: a JSON blob next
+  to the HTML in GCS, a row in manual_derivations and a local disk copy.
+- get_or_derive(manual_id) serves the stored artifacts. While the version is
+  still being derived it answers "pending" instead of calling Gemini again;
+  when nothing exists (for example, manuals saved before this stage) it
+  generates live, returns the result and leaves the storing to the
+  background thread.
+
+Derivations are keyed by record_hash, so re-saving identical content never
+derives twice. Disabled with MANUAL_DERIVATIONS_ENABLED=false.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import resilience
+from settings import MANUAL_DERIVATIONS_ENABLED, MANUAL_DERIVATIONS_MODEL
+
+log = logging.getLogger("manual_derivations")
+
+_PROMPT = """You write support material for an internal operations manual.
+From the manual below, produce (in the manual's language, Markdown):
+
+- "summary": 3-5 sentences: what the procedure is for, who runs it and its outputs.
+- "checklist": one "- [ ] ..." line per step, short and actionable; mark critical steps with (critical).
+- "message": a short message announcing the manual to the team (what it is and when to use it).
+
+Don't invent steps that don't appear in the manual.
+
+MANUAL
+{manual}
+"""
+
+_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "summary": {"type": "STRING"},
+        "checklist": {"type": "STRING"},
+        "message": {"type": "STRING"},
+    },
+    "required": ["summary", "checklist", "message"],
+}
+
+_client = None
+_executor = None
+_lock = threading.Lock()
+# record_hash being derived -> its artifacts once generated (None before)
+_in_flight = {}
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        from google import genai
+
+        _client = genai.Client()
+    return _client
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="manual-derive"
+                )
+    return _executor
+
+
+def manual_text(manual: dict) -> str:
+    """Plain-text version of a manual for the prompt."""
+    lines = [f"Title: {manual.get('title') or ''}"]
+    for field in ("business_area", "context", "requirements", "permissions", "outputs"):
+        if manual.get(field):
+            lines.append(f"{field.replace('_', ' ').capitalize()}: {manual[field]}")
+    for idx, step in enumerate(manual.get("steps") or [], start=1):
+        critical = " (critical)" if step.get("is_critical") else ""
+        lines.append(
+            f"Step {step.get('step_number', idx)}{critical}: {step.get('step_title') or ''}"
+            f" - {step.get('step_description') or ''}"
+            f" Expected output: {step.get('expected_output') or '-'}"
+        )
+    return "\n".join(lines)
+
+
+def generate(manual: dict) -> dict:
+    """One Gemini call -> {"summary", "checklist", "message"}."""
+    from google.genai import types
+
+    def run(timeout):
+        return _get_client().models.generate_content(
+            model=MANUAL_DERIVATIONS_MODEL,
+            contents=_PROMPT.format(manual=manual_text(manual)),
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=_SCHEMA,
+                temperature=0.2,
+                http_options=types.HttpOptions(timeout=max(1, int(timeout * 1000))),
+            ),
+        )
+
+    # Deadline, retries and circuit breaker of the "model" dependency
+    response = resilience.call("model", "derivations", run)
+    return json.loads(response.text)
+
+
+def _store(manual: dict, derived: dict) -> dict:
+    import manual_store_gcp
+
+    record = manual_store_gcp.save_derivations(manual, derived, MANUAL_DERIVATIONS_MODEL)
+    log.info(
+        "derivations stored",
+        extra={"manual_id": manual["manual_id"], "version": manual.get("version")},
+    )
+    return record
+
+
+def derive(manual: dict) -> dict:
+    """Generates and stores the artifacts of one manual version."""
+    return _store(manual, generate(manual))
+
+
+def _derive_in_background(manual: dict, derived: dict | None = None):
+    """Generates (unless `derived` is given) and stores, then releases the record_hash."""
+    record_hash = manual.get("record_hash")
+    try:
+        if derived is None:
+            derived = generate(manual)
+            with _lock:
+                _in_flight[record_hash] = derived
+        _store(manual, derived)
+    except Exception:
+        log.exception("derivation failed", extra={"manual_id": manual.get("manual_id")})
+    finally:
+        with _lock:
+            _in_flight.pop(record_hash, None)
+
+
+def _claim(record_hash: str) -> bool:
+    """Marks `record_hash` as being derived; False if it already is."""
+    with _lock:
+        if record_hash in _in_flight:
+            return False
+        _in_flight[record_hash] = None
+        return True
+
+
+def schedule(manual: dict) -> bool:
+    """Queues the derivation of a just-saved manual (get_manual shape + version/record_hash)."""
+    record_hash = manual.get("record_hash")
+    if not MANUAL_DERIVATIONS_ENABLED or not record_hash or not _claim(record_hash):
+        return False
+    _get_executor().submit(_derive_in_background, manual)
+    return True
+
+
+def _live(manual: dict, derived: dict, source: str) -> dict:
+    return {
+        "manual_id": manual["manual_id"],
+        "version": manual.get("version"),
+        **{f: derived.get(f) for f in _SCHEMA["required"]},
+        "source": source,
+    }
+
+
+def get_or_derive(manual_id: str) -> dict | None:
+    """
+    Stored artifacts of the current version. Generated live if missing, or
+    source "pending" (no artifacts) while they are being generated. None if
+    no manual.
+    """
+    import manual_store_gcp
+
+    stored = manual_store_gcp.get_derivations(manual_id)
+    if stored is not None:
+        return {**stored, "source": "stored"}
+
+    manual = manual_store_gcp.get_manual(manual_id)
+    if manual is None:
+        return None
+    record_hash = manual.get("record_hash")
+    if not record_hash:
+        # Manual without a version (tables not migrated): generated, never stored
+        return _live(manual, generate(manual), "live")
+
+    if not _claim(record_hash):
+        with _lock:
+            derived = _in_flight.get(record_hash)
+        if derived is None:
+            return _live(manual, {}, "pending")
+        return _live(manual, derived, "live")
+
+    try:
+        # The job that held the claim may have stored them in the meantime
+        stored = manual_store_gcp.get_derivations(manual_id)
+        if stored is not None:
+            with _lock:
+                _in_flight.pop(record_hash, None)
+            return {**stored, "source": "stored"}
+        log.info("no derivations yet, generating live", extra={"manual_id": manual_id})
+        derived = generate(manual)
+    except BaseException:
+        with _lock:
+            _in_flight.pop(record_hash, None)
+        raise
+    with _lock:
+        _in_flight[record_hash] = derived
+    # Storing (GCS + BigQuery) does not hold up the request
+    _get_executor().submit(_derive_in_background, manual, derived)
+    return _live(manual, derived, "live")
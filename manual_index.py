@@ -0,0 +1,287 @@
+# manual_index.py - In-process inverted index (BM25) over the manuals catalog
+"""
+Ranked full-text search for search_manuals without running a BigQuery job.
+
+- Text is accent-folded ("nómina" -> "nomina"), lower-cased and stemmed with
+  a light Spanish/English suffix stripper, so "cargar datos" also matches
+  "carga de data".
+- Each field has a weight (title and keywords count more than steps).
+- The index is built from the whole catalog in one query and then updated
+  incrementally by save_manual. It is rebuilt in the background every
+  MANUAL_INDEX_REFRESH_SECONDS to pick up saves made by other processes.
+"""
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Callable, Dict, List
+
+from settings import MANUAL_INDEX_REFRESH_SECONDS
+
+log = logging.getLogger("manual_index")
+
+# Weight of each manual field in the term frequencies
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "keywords": 2.5,
+    "business_area": 1.5,
+    "context": 1.0,
+    "outputs": 1.0,
+    "requirements": 0.5,
+    "permissions": 0.5,
+    "steps": 0.8,
+}
+
+# Fields returned as search results (same shape as search_manuals)
+RESULT_FIELDS = (
+    "manual_id",
+    "title",
+    "business_area",
+    "requester",
+    "created_at",
+    "last_updated",
+    "keywords",
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Minimum interval between build attempts, so a failing or stale index is
+# not rebuilt (or a thread started) on every search
+_BUILD_RETRY_SECONDS = 60
+
+_STOPWORDS = {
+    # es
+    "a", "al", "como", "con", "de", "del", "el", "en", "es", "la", "las", "lo",
+    "los", "mas", "me", "mi", "para", "por", "que", "se", "sin", "sobre", "su",
+    "un", "una", "uno", "unos", "unas", "y", "o", "u", "ya",
+    # en
+    "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in",
+    "into", "is", "it", "of", "on", "or", "the", "this", "to", "with",
+}
+
+# Longest first: the first matching suffix is stripped
+_SUFFIXES = (
+    "amientos", "imientos", "amiento", "imiento", "aciones", "iciones",
+    "acion", "icion", "ations", "ation", "mente", "ments", "ment",
+    "idades", "idad", "ando", "iendo", "ados", "adas", "idos", "idas",
+    "ado", "ada", "ido", "ida", "ings", "ing", "ed", "ar", "er", "ir",
+)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    """Lower-case and remove accents."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def stem(token: str) -> str:
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[: -len(suffix)]
+            break
+    else:
+        if token.endswith("s") and not token.endswith("ss") and len(token) > 4:
+            token = token[:-1]
+    # gender / final vowel: carga, cargo, cube -> carg, carg, cub
+    if len(token) > 3 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        stem(t) for t in _TOKEN_RE.findall(fold(text)) if t not in _STOPWORDS
+    ]
+
+
+def _field_text(manual: dict, field: str) -> str:
+    if field == "keywords":
+        keywords = manual.get("keywords") or []
+        if isinstance(keywords, str):
+            return keywords
+        return " ".join(keywords)
+    if field == "steps":
+        return " ".join(
+            f"{s.get('step_title') or ''} {s.get('step_description') or ''} "
+            f"{s.get('expected_output') or ''}"
+            for s in manual.get("steps") or []
+        )
+    return str(manual.get(field) or "")
+
+
+class InvertedIndex:
+    """BM25 index keyed by manual_id. Thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_len: Dict[str, float] = {}
+        self._meta: Dict[str, dict] = {}
+        self._total_len = 0.0
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, manual: dict):
+        """Adds or replaces one manual (get_manual shape, steps optional)."""
+        manual_id = manual["manual_id"]
+        terms = Counter()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(_field_text(manual, field)):
+                terms[token] += weight
+
+        meta = {f: manual.get(f) for f in RESULT_FIELDS}
+        meta["keywords"] = list(meta.get("keywords") or [])
+        for f in ("created_at", "last_updated"):
+            meta[f] = str(meta.get(f) or "")
+
+        with self._lock:
+            self._remove_locked(manual_id)
+            for token, tf in terms.items():
+                self._postings.setdefault(token, {})[manual_id] = tf
+            self._doc_terms[manual_id] = terms
+            self._doc_len[manual_id] = sum(terms.values())
+            self._total_len += self._doc_len[manual_id]
+            self._meta[manual_id] = meta
+
+    def remove(self, manual_id: str):
+        with self._lock:
+            self._remove_locked(manual_id)
+
+    def _remove_locked(self, manual_id: str):
+        terms = self._doc_terms.pop(manual_id, None)
+        if terms is None:
+            return
+        for token in terms:
+            docs = self._postings.get(token)
+            if docs is not None:
+                docs.pop(manual_id, None)
+                if not docs:
+                    del self._postings[token]
+        self._total_len -= self._doc_len.pop(manual_id)
+        self._meta.pop(manual_id, None)
+
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        """Ranked OR-search; every result carries its BM25 `score`."""
+        q_terms = Counter(tokenize(query))
+        if not q_terms:
+            return []
+
+        with self._lock:
+            n_docs = len(self._doc_len)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            scores: Dict[str, float] = {}
+            for token, q_tf in q_terms.items():
+                docs = self._postings.get(token)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for manual_id, tf in docs.items():
+                    norm = 1 - BM25_B + BM25_B * self._doc_len[manual_id] / avg_len
+                    scores[manual_id] = scores.get(manual_id, 0.0) + q_tf * idf * (
+                        tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+                    )
+
+            # Ties: most recent first
+            ranked = sorted(
+                scores.items(),
+                key=lambda kv: self._meta[kv[0]]["last_updated"],
+                reverse=True,
+            )
+            ranked.sort(key=lambda kv: -kv[1])
+            ranked = ranked[:limit]
+            return [
+                {**self._meta[manual_id], "score": round(score, 4)}
+                for manual_id, score in ranked
+            ]
+
+
+_index = InvertedIndex()
+_built_at = 0.0
+_build_attempted_at = 0.0
+_build_lock = threading.Lock()
+# Guards the swap of _index; add_manual holds it so no add falls in between
+_swap_lock = threading.Lock()
+# Manuals added while a build is running (None when no build is running)
+_added_during_build = None
+
+
+def is_ready() -> bool:
+    return _built_at > 0
+
+
+def build(load_catalog: Callable[[], List[dict]]):
+    """Rebuilds the whole index from the catalog (one BigQuery job)."""
+    global _index, _built_at, _added_during_build, _build_attempted_at
+    if not _build_lock.acquire(blocking=False):
+        return  # another thread is already building
+    _build_attempted_at = time.monotonic()
+    try:
+        started = time.perf_counter()
+        with _swap_lock:
+            _added_during_build = []
+        fresh = InvertedIndex()
+        for manual in load_catalog():
+            fresh.add(manual)
+        with _swap_lock:
+            # The catalog query may predate these saves
+            for manual in _added_during_build:
+                fresh.add(manual)
+            _index, _built_at = fresh, time.monotonic()
+        log.info(
+            "index built",
+            extra={"manuals": len(fresh), "ms": round((time.perf_counter() - started) * 1000)},
+        )
+    finally:
+        with _swap_lock:
+            _added_during_build = None
+        _build_lock.release()
+
+
+def _may_build() -> bool:
+    return (
+        not _build_lock.locked()
+        and time.monotonic() - _build_attempted_at > _BUILD_RETRY_SECONDS
+    )
+
+
+def ensure_ready(load_catalog: Callable[[], List[dict]]) -> bool:
+    """
+    Builds the index on first use (blocking). Afterwards, if it is older than
+    MANUAL_INDEX_REFRESH_SECONDS, refreshes it in a background thread while
+    the current one keeps serving. Builds are attempted at most once every
+    _BUILD_RETRY_SECONDS: meanwhile a missing index answers False (callers
+    use BigQuery) and a stale one keeps serving.
+    """
+    global _build_attempted_at
+    if not is_ready():
+        if _may_build():
+            build(load_catalog)
+        return is_ready()
+    if time.monotonic() - _built_at > MANUAL_INDEX_REFRESH_SECONDS and _may_build():
+        _build_attempted_at = time.monotonic()
+        threading.Thread(target=build, args=(load_catalog,), daemon=True).start()
+    return True
+
+
+def add_manual(manual: dict):
+    """Incremental update after a save."""
+    with _swap_lock:
+        _index.add(manual)
+        if _added_during_build is not None:
+            _added_during_build.append(manual)
+
+
+def search(query: str, limit: int = 50) -> List[Dict]:
+    return _index.search(query, limit)
@@ -0,0 +1,125 @@
+# manual_render.py - Compiled HTML template + precompression for manuals
+"""
+Renders a manual to HTML with templates compiled once at import time
+(static chunks + field slots, joined on each render) and precompresses the
+result for upload and serving.
+
+- gzip is always produced (GCS serves it with Content-Encoding: gzip).
+- brotli is produced only if the optional `brotli` package is installed.
+"""
+import gzip
+import html
+import re
+from typing import Dict, List, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+_SLOT_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
+def compile_template(template: str) -> Tuple[List[str], List[str]]:
+    """Splits `template` into static chunks and the slot names between them."""
+    parts = _SLOT_RE.split(template)
+    return parts[0::2], parts[1::2]
+
+
+def render_template(compiled: Tuple[List[str], List[str]], values: Dict[str, str]) -> str:
+    chunks, slots = compiled
+    out = [chunks[0]]
+    for slot, chunk in zip(slots, chunks[1:]):
+        out.append(values.get(slot, ""))
+        out.append(chunk)
+    return "".join(out)
+
+
+_PAGE = compile_template(
+    """<!DOCTYPE html>
+<html lang="es">
+<head>
+  <meta charset="UTF-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1" />
+  <title>{{title}}</title>
+  <style>
+    body { font-family: Arial, sans-serif; max-width: 900px; margin: 2rem auto; padding: 0 1rem; color: #222; }
+    h1 { color: #1a4d8f; }
+    h3 { margin-bottom: .25rem; }
+    .step { border-left: 4px solid #1a4d8f; padding: .5rem 1rem; margin: 1rem 0; background: #f7f9fc; }
+    .step.critical { border-left-color: #c0392b; }
+    .meta { color: #555; font-size: .9rem; }
+  </style>
+</head>
+<body>
+  <h1>{{title}}</h1>
+  <h3>Contexto</h3>
+  <p>{{context}}</p>
+  <h3>Requerimientos</h3>
+  <p>{{requirements}}</p>
+  <h3>Permisos</h3>
+  <p>{{permissions}}</p>
+  <h3>Outputs</h3>
+  <p>{{outputs}}</p>
+  <hr />
+  {{steps}}
+</body>
+</html>
+"""
+)
+
+_STEP = compile_template(
+    """<div class="step{{critical_class}}">
+    <h3>Paso {{step_number}}: {{step_title}}</h3>
+    <p>{{step_description}}</p>
+    <p class="meta"><b>Resultado esperado:</b> {{expected_output}}</p>
+    <p class="meta"><b>Herramientas:</b> {{required_tools}} &middot; <b>Tiempo estimado:</b> {{estimated_time}}</p>
+  </div>
+  """
+)
+
+
+def _text(value) -> str:
+    return html.escape(str(value)) if value not in (None, "") else ""
+
+
+def render_manual_html(manual: dict) -> str:
+    steps = []
+    for idx, step in enumerate(manual.get("steps") or [], start=1):
+        steps.append(
+            render_template(
+                _STEP,
+                {
+                    "critical_class": " critical" if step.get("is_critical") else "",
+                    "step_number": _text(step.get("step_number", idx)),
+                    "step_title": _text(step.get("step_title")),
+                    "step_description": _text(step.get("step_description")),
+                    "expected_output": _text(step.get("expected_output")),
+                    "required_tools": _text(step.get("required_tools")),
+                    "estimated_time": _text(step.get("estimated_time")),
+                },
+            )
+        )
+
+    return render_template(
+        _PAGE,
+        {
+            "title": _text(manual.get("title")),
+            "context": _text(manual.get("context")),
+            "requirements": _text(manual.get("requirements")),
+            "permissions": _text(manual.get("permissions")),
+            "outputs": _text(manual.get("outputs")),
+            "steps": "".join(steps),
+        },
+    )
+
+
+def gzip_bytes(data: bytes) -> bytes:
+    # mtime=0: mismo HTML -> mismos bytes comprimidos
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def brotli_bytes(data: bytes) -> bytes | None:
+    if brotli is None:
+        return None
+    return brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
@@ -0,0 +1,143 @@
+# manual_store_async.py - Async API over manual_store_gcp (FastAPI endpoints + agent tools)
+"""
+BigQuery and GCS Python clients are blocking, so every storage call is run
+on one bounded thread pool (STORE_MAX_WORKERS) instead of the event loop.
+A slow BigQuery job then only holds one worker, never the uvicorn loop.
+
+The clients' HTTP sessions are shared by every thread; their connection
+pools are enlarged on first use so concurrent calls reuse keep-alive
+connections instead of opening (and discarding) new ones.
+
+Each call is timed in its worker (metrics.storage_duration, by function
+name), so the histogram shows the storage time, not the wait for a worker.
+It runs with the caller's context, as a `store.<function>` span of the
+request's trace (tracing.py).
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import metrics
+import tracing
+from settings import STORE_MAX_WORKERS
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _configure_http_pools():
+    """Enlarges the requests pools of the shared BigQuery / GCS sessions."""
+    from requests.adapters import HTTPAdapter
+
+    import manual_store_gcp
+
+    # store async workers + the store's own parallel write pool, each with
+    # a hedged attempt in flight (resilience.hedge_workers)
+    size = 2 * (STORE_MAX_WORKERS + manual_store_gcp._IO_WORKERS)
+    sessions = [
+        getattr(manual_store_gcp.bq_client, "_http", None),
+        getattr(getattr(manual_store_gcp.bucket, "client", None), "_http", None),
+    ]
+    for session in sessions:
+        if session is None or not hasattr(session, "mount"):
+            continue
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+        session.mount("https://", adapter)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _configure_http_pools()
+                _executor = ThreadPoolExecutor(
+                    max_workers=STORE_MAX_WORKERS, thread_name_prefix="store-async"
+                )
+    return _executor
+
+
+def _timed_call(fn, *args, **kwargs):
+    with tracing.span(f"store.{fn.__name__}"), metrics.timed(
+        metrics.storage_duration, metrics.storage_errors, operation=fn.__name__
+    ):
+        return fn(*args, **kwargs)
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Runs a blocking storage function on the bounded store pool."""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(context.run, _timed_call, fn, *args, **kwargs)
+    )
+
+
+async def search_manuals(query: str = "", limit: int = 50) -> List[Dict]:
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.search_manuals, query, limit=limit)
+
+
+async def search_manuals_page(
+    query: str = "",
+    limit: int = 50,
+    cursor: str | None = None,
+    columns: List[str] | None = None,
+) -> Dict:
+    import manual_store_gcp
+
+    return await run_blocking(
+        manual_store_gcp.search_manuals_page,
+        query,
+        limit=limit,
+        cursor=cursor,
+        columns=columns,
+    )
+
+
+async def iter_manuals(columns: List[str] | None = None):
+    """Starts the export job off-loop; iterate the result in a thread (StreamingResponse does)."""
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.iter_manuals, columns)
+
+
+async def get_manual(manual_id: str) -> dict | None:
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.get_manual, manual_id)
+
+
+async def get_manuals(manual_ids: List[str]) -> List[Dict]:
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.get_manuals, manual_ids)
+
+
+async def get_manual_html(manual_id: str) -> dict | None:
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.get_manual_html, manual_id)
+
+
+async def get_derivations(manual_id: str) -> dict | None:
+    """Stored summary / checklist / message; generated live if missing."""
+    import manual_derivations
+
+    return await run_blocking(manual_derivations.get_or_derive, manual_id)
+
+
+async def save_manual(manual_struct: dict) -> dict:
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.save_manual, manual_struct)
+
+
+async def save_manuals(manual_structs: List[dict]) -> List[dict]:
+    import manual_store_gcp
+
+    return await run_blocking(manual_store_gcp.save_manuals, manual_structs)
@@ -1,316 +1,1254 @@
-      </style>
-    </head>
-    <body>
-      <h1>{title}</h1>
-      <h3>Contexto</h3>
-      <p>{context}</p>
-      <h3>Requerimientos</h3>
-      <p>{requirements}</p>
-      <h3>Permisos</h3>
-      <p>{permissions}</p>
-      <h3>Outputs</h3>
-      <p>{outputs}</p>
-      <hr />
-      {html_steps}
-    </body>
-    </html>
-    """
-    return html.strip()
-
-
-def init_db():
-    """En modo GCP asumimos que las tablas ya existen."""
-    print(">>> [manual_store_gcp] init_db (no-op, usando BigQuery)")
-    return
-
-
-def save_manual(manual_struct: dict) -> dict:
-    print(">>> [manual_store_gcp] save_manual INICIO")
-
-    now = datetime.now(timezone.utc)
-    now_str = now.isoformat()
-
-    manual_id = manual_struct.get("manual_id") or f"MAN-{uuid.uuid4().hex[:10]}"
-    version = manual_struct.get("version") or 1
-
-    # keywords: ensure list
-    keywords = manual_struct.get("keywords") or []
-    if isinstance(keywords, str):
-        keywords = [k.strip() for k in keywords.split(",") if k.strip()]
-
-    # 1) Render HTML and upload to GCS
-    html = _render_manual_html(manual_struct)
-    blob_path = f"manuals/{manual_id}/v{version}.html"
-    blob = bucket.blob(blob_path)
-
-    print(f">>> [manual_store_gcp] Subiendo HTML a gs://{MANUALS_BUCKET}/{blob_path}")
-    blob.upload_from_string(html, content_type="text/html")
-    gcs_uri = f"gs://{MANUALS_BUCKET}/{blob_path}"
-    print(">>> [manual_store_gcp] HTML subido OK:", gcs_uri)
-
-    # 2) manuals_dict row
-    manuals_row = {
-        "manual_id": manual_id,
-        "title": manual_struct.get("title"),
-        "business_area": manual_struct.get("business_area"),
-        "requester": manual_struct.get("requester"),
-        "created_by": manual_struct.get("created_by") or "manual-ai",
-        "created_at": manual_struct.get("created_at") or now_str,
-        "last_updated": now_str,
-        "context": manual_struct.get("context"),
-        "requirements": manual_struct.get("requirements"),
-        "permissions": manual_struct.get("permissions"),
-        "outputs": manual_struct.get("outputs"),
-        "keywords": keywords,  # ARRAY<STRING>
-    }
-
-    print(">>> [manual_store_gcp] Insertando en manuals_dict ...")
-    errors = bq_client.insert_rows_json(MANUALS_TABLE, [manuals_row])
-    if errors:
-        print("!!! [manual_store_gcp] ERROR manuals_dict:", errors)
-        raise RuntimeError(f"Error insertando en manuals_dict: {errors}")
-    print(">>> [manual_store_gcp] OK manuals_dict")
-
-    # 3) steps row
-    steps = manual_struct.get("steps", [])
-    step_rows = []
-    for idx, step in enumerate(steps, start=1):
-        step_rows.append(
-            {
-                "manual_id": manual_id,
-                "step_number": step.get("step_number", idx),
-                "step_title": step.get("step_title"),
-                "step_description": step.get("step_description"),
-                "expected_output": step.get("expected_output"),
-                "required_tools": step.get("required_tools"),
-                "estimated_time": step.get("estimated_time"),
-                "is_critical": bool(step.get("is_critical")),
-            }
-        )
-
-    if step_rows:
-        print(">>> [manual_store_gcp] Insertando en manual_steps ...")
-        errors = bq_client.insert_rows_json(STEPS_TABLE, step_rows)
-        if errors:
-            print("!!! [manual_store_gcp] ERROR manual_steps:", errors)
-            raise RuntimeError(f"Error insertando en manual_steps: {errors}")
-        print(">>> [manual_store_gcp] OK manual_steps")
-
-    # 4) files row
-    files_row = {
-        "manual_id": manual_id,
-        "version": version,
-        "file_path": gcs_uri,
-        "format": "html",
-        "created_at": now_str,
-        "created_by": manuals_row["created_by"],
-    }
-
-    print(">>> [manual_store_gcp] Insertando en manual_files ...")
-    errors = bq_client.insert_rows_json(FILES_TABLE, [files_row])
-    if errors:
-        print("!!! [manual_store_gcp] ERROR manual_files:", errors)
-        raise RuntimeError(f"Error insertando en manual_files: {errors}")
-    print(">>> [manual_store_gcp] OK manual_files")
-
-    result = {
-        "manual_id": manual_id,
-        "title": manuals_row["title"],
-        "business_area": manuals_row["business_area"],
-        "requester": manuals_row["requester"],
-        "created_by": manuals_row["created_by"],
-        "created_at": manuals_row["created_at"],
-        "last_updated": manuals_row["last_updated"],
-        "steps_count": len(steps),
-        "file_path": gcs_uri,
-        "version": version,
-    }
-
-    print(">>> [manual_store_gcp] save_manual FIN OK:", manual_id)
-    return result
-
-
-def search_manuals(query: str = "") -> List[Dict]:
-    """
-    Busca manuales en BigQuery.
-    - Si query == "" -> trae hasta 50 manuales ordenados por last_updated DESC.
-    - Si query tiene texto -> filtra por título, contexto, outputs y keywords.
-    """
-    q = (query or "").strip().lower()
-
-    print("\n[manual_store_gcp] search_manuals() llamado")
-    print("  PROJECT_ID:", PROJECT_ID)
-    print("  DATASET   :", BQ_DATASET)
-    print("  TABLE     :", MANUALS_TABLE)
-    print("  query_txt :", repr(q))
-
-    try:
-        if not q:
-            # No filter: same behavior as test_raw
-            sql = f"""
-              SELECT
-                manual_id,
-                title,
-                business_area,
-                requester,
-                created_at,
-                last_updated,
-                keywords
-              FROM `{MANUALS_TABLE}`
-              ORDER BY last_updated DESC
-              LIMIT 50
-            """
-            print("  SQL (sin filtro):")
-            print(sql)
-            job = bq_client.query(sql)
-
-        else:
-            # With text filter (in title, context, outputs or keywords)
-            sql = f"""
-              SELECT
-                manual_id,
-                title,
-                business_area,
-                requester,
-                created_at,
-                last_updated,
-                keywords
-              FROM `{MANUALS_TABLE}`
-              WHERE (
-                LOWER(title)   LIKE '%' || @q || '%' OR
-                LOWER(context) LIKE '%' || @q || '%' OR
-                LOWER(outputs) LIKE '%' || @q || '%' OR
-                EXISTS (
-                  SELECT kw
-                  FROM UNNEST(keywords) kw
-                  WHERE LOWER(kw) LIKE '%' || @q || '%'
-                )
-              )
-              ORDER BY last_updated DESC
-              LIMIT 50
-            """
-            print("  SQL (con filtro):")
-            print(sql)
-            job = bq_client.query(
-                sql,
-                job_config=bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ScalarQueryParameter("q", "STRING", q),
-                    ]
-                ),
-            )
-
-        rows = list(job.result())
-        print("  filas devueltas por BQ:", len(rows))
-
-        results: List[Dict] = []
-        for r in rows:
-            results.append(
-                {
-                    "manual_id": r.manual_id,
-                    "title": r.title,
-                    "business_area": getattr(r, "business_area", None),
-                    "requester": getattr(r, "requester", None),
-                    "created_at": str(getattr(r, "created_at", "")),
-                    "last_updated": str(getattr(r, "last_updated", "")),
-                    "keywords": list(getattr(r, "keywords", []) or []),
-                }
-            )
-
-        print("  resultados procesados:", len(results))
-        print("-------------------------------------------------\n")
-        return results
-
-    except Exception as e:
-        print("!!! ERROR en search_manuals:", repr(e))
-        print("-------------------------------------------------\n")
-        # Always return list, never None
-        return []
-
-
-
-def get_manual(manual_id: str) -> dict | None:
-    # 1) metadata
-    meta_job = bq_client.query(
-        f"SELECT * FROM `{MANUALS_TABLE}` WHERE manual_id = @manual_id",
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("manual_id", "STRING", manual_id)
-            ]
-        ),
-    )
-    meta_rows = list(meta_job.result())
-    if not meta_rows:
-        return None
-    m = meta_rows[0]
-
-    # 2) steps
-    steps_job = bq_client.query(
-        f"""
-        SELECT *
-        FROM `{STEPS_TABLE}`
-        WHERE manual_id = @manual_id
-        ORDER BY step_number
-        """,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("manual_id", "STRING", manual_id)
-            ]
-        ),
-    )
-    steps = []
-    for s in steps_job.result():
-        steps.append(
-            {
-                "step_number": s.step_number,
-                "step_title": s.step_title,
-                "step_description": s.step_description,
-                "expected_output": s.expected_output,
-                "required_tools": s.required_tools,
-                "estimated_time": s.estimated_time,
-                "is_critical": s.is_critical,
-            }
-        )
-
-    # 3) files
-    files_job = bq_client.query(
-        f"""
-        SELECT *
-        FROM `{FILES_TABLE}`
-        WHERE manual_id = @manual_id
-        ORDER BY version DESC
-        """,
-        job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("manual_id", "STRING", manual_id)
-            ]
-        ),
-    )
-    files = []
-    for f in files_job.result():
-        files.append(
-            {
-                "version": f.version,
-                "file_path": f.file_path,
-                "format": f.format,
-                "created_at": f.created_at.isoformat() if f.created_at else None,
-                "created_by": f.created_by,
-            }
-        )
-
-    return {
-        "manual_id": m.manual_id,
-        "title": m.title,
-        "business_area": m.business_area,
-        "requester": m.requester,
-        "created_by": m.created_by,
-        "created_at": m.created_at.isoformat() if m.created_at else None,
-        "last_updated": m.last_updated.isoformat() if m.last_updated else None,
-        "context": m.context,
-        "requirements": m.requirements,
-        "permissions": m.permissions,
-        "outputs": m.outputs,
-        "keywords": list(m.keywords) if m.keywords else [],
-        "steps": steps,
-        "files": files,
-    }
+      </style>
+    </head>
+    <body>
+      <h1>{title}</h1>
+      <h3>Contexto</h3>
+      <p>{context}</p>
+      <h3>Requerimientos</h3>
+      <p>{requirements}</p>
+      <h3>Permisos</h3>
+      <p>{permissions}</p>
+      <h3>Outputs</h3>
+      <p>{outputs}</p>
+      <hr />
+      {html_steps}
+    </body>
+    </html>
+    """
+    return html.strip()
+
+
+import base64
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from google.api_core.exceptions import NotFound
+from google.cloud.bigquery import DEFAULT_RETRY
+
+import manual_cache
+import manual_derivations
+import manual_index
+import manual_render
+import manual_vectors
+import metrics
+import resilience
+import tracing
+from settings import MANUAL_DERIVED_CACHE_DIR, MANUAL_HTML_CACHE_DIR
+
+log = logging.getLogger("manual_store_gcp")
+
+
+def init_db():
+    """En modo GCP asumimos que las tablas ya existen."""
+    log.info("init_db (no-op, usando BigQuery)")
+    return
+
+
+@contextlib.contextmanager
+def _timed(operation: str, **attributes):
+    """
+    Mide un job de BigQuery / transferencia de GCS: storage_operation_seconds
+    y un span storage.<operation> dentro de la traza del pedido.
+    """
+    with tracing.span(f"storage.{operation}", attributes), metrics.timed(
+        metrics.storage_duration, metrics.storage_errors, operation=operation
+    ):
+        yield
+
+
+def _query_rows(sql: str, job_config=None, operation: str = "query") -> list:
+    """
+    Filas de un query de lectura. resilience.call pone el deadline (timeout
+    del cliente), reintenta los errores transitorios y, si tarda más que el
+    p95 de las últimas consultas de la misma operación, lanza un duplicado.
+    Los reintentos propios de la librería quedan apagados.
+    """
+
+    def run(timeout):
+        job = bq_client.query(
+            sql, job_config=job_config, timeout=timeout, retry=None, job_retry=None
+        )
+        return list(job.result(timeout=timeout))
+
+    return resilience.call("bigquery", f"query.{operation}", run, hedge=True)
+
+
+# Streaming inserts: filas por llamada a insert_rows_json en save_manuals
+_INSERT_CHUNK_SIZE = 500
+_IO_WORKERS = 8
+
+_io_pool = None
+
+
+def _get_io_pool():
+    """Pool de hilos compartido para las llamadas de red de GCS/BigQuery."""
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(
+            max_workers=_IO_WORKERS, thread_name_prefix="manual-store"
+        )
+    return _io_pool
+
+
+def _submit(fn, *args):
+    """Lanza fn en el pool de E/S con el contexto actual (el span de la traza)."""
+    return _get_io_pool().submit(contextvars.copy_context().run, fn, *args)
+
+
+# Campos que cambian en cada guardado y no cuentan como contenido
+_VOLATILE_FIELDS = ("created_at", "last_updated", "version", "record_hash")
+
+
+def _record_hash(manuals_row: dict, step_rows: List[dict]) -> str:
+    """sha256 de la metadata y los pasos de un manual, sin fechas ni versión."""
+    payload = {
+        "manual": {k: v for k, v in manuals_row.items() if k not in _VOLATILE_FIELDS},
+        "steps": [
+            {k: v for k, v in row.items() if k not in _VOLATILE_FIELDS}
+            for row in step_rows
+        ],
+    }
+    raw = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _prepare_manual(manual_struct: dict, now_str: str) -> dict:
+    """
+    Arma el HTML y las filas de las tres tablas para un manual.
+    El HTML se guarda direccionado por contenido (sha256), así que la ruta
+    no depende de la versión; la versión la asigna _assign_version.
+    """
+    manual_id = manual_struct.get("manual_id") or f"MAN-{uuid.uuid4().hex[:10]}"
+
+    # keywords: ensure list
+    keywords = manual_struct.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = [k.strip() for k in keywords.split(",") if k.strip()]
+
+    html = manual_render.render_manual_html(manual_struct)
+    content_hash = hashlib.sha256(html.encode("utf-8")).hexdigest()
+    blob_path = f"manuals/blobs/{content_hash}.html"
+    gcs_uri = f"gs://{MANUALS_BUCKET}/{blob_path}"
+
+    manuals_row = {
+        "manual_id": manual_id,
+        "title": manual_struct.get("title"),
+        "business_area": manual_struct.get("business_area"),
+        "requester": manual_struct.get("requester"),
+        "created_by": manual_struct.get("created_by") or "manual-ai",
+        "created_at": manual_struct.get("created_at") or now_str,
+        "last_updated": now_str,
+        "context": manual_struct.get("context"),
+        "requirements": manual_struct.get("requirements"),
+        "permissions": manual_struct.get("permissions"),
+        "outputs": manual_struct.get("outputs"),
+        "keywords": keywords,  # ARRAY<STRING>
+        "version": None,
+        "record_hash": None,
+    }
+
+    steps = manual_struct.get("steps", [])
+    step_rows = []
+    for idx, step in enumerate(steps, start=1):
+        step_rows.append(
+            {
+                "manual_id": manual_id,
+                "step_number": step.get("step_number", idx),
+                "step_title": step.get("step_title"),
+                "step_description": step.get("step_description"),
+                "expected_output": step.get("expected_output"),
+                "required_tools": step.get("required_tools"),
+                "estimated_time": step.get("estimated_time"),
+                "is_critical": bool(step.get("is_critical")),
+                "version": None,
+                "record_hash": None,
+            }
+        )
+
+    # Hash del contenido (sin fechas): si coincide con la última versión
+    # guardada, el re-guardado no escribe nada
+    record_hash = _record_hash(manuals_row, step_rows)
+    manuals_row["record_hash"] = record_hash
+    for row in step_rows:
+        row["record_hash"] = record_hash
+
+    # Clave de idempotencia: el contenido. Un manual nuevo todavía no tiene
+    # id propio (se genera arriba), así que su clave no lo incluye
+    if manual_struct.get("manual_id"):
+        idempotency_key = record_hash
+    else:
+        idempotency_key = _record_hash(
+            {k: v for k, v in manuals_row.items() if k != "manual_id"},
+            [{k: v for k, v in row.items() if k != "manual_id"} for row in step_rows],
+        )
+
+    files_row = {
+        "manual_id": manual_id,
+        "version": None,
+        "file_path": gcs_uri,
+        "format": "html",
+        "created_at": now_str,
+        "created_by": manuals_row["created_by"],
+        "content_hash": content_hash,
+    }
+
+    result = {
+        "manual_id": manual_id,
+        "title": manuals_row["title"],
+        "business_area": manuals_row["business_area"],
+        "requester": manuals_row["requester"],
+        "created_by": manuals_row["created_by"],
+        "created_at": manuals_row["created_at"],
+        "last_updated": manuals_row["last_updated"],
+        "steps_count": len(steps),
+        "file_path": gcs_uri,
+        "version": None,
+        "content_hash": content_hash,
+        "idempotency_key": idempotency_key,
+        "unchanged": False,
+        "deduplicated": False,
+    }
+
+    return {
+        "manual_id": manual_id,
+        # Sólo un manual que ya traía id puede tener versiones anteriores
+        "is_new": not manual_struct.get("manual_id"),
+        "requested_version": manual_struct.get("version"),
+        "content_hash": content_hash,
+        "record_hash": record_hash,
+        "idempotency_key": idempotency_key,
+        "html": html,
+        "blob_path": blob_path,
+        "manuals_row": manuals_row,
+        "step_rows": step_rows,
+        "files_row": files_row,
+        "result": result,
+    }
+
+
+# Hashes de HTML que ya sabemos que están en GCS (evita el exists())
+_stored_hashes = set()
+
+
+def _blob_exists(blob_path: str, content_hash: str) -> bool:
+    if content_hash in _stored_hashes:
+        return True
+    exists = resilience.call(
+        "gcs", "exists", lambda timeout: bucket.blob(blob_path).exists(timeout=timeout, retry=None), hedge=True
+    )
+    if exists:
+        _stored_hashes.add(content_hash)
+        return True
+    return False
+
+
+def _upload_html(blob_path: str, html: str, content_hash: str) -> None:
+    """Sube el HTML ya comprimido con gzip (GCS lo sirve con Content-Encoding)."""
+    data = html.encode("utf-8")
+    gz = manual_render.gzip_bytes(data)
+    _write_html_cache(content_hash, data, gz)
+
+    blob = bucket.blob(blob_path)
+    blob.content_encoding = "gzip"
+    # La ruta es el hash del contenido: nunca cambia, se puede cachear siempre
+    blob.cache_control = "public, max-age=31536000, immutable"
+    log.info(
+        "subiendo HTML a GCS",
+        extra={"blob": f"gs://{MANUALS_BUCKET}/{blob_path}", "bytes": len(data), "gzip_bytes": len(gz)},
+    )
+    with _timed("gcs_upload", blob=blob_path, bytes=len(gz)):
+        # Idempotente: la ruta es el hash del contenido
+        resilience.call(
+            "gcs",
+            "upload",
+            lambda timeout: blob.upload_from_string(
+                gz,
+                content_type="text/html; charset=utf-8",
+                timeout=timeout,
+                retry=None,
+            ),
+        )
+    _stored_hashes.add(content_hash)
+
+
+def _html_cache_path(content_hash: str, encoding: str) -> str:
+    return os.path.join(MANUAL_HTML_CACHE_DIR, f"{content_hash}.html.{encoding}")
+
+
+def _write_html_cache(content_hash: str, html: bytes, gz: bytes) -> None:
+    """Guarda las variantes comprimidas en el cache local de disco."""
+    variants = {"gz": gz}
+    br = manual_render.brotli_bytes(html)
+    if br is not None:
+        variants["br"] = br
+    for encoding, data in variants.items():
+        path = _html_cache_path(content_hash, encoding)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+def get_manual_html(manual_id: str) -> dict | None:
+    """
+    HTML de la última versión de un manual, precomprimido, para servirlo.
+    Devuelve {"content_hash", "variants": {"gz": path, "br": path?}} o None.
+
+    Orden: cache local de disco -> render local (si el hash coincide) -> GCS.
+    """
+    manual = get_manual(manual_id)
+    if not manual or not manual.get("files"):
+        return None
+    latest = manual["files"][0]
+    content_hash = latest.get("content_hash")
+
+    if not content_hash or not os.path.exists(_html_cache_path(content_hash, "gz")):
+        html = manual_render.render_manual_html(manual).encode("utf-8")
+        rendered_hash = hashlib.sha256(html).hexdigest()
+        if content_hash in (None, rendered_hash):
+            gz = manual_render.gzip_bytes(html)
+            content_hash = rendered_hash
+        else:
+            # El HTML guardado no se puede reconstruir: se baja una vez de GCS
+            blob_path = latest["file_path"].split(f"gs://{MANUALS_BUCKET}/", 1)[-1]
+            log.info("descargando HTML de GCS", extra={"blob": blob_path})
+            with _timed("gcs_download", blob=blob_path):
+                raw = resilience.call(
+                    "gcs",
+                    "download",
+                    lambda timeout: bucket.blob(blob_path).download_as_bytes(
+                        raw_download=True, timeout=timeout, retry=None
+                    ),
+                    hedge=True,
+                )
+            if raw[:2] == b"\x1f\x8b":
+                gz, html = raw, gzip.decompress(raw)
+            else:
+                gz, html = manual_render.gzip_bytes(raw), raw
+        _write_html_cache(content_hash, html, gz)
+
+    variants = {}
+    for encoding in ("gz", "br"):
+        path = _html_cache_path(content_hash, encoding)
+        if os.path.exists(path):
+            variants[encoding] = path
+    return {"content_hash": content_hash, "variants": variants}
+
+
+# Resumen / checklist / mensaje generados una vez por versión de manual
+DERIVATIONS_TABLE = f"{PROJECT_ID}.{BQ_DATASET}.manual_derivations"
+DERIVED_FIELDS = ("summary", "checklist", "message")
+
+
+def _derived_blob_path(record_hash: str) -> str:
+    # Junto al HTML y direccionado por contenido, igual que él
+    return f"manuals/derived/{record_hash}.json"
+
+
+def _derived_cache_path(record_hash: str) -> str:
+    return os.path.join(MANUAL_DERIVED_CACHE_DIR, f"{record_hash}.json")
+
+
+def _write_derived_cache(record_hash: str, data: bytes) -> None:
+    path = _derived_cache_path(record_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_derivations(manual: dict, derived: dict, model: str) -> dict:
+    """
+    Guarda los derivados de una versión de manual: JSON en GCS
+    (manuals/derived/{record_hash}.json), cache local y una fila en
+    manual_derivations. Devuelve el registro guardado.
+    """
+    record_hash = manual["record_hash"]
+    record = {
+        "manual_id": manual["manual_id"],
+        "version": manual.get("version"),
+        "record_hash": record_hash,
+        **{f: derived.get(f) for f in DERIVED_FIELDS},
+        "model": model,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "file_path": f"gs://{MANUALS_BUCKET}/{_derived_blob_path(record_hash)}",
+    }
+    data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    _write_derived_cache(record_hash, data)
+
+    blob = bucket.blob(_derived_blob_path(record_hash))
+    blob.cache_control = "public, max-age=31536000, immutable"
+    with _timed("gcs_upload", blob=_derived_blob_path(record_hash), bytes=len(data)):
+        resilience.call(
+            "gcs",
+            "upload",
+            lambda timeout: blob.upload_from_string(
+                data,
+                content_type="application/json; charset=utf-8",
+                timeout=timeout,
+                retry=None,
+            ),
+        )
+
+    errors = _insert_rows(DERIVATIONS_TABLE, [record])
+    if errors:
+        log.error("error en manual_derivations", extra={"errors": errors})
+        raise RuntimeError(f"{DERIVATIONS_TABLE}: {errors}")
+    return record
+
+
+def get_derivations(manual_id: str) -> dict | None:
+    """
+    Derivados de la versión vigente de un manual, o None si todavía no se
+    generaron. Orden: cache local de disco -> GCS -> tabla
+    manual_derivations (la fila que escribió save_derivations, por si el
+    JSON de GCS no está).
+    """
+    manual = get_manual(manual_id)
+    if not manual or not manual.get("record_hash"):
+        return None
+    record_hash = manual["record_hash"]
+
+    path = _derived_cache_path(record_hash)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return json.loads(f.read())
+
+    try:
+        with _timed("gcs_download"):
+            data = resilience.call(
+                "gcs",
+                "download",
+                lambda timeout: bucket.blob(_derived_blob_path(record_hash)).download_as_bytes(
+                    timeout=timeout, retry=None
+                ),
+                hedge=True,
+            )
+    except NotFound:
+        record = _query_derivation(record_hash)
+        if record is None:
+            return None
+        data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+    _write_derived_cache(record_hash, data)
+    return json.loads(data)
+
+
+def _query_derivation(record_hash: str) -> dict | None:
+    """Última fila de manual_derivations para un record_hash, o None."""
+    sql = f"""
+      SELECT manual_id, version, record_hash, {", ".join(DERIVED_FIELDS)},
+             model, created_at, file_path
+      FROM `{DERIVATIONS_TABLE}`
+      WHERE record_hash = @record_hash
+      ORDER BY created_at DESC
+      LIMIT 1
+    """
+    params = [bigquery.ScalarQueryParameter("record_hash", "STRING", record_hash)]
+    rows = _query_rows(sql, bigquery.QueryJobConfig(query_parameters=params), "derivations")
+    if not rows:
+        return None
+    record = dict(rows[0].items())
+    record["created_at"] = _iso(record["created_at"])
+    return record
+
+
+def _latest_manuals_sql(where: str = "WHERE TRUE") -> str:
+    """
+    Subconsulta con la fila vigente de cada manual en manuals_dict.
+    Cada re-guardado agrega una fila con version + 1; compact_manuals borra
+    las anteriores. `where` filtra antes de la ventana (p. ej. por ids).
+    """
+    return f"""(
+        SELECT *
+        FROM `{MANUALS_TABLE}`
+        {where}
+        QUALIFY ROW_NUMBER() OVER (
+          PARTITION BY manual_id ORDER BY version DESC, last_updated DESC
+        ) = 1
+      )"""
+
+
+def _latest_versions(manual_ids: List[str]) -> Dict[str, dict]:
+    """
+    Versión vigente de cada manual: {id: {version, record_hash}}.
+    Usa get_manual cacheado cuando está; el resto va en un solo job.
+    """
+    latest: Dict[str, dict] = {}
+    missing = []
+    for manual_id in manual_ids:
+        hit, manual = manual_cache.get("manual", manual_id, version_of=manual_id)
+        if hit and "record_hash" in manual:
+            latest[manual_id] = {
+                "version": manual["version"],
+                "record_hash": manual["record_hash"],
+            }
+        else:
+            missing.append(manual_id)
+
+    if missing:
+        with _timed("bq_query", query="latest_versions", manuals=len(missing)):
+            rows = _query_rows(
+                f"""
+                SELECT manual_id, version, record_hash
+                FROM {_latest_manuals_sql("WHERE manual_id IN UNNEST(@manual_ids)")}
+                """,
+                bigquery.QueryJobConfig(
+                    query_parameters=[
+                        bigquery.ArrayQueryParameter("manual_ids", "STRING", missing)
+                    ]
+                ),
+                "latest_versions",
+            )
+        for r in rows:
+            latest[r.manual_id] = {"version": r.version, "record_hash": r.record_hash}
+    return latest
+
+
+def _assign_version(p: dict, latest: dict | None) -> None:
+    """
+    Versión nueva = última + 1 (o la pedida, si es mayor). Si la metadata y
+    los pasos son idénticos a la versión vigente, el guardado no escribe
+    nada (ni filas ni HTML) y devuelve esa versión.
+    """
+    if latest and latest.get("record_hash") == p["record_hash"]:
+        version = latest["version"]
+        p["result"]["unchanged"] = True
+    else:
+        version = ((latest or {}).get("version") or 0) + 1
+        version = max(version, int(p["requested_version"] or 0))
+    p["manuals_row"]["version"] = version
+    for row in p["step_rows"]:
+        row["version"] = version
+    p["files_row"]["version"] = version
+    p["result"]["version"] = version
+
+
+def _insert_rows(table: str, rows: List[dict]) -> list:
+    with _timed("bq_insert", table=table, rows=len(rows)):
+        # Sin reintentos propios ni hedging (un insert repetido duplica filas);
+        # los de la librería reusan los mismos insertId, y su deadline (600 s
+        # por defecto) se acota al que queda de BQ_TIMEOUT_SECONDS
+        errors = resilience.call(
+            "bigquery",
+            "insert",
+            lambda timeout: bq_client.insert_rows_json(
+                table, rows, timeout=timeout, retry=DEFAULT_RETRY.with_deadline(timeout)
+            ),
+            idempotent=False,
+        )
+    if errors:
+        metrics.storage_errors.inc(operation="bq_insert")
+    return errors
+
+
+def _submit_chunked(table: str, rows: List[dict], owners: List[int]) -> List[tuple]:
+    """
+    Lanza en el pool los insert_rows_json de `rows` en bloques de
+    _INSERT_CHUNK_SIZE. `owners[i]` es el índice del manual dueño de `rows[i]`.
+    """
+    submitted = []
+    for start in range(0, len(rows), _INSERT_CHUNK_SIZE):
+        chunk = rows[start : start + _INSERT_CHUNK_SIZE]
+        fut = _submit(_insert_rows, table, chunk)
+        submitted.append((table, owners[start : start + len(chunk)], fut))
+    return submitted
+
+
+def _collect_chunked(submitted: List[tuple]) -> List[tuple]:
+    """Espera los inserts lanzados y devuelve (indice_manual, error) por fallo."""
+    failures = []
+    for table, owners, fut in submitted:
+        try:
+            errors = fut.result()
+        except Exception as e:
+            # Falla la llamada completa: todos los manuales del bloque fallan
+            log.error("error en insert", extra={"table": table, "error": repr(e)})
+            failures.extend((owner, f"{table}: {e!r}") for owner in set(owners))
+            continue
+        if errors:
+            log.error("error en insert", extra={"table": table, "errors": errors})
+        for err in errors or []:
+            owner = owners[err.get("index", 0)]
+            failures.append((owner, f"{table}: {err.get('errors', err)}"))
+    return failures
+
+
+def _stored_record(p: dict) -> dict:
+    """
+    El manual tal como quedó guardado, con la forma de get_manual, armado con
+    las filas escritas (sin volver a leer BigQuery). `files` trae sólo el
+    archivo de esta versión.
+    """
+    row = p["manuals_row"]
+    files_row = {k: v for k, v in p["files_row"].items() if k != "manual_id"}
+    return {
+        **{k: row[k] for k in row},
+        "keywords": list(row["keywords"] or []),
+        "steps": [
+            {k: v for k, v in s.items() if k not in ("manual_id", "version", "record_hash")}
+            for s in p["step_rows"]
+        ],
+        "files": [files_row],
+    }
+
+
+# idempotency_key -> [lock, usuarios]: un mismo contenido se guarda de a uno
+_save_locks: Dict[str, list] = {}
+_save_locks_guard = threading.Lock()
+
+
+@contextlib.contextmanager
+def _idempotency_guard(keys: List[str]):
+    """
+    Serializa los guardados con la misma clave de idempotencia dentro del
+    proceso: el segundo espera al primero y luego lo encuentra en
+    manual_cache.recent_save. Los locks se toman en orden (sin deadlocks).
+    """
+    keys = sorted(set(keys))
+    with _save_locks_guard:
+        entries = []
+        for key in keys:
+            entry = _save_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+            entries.append(entry)
+    acquired = []
+    try:
+        for entry in entries:
+            entry[0].acquire()
+            acquired.append(entry)
+        yield
+    finally:
+        for entry in reversed(acquired):
+            entry[0].release()
+        with _save_locks_guard:
+            for key, entry in zip(keys, entries):
+                entry[1] -= 1
+                if not entry[1]:
+                    _save_locks.pop(key, None)
+
+
+def save_manuals(manual_structs: List[dict]) -> List[dict]:
+    """
+    Guarda varios manuales en paralelo.
+
+    - Los HTML se suben a GCS de forma concurrente.
+    - Las filas de manuals_dict y manual_steps de todos los manuales se
+      agrupan en pocas llamadas de streaming insert, mientras se suben los HTML.
+    - La fila de manual_files de cada manual se inserta sólo si su HTML subió.
+    - Cada re-guardado agrega filas con version + 1 (no hay UPDATE: las filas
+      recién insertadas por streaming no admiten DML); las lecturas usan sólo
+      la versión vigente y compact_manuals borra las anteriores. Si nada
+      cambió respecto de la versión vigente, no se escribe nada.
+    - Idempotente: la clave (idempotency_key) sale del contenido. Un guardado
+      igual a otro hecho en los últimos SAVE_DEDUP_WINDOW_SECONDS devuelve el
+      resultado de aquél sin escribir ni consultar BigQuery (deduplicated);
+      dos guardados iguales simultáneos se hacen de a uno.
+
+    Devuelve un resultado por manual (mismo orden que la entrada):
+    {"status": "ok", ..., "manual": {...}} (el registro guardado, con la
+    forma de get_manual) o {"status": "error", "manual_id": ..., "errors": [...]}.
+    """
+    log.debug("save_manuals inicio", extra={"manuals": len(manual_structs)})
+
+    now_str = datetime.now(timezone.utc).isoformat()
+    prepared = [_prepare_manual(m, now_str) for m in manual_structs]
+
+    with _idempotency_guard([p["idempotency_key"] for p in prepared]):
+        results: List[dict | None] = [None] * len(prepared)
+        pending = []
+        for i, p in enumerate(prepared):
+            previous = manual_cache.recent_save(p["idempotency_key"])
+            if previous is not None:
+                log.info(
+                    "guardado repetido, no se escribe",
+                    extra={"manual_id": previous["manual_id"]},
+                )
+                results[i] = {**previous, "unchanged": True, "deduplicated": True}
+            else:
+                pending.append(i)
+        if pending:
+            written = _write_manuals([prepared[i] for i in pending])
+            for i, result in zip(pending, written):
+                results[i] = result
+
+    ok = sum(1 for r in results if r["status"] == "ok")
+    log.info("save_manuals fin", extra={"ok": ok, "manuals": len(results)})
+    return results
+
+
+def _write_manuals(prepared: List[dict]) -> List[dict]:
+    """Escribe los manuales ya preparados (ver save_manuals)."""
+    errors: Dict[int, list] = {i: [] for i in range(len(prepared))}
+
+    # 0) Versiones previas (sólo re-guardados) y HTML ya existente, en paralelo
+    resaved = [p["manual_id"] for p in prepared if not p["is_new"]]
+    latest_fut = _submit(_latest_versions, resaved) if resaved else None
+    exists_futs = [
+        _submit(_blob_exists, p["blob_path"], p["content_hash"]) for p in prepared
+    ]
+    latest = {}
+    if latest_fut is not None:
+        try:
+            latest = latest_fut.result()
+        except Exception as e:
+            log.error("error leyendo versiones", extra={"error": repr(e)})
+            for i, p in enumerate(prepared):
+                if not p["is_new"]:
+                    errors[i].append(f"{MANUALS_TABLE}: {e!r}")
+    for p in prepared:
+        _assign_version(p, latest.get(p["manual_id"]))
+
+    # 1) HTML a GCS (sólo los que no existen) en paralelo con los inserts
+    uploads = []
+    for i, (p, exists_fut) in enumerate(zip(prepared, exists_futs)):
+        if errors[i]:
+            uploads.append(None)
+            continue
+        try:
+            exists = exists_fut.result()
+        except Exception:
+            exists = False
+        if p["result"]["unchanged"]:
+            log.info("manual sin cambios, no se escribe", extra={"manual_id": p["manual_id"]})
+            uploads.append(None)
+        elif exists:
+            log.debug("HTML ya en GCS, no se sube", extra={"blob": p["blob_path"]})
+            uploads.append(None)
+        else:
+            uploads.append(
+                _submit(_upload_html, p["blob_path"], p["html"], p["content_hash"])
+            )
+
+    # 2) manuals_dict + manual_steps, ya en paralelo con las subidas
+    # (los que ya fallaron al leer su versión o no cambiaron no se escriben)
+    manuals_rows, manuals_owners = [], []
+    step_rows, step_owners = [], []
+    for i, p in enumerate(prepared):
+        if errors[i] or p["result"]["unchanged"]:
+            continue
+        manuals_rows.append(p["manuals_row"])
+        manuals_owners.append(i)
+        step_rows.extend(p["step_rows"])
+        step_owners.extend([i] * len(p["step_rows"]))
+
+    submitted = _submit_chunked(MANUALS_TABLE, manuals_rows, manuals_owners)
+    if step_rows:
+        submitted += _submit_chunked(STEPS_TABLE, step_rows, step_owners)
+
+    # 3) manual_files para cada versión nueva cuyo HTML está en GCS
+    files_rows, files_owners = [], []
+    for i, fut in enumerate(uploads):
+        if fut is not None:
+            try:
+                fut.result()
+            except Exception as e:
+                log.error(
+                    "error subiendo HTML",
+                    extra={"blob": prepared[i]["blob_path"], "error": repr(e)},
+                )
+                errors[i].append(f"GCS upload: {e!r}")
+                continue
+        if errors[i] or prepared[i]["result"]["unchanged"]:
+            continue
+        files_rows.append(prepared[i]["files_row"])
+        files_owners.append(i)
+
+    if files_rows:
+        submitted += _submit_chunked(FILES_TABLE, files_rows, files_owners)
+
+    for owner, err in _collect_chunked(submitted):
+        errors[owner].append(err)
+
+    results = []
+    for i, p in enumerate(prepared):
+        if errors[i]:
+            # Aunque falle parcialmente, algo se escribió: invalidamos igual
+            manual_cache.invalidate_manual(p["manual_id"])
+            results.append(
+                {"status": "error", "manual_id": p["manual_id"], "errors": errors[i]}
+            )
+            continue
+        if not p["result"]["unchanged"]:
+            manual_cache.invalidate_manual(p["manual_id"])
+            saved = {**p["manuals_row"], "steps": p["step_rows"]}
+            manual_index.add_manual(saved)
+            manual_vectors.upsert_manual(saved)
+            manual_derivations.schedule(saved)
+        result = {"status": "ok", **p["result"], "manual": _stored_record(p)}
+        manual_cache.remember_save(p["idempotency_key"], result)
+        results.append(result)
+    return results
+
+
+def save_manual(manual_struct: dict) -> dict:
+    result = save_manuals([manual_struct])[0]
+    if result["status"] != "ok":
+        raise RuntimeError(
+            f"Error guardando manual {result['manual_id']}: {result['errors']}"
+        )
+
+    result.pop("status")
+    log.info("manual guardado", extra={"manual_id": result["manual_id"], "version": result.get("version")})
+    return result
+
+
+# Columnas de manuals_dict que se pueden pedir en búsquedas / listados
+SEARCH_COLUMNS = (
+    "manual_id",
+    "title",
+    "business_area",
+    "requester",
+    "created_by",
+    "created_at",
+    "last_updated",
+    "context",
+    "requirements",
+    "permissions",
+    "outputs",
+    "keywords",
+)
+DEFAULT_SEARCH_COLUMNS = (
+    "manual_id",
+    "title",
+    "business_area",
+    "requester",
+    "created_at",
+    "last_updated",
+    "keywords",
+)
+MAX_PAGE_SIZE = 500
+
+
+def _select_columns(columns) -> List[str]:
+    """Valida las columnas pedidas; manual_id siempre va."""
+    if not columns:
+        return list(DEFAULT_SEARCH_COLUMNS)
+    unknown = [c for c in columns if c not in SEARCH_COLUMNS]
+    if unknown:
+        raise ValueError(f"Columnas desconocidas: {unknown}")
+    return ["manual_id"] + [c for c in dict.fromkeys(columns) if c != "manual_id"]
+
+
+def encode_cursor(position: dict) -> str:
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("cursor inválido")
+
+
+def _summary_value(column: str, value):
+    if column in ("created_at", "last_updated"):
+        return str(value or "")
+    if column == "keywords":
+        return list(value or [])
+    return value
+
+
+def _row_to_summary(r, columns: List[str]) -> dict:
+    return {c: _summary_value(c, getattr(r, c, None)) for c in columns}
+
+
+def _query_page(q: str, limit: int, after: dict | None, columns: List[str]):
+    """
+    Página de la versión vigente de cada manual en orden (last_updated DESC, manual_id DESC),
+    con paginación keyset: `after` es la última fila de la página anterior.
+    Devuelve (filas, hay_mas).
+    """
+    select = ", ".join(dict.fromkeys(columns + ["last_updated"]))
+    where = []
+    params = [bigquery.ScalarQueryParameter("limit", "INT64", limit + 1)]
+
+    if q:
+        # Con texto: filtro por título, contexto, outputs o keywords
+        where.append(
+            """(
+                LOWER(title)   LIKE '%' || @q || '%' OR
+                LOWER(context) LIKE '%' || @q || '%' OR
+                LOWER(outputs) LIKE '%' || @q || '%' OR
+                EXISTS (
+                  SELECT kw
+                  FROM UNNEST(keywords) kw
+                  WHERE LOWER(kw) LIKE '%' || @q || '%'
+                )
+              )"""
+        )
+        params.append(bigquery.ScalarQueryParameter("q", "STRING", q))
+
+    if after:
+        where.append(
+            "(last_updated < @after_ts OR "
+            "(last_updated = @after_ts AND manual_id < @after_id))"
+        )
+        params.append(bigquery.ScalarQueryParameter("after_ts", "TIMESTAMP", after["ts"]))
+        params.append(bigquery.ScalarQueryParameter("after_id", "STRING", after["id"]))
+
+    sql = f"""
+      SELECT {select}
+      FROM {_latest_manuals_sql()}
+      {"WHERE " + " AND ".join(where) if where else ""}
+      ORDER BY last_updated DESC, manual_id DESC
+      LIMIT @limit
+    """
+    log.debug("consulta de página", extra={"sql": sql})
+    with _timed("bq_query", query="page", limit=limit):
+        rows = _query_rows(sql, bigquery.QueryJobConfig(query_parameters=params), "page")
+    return rows[:limit], len(rows) > limit
+
+
+def search_manuals_page(
+    query: str = "",
+    limit: int = 50,
+    cursor: str | None = None,
+    columns: List[str] | None = None,
+) -> Dict:
+    """
+    Busca manuales con paginación por cursor.
+    - Si query == "" -> manuales ordenados por last_updated DESC; el cursor es
+      keyset sobre (last_updated, manual_id), así cada página es una consulta
+      acotada aunque el catálogo crezca.
+    - Si query tiene texto -> búsqueda rankeada (BM25) en el índice local
+      manual_index, sobre metadata y pasos; el cursor es la posición en el
+      ranking. Si el índice no está disponible, filtra con LIKE por título,
+      contexto, outputs y keywords (keyset, igual que sin texto).
+    Cada cursor lleva el camino que lo generó ("src": "index" o "bq") y sólo
+    sirve para ese camino: un cursor del índice cuando el índice dejó de
+    estar disponible es un ValueError (repetir la búsqueda sin cursor).
+    `columns` elige qué columnas de manuals_dict se devuelven.
+    Devuelve {"results": [...], "next_cursor": str | None}.
+    """
+    q = (query or "").strip().lower()
+    limit = max(1, min(int(limit or 50), MAX_PAGE_SIZE))
+    columns = _select_columns(columns)
+    position = decode_cursor(cursor) if cursor else {}
+    source = position.get("src")
+    if cursor and source not in ("index", "bq"):
+        raise ValueError("cursor inválido")
+
+    log.debug(
+        "search_manuals",
+        extra={"table": MANUALS_TABLE, "q": q, "limit": limit, "cursor": position},
+    )
+
+    if q and source != "bq":
+        try:
+            if manual_index.ensure_ready(load_catalog):
+                offset = int(position.get("offset", 0))
+                ranked = manual_index.search(q, limit=offset + limit + 1)
+                page = ranked[offset : offset + limit]
+                results = _project_ranked(page, columns)
+                next_cursor = (
+                    encode_cursor({"src": "index", "offset": offset + limit})
+                    if len(ranked) > offset + limit
+                    else None
+                )
+                log.debug("resultados desde índice local", extra={"results": len(results)})
+                return {"results": results, "next_cursor": next_cursor}
+        except Exception as e:
+            log.warning("error en índice local, usando BigQuery", extra={"error": repr(e)})
+    if source == "index":
+        # Un offset del ranking no es una posición keyset de BigQuery
+        raise ValueError("cursor vencido: repetir la búsqueda sin cursor")
+
+    cache_key = repr((q, limit, cursor, columns))
+    gen = manual_cache.generation(manual_cache.CATALOG)
+    hit, cached = manual_cache.get("search", cache_key, version_of=manual_cache.CATALOG)
+    if hit:
+        log.debug("resultados desde cache", extra={"results": len(cached["results"])})
+        return cached
+
+    after = position if source == "bq" else None
+    rows, has_more = _query_page(q, limit, after, columns)
+
+    results = [_row_to_summary(r, columns) for r in rows]
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            {"src": "bq", "ts": last.last_updated.isoformat(), "id": last.manual_id}
+        )
+
+    page = {"results": results, "next_cursor": next_cursor}
+    log.debug("resultados desde BigQuery", extra={"results": len(results)})
+    manual_cache.put(
+        "search", cache_key, page, version_of=manual_cache.CATALOG, gen=gen
+    )
+    return page
+
+
+def _project_ranked(ranked: List[Dict], columns: List[str]) -> List[Dict]:
+    """Proyecta resultados del índice a `columns` (+ score)."""
+    if all(c in manual_index.RESULT_FIELDS for c in columns):
+        return [{**{c: r[c] for c in columns}, "score": r["score"]} for r in ranked]
+
+    # Columnas que el índice no guarda: se completan con get_manuals (cacheado)
+    full = {m["manual_id"]: m for m in get_manuals([r["manual_id"] for r in ranked])}
+    results = []
+    for r in ranked:
+        source = {**full.get(r["manual_id"], {}), **r}
+        results.append(
+            {**{c: _summary_value(c, source.get(c)) for c in columns}, "score": r["score"]}
+        )
+    return results
+
+
+def search_manuals(query: str = "", limit: int = 50) -> List[Dict]:
+    """
+    Busca manuales (primera página de search_manuals_page).
+    Siempre devuelve una lista, nunca None.
+    """
+    try:
+        return search_manuals_page(query, limit=limit)["results"]
+    except Exception as e:
+        log.error("error en search_manuals", extra={"error": repr(e)})
+        # Always return list, never None
+        return []
+
+
+def iter_manuals(columns: List[str] | None = None, page_size: int = 1000):
+    """
+    Recorre el catálogo completo (last_updated DESC) sin cargarlo en memoria:
+    un solo job y las filas se leen página a página desde BigQuery.
+    Las columnas se validan y el job se lanza al llamar (no al iterar).
+    """
+    columns = _select_columns(columns)
+    sql = f"""
+      SELECT {", ".join(columns)}
+      FROM {_latest_manuals_sql()}
+      ORDER BY last_updated DESC, manual_id DESC
+    """
+    # Deadline y reintentos hasta que el job termina; las páginas se leen después
+    rows = resilience.call(
+        "bigquery",
+        "query.iter_manuals",
+        lambda timeout: bq_client.query(
+            sql, timeout=timeout, retry=None, job_retry=None
+        ).result(page_size=page_size, timeout=timeout),
+    )
+    return (_row_to_summary(r, columns) for r in rows)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _row_to_manual(m) -> dict:
+    """Convierte una fila de la consulta anidada en el dict de manual."""
+    steps = [
+        {
+            "step_number": s["step_number"],
+            "step_title": s["step_title"],
+            "step_description": s["step_description"],
+            "expected_output": s["expected_output"],
+            "required_tools": s["required_tools"],
+            "estimated_time": s["estimated_time"],
+            "is_critical": s["is_critical"],
+        }
+        for s in (m.steps or [])
+    ]
+    files = [
+        {
+            "version": f["version"],
+            "file_path": f["file_path"],
+            "format": f["format"],
+            "created_at": _iso(f["created_at"]),
+            "created_by": f["created_by"],
+            "content_hash": f["content_hash"],
+        }
+        for f in (m.files or [])
+    ]
+
+    return {
+        "manual_id": m.manual_id,
+        "title": m.title,
+        "business_area": m.business_area,
+        "requester": m.requester,
+        "created_by": m.created_by,
+        "created_at": _iso(m.created_at),
+        "last_updated": _iso(m.last_updated),
+        "context": m.context,
+        "requirements": m.requirements,
+        "permissions": m.permissions,
+        "outputs": m.outputs,
+        "keywords": list(m.keywords) if m.keywords else [],
+        "version": m.version,
+        "record_hash": m.record_hash,
+        "steps": steps,
+        "files": files,
+    }
+
+
+def get_manuals(manual_ids: List[str]) -> List[Dict]:
+    """
+    Trae metadata + pasos ordenados + versiones de archivo de varios manuales
+    en un solo job de BigQuery (subconsultas ARRAY correlacionadas).
+    Devuelve los manuales en el mismo orden que `manual_ids`; los que no
+    existen se omiten. Sólo se consultan los que no están en manual_cache.
+    """
+    ids = list(dict.fromkeys(i for i in manual_ids if i))
+    if not ids:
+        return []
+
+    found: Dict[str, dict] = {}
+    missing: Dict[str, int] = {}
+    for manual_id in ids:
+        hit, manual = manual_cache.get("manual", manual_id, version_of=manual_id)
+        if hit:
+            found[manual_id] = manual
+        else:
+            missing[manual_id] = manual_cache.generation(manual_id)
+
+    if missing:
+        for manual in _query_manuals(list(missing)):
+            manual_id = manual["manual_id"]
+            manual_cache.put(
+                "manual", manual_id, manual, version_of=manual_id, gen=missing[manual_id]
+            )
+            found[manual_id] = manual
+
+    return [found[i] for i in ids if i in found]
+
+
+def load_catalog() -> List[Dict]:
+    """Todos los manuales con pasos y archivos, en un solo job (para índices)."""
+    return _query_manuals(None)
+
+
+def _query_manuals(ids: List[str] | None) -> List[Dict]:
+    """
+    Consulta anidada sobre la versión vigente de cada manual (y sólo los
+    pasos de esa versión); `ids=None` trae el catálogo completo.
+    """
+    where = "WHERE manual_id IN UNNEST(@manual_ids)" if ids is not None else "WHERE TRUE"
+    sql = f"""
+      SELECT
+        m.*,
+        ARRAY(
+          SELECT AS STRUCT
+            s.step_number,
+            s.step_title,
+            s.step_description,
+            s.expected_output,
+            s.required_tools,
+            s.estimated_time,
+            s.is_critical
+          FROM `{STEPS_TABLE}` s
+          WHERE s.manual_id = m.manual_id
+            AND s.version IS NOT DISTINCT FROM m.version
+            AND s.record_hash IS NOT DISTINCT FROM m.record_hash
+          ORDER BY s.step_number
+        ) AS steps,
+        ARRAY(
+          SELECT AS STRUCT
+            f.version,
+            f.file_path,
+            f.format,
+            f.created_at,
+            f.created_by,
+            f.content_hash
+          FROM `{FILES_TABLE}` f
+          WHERE f.manual_id = m.manual_id
+          ORDER BY f.version DESC
+        ) AS files
+      FROM {_latest_manuals_sql(where)} m
+    """
+    params = []
+    if ids is not None:
+        params.append(bigquery.ArrayQueryParameter("manual_ids", "STRING", ids))
+    with _timed("bq_query", query="manuals", manuals=len(ids) if ids is not None else None):
+        rows = _query_rows(sql, bigquery.QueryJobConfig(query_parameters=params), "manuals")
+
+    return [_row_to_manual(row) for row in rows]
+
+
+def get_manual(manual_id: str) -> dict | None:
+    manuals = get_manuals([manual_id])
+    return manuals[0] if manuals else None
+
+
+def compact_manuals(min_age_hours: float = 2) -> Dict[str, int]:
+    """
+    Borra las versiones reemplazadas de manuals_dict y manual_steps.
+
+    Sólo toca filas de versiones con más de `min_age_hours` de antigüedad:
+    las filas recientes pueden seguir en el streaming buffer, donde BigQuery
+    no permite DELETE. Primero los pasos (se identifican por la fila de
+    manuals_dict de su versión) y después la metadata.
+    Devuelve las filas borradas por tabla.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("cutoff", "TIMESTAMP", cutoff)]
+    )
+    superseded = f"""
+        SELECT old.manual_id, old.version, old.record_hash
+        FROM `{MANUALS_TABLE}` old
+        JOIN {_latest_manuals_sql()} cur
+          ON cur.manual_id = old.manual_id
+        WHERE old.last_updated < @cutoff
+          AND old.version < cur.version
+    """
+
+    def delete(sql):
+        # El query y la espera del job bajo el deadline de BigQuery, sin
+        # hedging ni reintentos propios de la librería
+        def run(timeout):
+            job = bq_client.query(
+                sql, job_config=job_config, timeout=timeout, retry=None, job_retry=None
+            )
+            job.result(timeout=timeout)
+            return job
+
+        return resilience.call("bigquery", "compact", run, idempotent=False)
+
+    steps_job = delete(
+        f"""
+        DELETE FROM `{STEPS_TABLE}` s
+        WHERE EXISTS (
+          SELECT 1 FROM ({superseded}) old
+          WHERE old.manual_id = s.manual_id
+            AND old.version IS NOT DISTINCT FROM s.version
+            AND old.record_hash IS NOT DISTINCT FROM s.record_hash
+        )
+        """
+    )
+
+    manuals_job = delete(
+        f"""
+        DELETE FROM `{MANUALS_TABLE}` m
+        WHERE EXISTS (
+          SELECT 1 FROM ({superseded}) old
+          WHERE old.manual_id = m.manual_id
+            AND old.version = m.version
+        )
+        """
+    )
+
+    deleted = {
+        STEPS_TABLE: steps_job.num_dml_affected_rows or 0,
+        MANUALS_TABLE: manuals_job.num_dml_affected_rows or 0,
+    }
+    log.info("compact_manuals", extra={"deleted": deleted})
+    return deleted
+
+
+if __name__ == "__main__":
+    # Compactación (cron diario): python manual_store_gcp.py compact [horas]
+    if sys.argv[1:2] == ["compact"]:
+        compact_manuals(float(sys.argv[2]) if len(sys.argv) > 2 else 2)
@@ -0,0 +1,470 @@
+# manual_vectors.py - Vector index (NumPy) for semantic search over manuals and steps
+"""
+Semantic similarity search over the catalog.
+
+- Every manual and every step is one row of a contiguous float32 matrix
+  (L2-normalized), saved as `vectors.npy` and memory-mapped on load.
+- Queries are embedded in batch and scored with one matrix product; top-k is
+  taken with argpartition, block by block so memory stays bounded.
+- Embedders are pluggable. The default HashingEmbedder is local and offline
+  (hashed stems + char n-grams weighted by TF-IDF). GeminiEmbedder uses the
+  Gemini embeddings API and also catches synonyms.
+- The whole index is rebuilt from the catalog in one batch pass; saves in
+  between go to a small in-memory delta. Once the index is older than
+  MANUAL_VECTOR_REFRESH_SECONDS it is rebuilt in the background, or reloaded
+  from disk if another process rebuilt it meanwhile. Saves made since the
+  catalog was read are re-applied to whichever index is swapped in.
+"""
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from manual_index import fold, tokenize
+from settings import (
+    MANUAL_VECTOR_DIM,
+    MANUAL_VECTOR_DIR,
+    MANUAL_VECTOR_EMBEDDER,
+    MANUAL_VECTOR_REFRESH_SECONDS,
+)
+
+log = logging.getLogger("manual_vectors")
+
+# Rows scored per block in search (bounds the size of the score matrix)
+_SEARCH_BLOCK_ROWS = 65536
+_EMBED_BATCH = 256
+# Saves this close before an index's catalog read are re-applied anyway
+# (clock skew between workers; re-applying a manual is harmless)
+_CLOCK_SLACK_SECONDS = 60
+# Minimum interval between refresh attempts (a failing rebuild is not retried per query)
+_REFRESH_RETRY_SECONDS = 60
+
+
+class Embedder:
+    """Interface: texts -> (n, dim) float32 matrix with L2-normalized rows."""
+
+    name = "base"
+    dim = 0
+
+    def fit(self, texts: List[str]):
+        """Optional: learn corpus statistics before a full rebuild."""
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def state(self) -> dict:
+        return {"name": self.name, "dim": self.dim}
+
+    def load_state(self, state: dict):
+        """Restores what fit() learned (saved next to the vectors)."""
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder(Embedder):
+    """Offline embedder: signed feature hashing of stems and char 4-grams, TF-IDF."""
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.idf = np.ones(dim, dtype=np.float32)
+
+    def _features(self, text: str) -> Dict[int, float]:
+        features: Dict[int, float] = {}
+
+        def add(feature: str, weight: float):
+            h = zlib.crc32(feature.encode("utf-8"))
+            bucket = h % self.dim
+            sign = 1.0 if (h >> 31) & 1 else -1.0
+            features[bucket] = features.get(bucket, 0.0) + sign * weight
+
+        for stem in tokenize(text):
+            add("w:" + stem, 1.0)
+        for word in fold(text).split():
+            padded = f"#{word}#"
+            for i in range(len(padded) - 3):
+                add("c:" + padded[i : i + 4], 0.3)
+        return features
+
+    def fit(self, texts: List[str]):
+        df = np.zeros(self.dim, dtype=np.float64)
+        for text in texts:
+            for bucket in self._features(text):
+                df[bucket] += 1
+        n = max(len(texts), 1)
+        self.idf = np.log((1 + n) / (1 + df)).astype(np.float32) + 1.0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, value in self._features(text).items():
+                if value:
+                    # sublinear tf, keeping the sign of the hash
+                    matrix[row, bucket] = math.copysign(1 + math.log(abs(value)), value)
+        matrix *= self.idf
+        return _normalize_rows(matrix)
+
+    def state(self) -> dict:
+        return {"name": self.name, "dim": self.dim, "idf": self.idf.tolist()}
+
+    def load_state(self, state: dict):
+        if state.get("idf"):
+            self.idf = np.asarray(state["idf"], dtype=np.float32)
+
+
+class GeminiEmbedder(Embedder):
+    """Gemini embeddings API (needs GOOGLE_API_KEY / Vertex credentials)."""
+
+    name = "gemini"
+
+    def __init__(self, model: str = "text-embedding-004", dim: int = 768):
+        from google import genai
+
+        self.model = model
+        self.dim = dim
+        self._client = genai.Client()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        from google.genai import types
+
+        rows = []
+        for start in range(0, len(texts), 100):
+            response = self._client.models.embed_content(
+                model=self.model,
+                contents=texts[start : start + 100],
+                config=types.EmbedContentConfig(output_dimensionality=self.dim),
+            )
+            rows.extend(e.values for e in response.embeddings)
+        return _normalize_rows(np.asarray(rows, dtype=np.float32).reshape(-1, self.dim))
+
+
+def make_embedder(name: str = MANUAL_VECTOR_EMBEDDER) -> Embedder:
+    if name == "gemini":
+        return GeminiEmbedder()
+    return HashingEmbedder(MANUAL_VECTOR_DIM)
+
+
+def _manual_text(manual: dict) -> str:
+    keywords = manual.get("keywords") or []
+    if isinstance(keywords, list):
+        keywords = ", ".join(keywords)
+    steps = " ".join(s.get("step_title") or "" for s in manual.get("steps") or [])
+    return " ".join(
+        str(x or "")
+        for x in (
+            manual.get("title"),
+            manual.get("business_area"),
+            keywords,
+            manual.get("context"),
+            manual.get("outputs"),
+            steps,
+        )
+    )
+
+
+def _step_text(manual: dict, step: dict) -> str:
+    return " ".join(
+        str(x or "")
+        for x in (
+            manual.get("title"),
+            step.get("step_title"),
+            step.get("step_description"),
+            step.get("expected_output"),
+        )
+    )
+
+
+def catalog_items(manual: dict) -> List[tuple]:
+    """(item, text) rows for one manual: the manual itself plus each step."""
+    base = {
+        "manual_id": manual["manual_id"],
+        "title": manual.get("title"),
+        "business_area": manual.get("business_area"),
+    }
+    items = [({**base, "kind": "manual"}, _manual_text(manual))]
+    for step in manual.get("steps") or []:
+        items.append(
+            (
+                {
+                    **base,
+                    "kind": "step",
+                    "step_number": step.get("step_number"),
+                    "step_title": step.get("step_title"),
+                },
+                _step_text(manual, step),
+            )
+        )
+    return items
+
+
+class VectorIndex:
+    """Float32 matrix (mmap from disk) + in-memory delta for recent saves."""
+
+    def __init__(self, embedder: Embedder):
+        self.embedder = embedder
+        # Wall-clock time the catalog was read (saves after it are not in `items`)
+        self.built_at = 0.0
+        self._lock = threading.RLock()
+        self.vectors = np.zeros((0, embedder.dim), dtype=np.float32)
+        self.items: List[dict] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.delta_vectors = np.zeros((0, embedder.dim), dtype=np.float32)
+        self.delta_items: List[dict] = []
+
+    def __len__(self):
+        return int(self.alive.sum()) + len(self.delta_items)
+
+    @classmethod
+    def build(cls, embedder: Embedder, manuals: List[dict], built_at: float = 0.0) -> "VectorIndex":
+        rows = [row for manual in manuals for row in catalog_items(manual)]
+        texts = [text for _, text in rows]
+        embedder.fit(texts)
+
+        index = cls(embedder)
+        index.built_at = built_at
+        index.items = [item for item, _ in rows]
+        index.vectors = np.empty((len(rows), embedder.dim), dtype=np.float32)
+        for start in range(0, len(rows), _EMBED_BATCH):
+            batch = texts[start : start + _EMBED_BATCH]
+            index.vectors[start : start + len(batch)] = embedder.embed(batch)
+        index.alive = np.ones(len(rows), dtype=bool)
+        return index
+
+    def save(self, directory: str):
+        """
+        Writes vectors.npy + items.json atomically: into a directory of its own
+        (other workers may be saving at the same time), then renamed in place.
+        """
+        base = directory.rstrip("/")
+        tmp = f"{base}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        old = f"{base}.{os.getpid()}.{uuid.uuid4().hex}.old"
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, "vectors.npy"), np.ascontiguousarray(self.vectors))
+        with open(os.path.join(tmp, "items.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"embedder": self.embedder.state(), "built_at": self.built_at, "items": self.items}, f
+            )
+        try:
+            os.rename(base, old)
+        except FileNotFoundError:
+            pass
+        try:
+            os.replace(tmp, base)
+        except OSError:
+            # Another worker moved its own index in first
+            shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, embedder: Embedder) -> "VectorIndex":
+        with open(os.path.join(directory, "items.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["embedder"].get("name") != embedder.name:
+            raise ValueError(f"index built with embedder {meta['embedder'].get('name')!r}")
+        if meta["embedder"].get("dim") != embedder.dim:
+            raise ValueError(f"index built with dimension {meta['embedder'].get('dim')!r}")
+        embedder.load_state(meta["embedder"])
+
+        index = cls(embedder)
+        index.built_at = float(meta.get("built_at") or 0.0)
+        index.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        index.items = meta["items"]
+        index.alive = np.ones(len(index.items), dtype=bool)
+        return index
+
+    def upsert_manual(self, manual: dict):
+        """Replaces the rows of one manual (goes to the delta until next rebuild)."""
+        rows = catalog_items(manual)
+        vectors = self.embedder.embed([text for _, text in rows])
+        manual_id = manual["manual_id"]
+        with self._lock:
+            for i, item in enumerate(self.items):
+                if item["manual_id"] == manual_id:
+                    self.alive[i] = False
+            keep = [i for i, item in enumerate(self.delta_items) if item["manual_id"] != manual_id]
+            self.delta_items = [self.delta_items[i] for i in keep] + [item for item, _ in rows]
+            self.delta_vectors = np.vstack([self.delta_vectors[keep], vectors])
+
+    def search(self, queries: List[str], k: int = 5, kind: str | None = None) -> List[List[dict]]:
+        """Top-k cosine similarity for a batch of queries."""
+        if not queries:
+            return []
+        q = self.embedder.embed(queries)  # (m, dim)
+
+        with self._lock:
+            blocks = [(self.vectors, self.items, self.alive)]
+            if self.delta_items:
+                blocks.append(
+                    (self.delta_vectors, self.delta_items, np.ones(len(self.delta_items), dtype=bool))
+                )
+
+            best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_items: List[List[dict]] = [[] for _ in queries]
+            for vectors, items, alive in blocks:
+                mask = alive.copy()
+                if kind is not None:
+                    mask &= np.fromiter((it["kind"] == kind for it in items), bool, len(items))
+                for start in range(0, len(items), _SEARCH_BLOCK_ROWS):
+                    stop = min(start + _SEARCH_BLOCK_ROWS, len(items))
+                    scores = q @ np.asarray(vectors[start:stop]).T  # (m, block)
+                    scores[:, ~mask[start:stop]] = -np.inf
+                    take = min(k, stop - start)
+                    top = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+                    top_scores = np.take_along_axis(scores, top, axis=1)
+                    best_scores = np.concatenate([best_scores, top_scores], axis=1)
+                    for row in range(len(queries)):
+                        best_items[row].extend(items[start + j] for j in top[row])
+                    # Keep the k best so far
+                    if best_scores.shape[1] > k:
+                        keep = np.argsort(-best_scores, axis=1)[:, :k]
+                        best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                        best_items = [[best_items[r][j] for j in keep[r]] for r in range(len(queries))]
+
+        results = []
+        for row in range(len(queries)):
+            order = np.argsort(-best_scores[row])
+            results.append(
+                [
+                    {**best_items[row][j], "score": round(float(best_scores[row][j]), 4)}
+                    for j in order
+                    if np.isfinite(best_scores[row][j])
+                ]
+            )
+        return results
+
+
+_index: VectorIndex | None = None
+_build_lock = threading.Lock()
+# Guards _index and _recent_saves
+_swap_lock = threading.Lock()
+# manual_id -> (wall-clock time, manual) of this worker's saves not yet in a full build
+_recent_saves: Dict[str, tuple] = {}
+_refresh_started = 0.0
+
+
+def _swap(index: VectorIndex) -> VectorIndex:
+    """Makes `index` current after re-applying the saves its catalog read missed."""
+    global _index
+    with _swap_lock:
+        since = index.built_at - _CLOCK_SLACK_SECONDS
+        for manual_id, (saved_at, manual) in list(_recent_saves.items()):
+            if saved_at >= since:
+                index.upsert_manual(manual)
+            else:
+                del _recent_saves[manual_id]
+        _index = index
+        return index
+
+
+def _rebuild_locked(load_catalog: Callable[[], List[dict]]) -> VectorIndex:
+    started = time.time()
+    built = VectorIndex.build(make_embedder(), load_catalog(), built_at=started)
+    built.save(MANUAL_VECTOR_DIR)
+    index = _swap(VectorIndex.load(MANUAL_VECTOR_DIR, built.embedder))
+    log.info(
+        "index rebuilt",
+        extra={
+            "vectors": len(index),
+            "dir": MANUAL_VECTOR_DIR,
+            "ms": round((time.time() - started) * 1000),
+        },
+    )
+    return index
+
+
+def rebuild_from_catalog(load_catalog: Callable[[], List[dict]]) -> VectorIndex:
+    """One batch pass over the catalog: embed, save to disk, reload as mmap."""
+    with _build_lock:
+        return _rebuild_locked(load_catalog)
+
+
+def _is_stale(index: VectorIndex) -> bool:
+    return time.time() - index.built_at > MANUAL_VECTOR_REFRESH_SECONDS
+
+
+def refresh(load_catalog: Callable[[], List[dict]]):
+    """
+    Background refresh of a stale index: loads the one on disk if another
+    worker rebuilt it since, otherwise rebuilds it from the catalog.
+    """
+    if not _build_lock.acquire(blocking=False):
+        return  # another thread is already refreshing
+    try:
+        try:
+            on_disk = VectorIndex.load(MANUAL_VECTOR_DIR, make_embedder())
+        except (OSError, ValueError, KeyError):
+            on_disk = None
+        if on_disk is not None and not _is_stale(on_disk):
+            _swap(on_disk)
+            log.info("index reloaded from disk", extra={"vectors": len(on_disk)})
+        else:
+            _rebuild_locked(load_catalog)
+    except Exception:
+        log.exception("index refresh failed")
+    finally:
+        _build_lock.release()
+
+
+def ensure_ready(load_catalog: Callable[[], List[dict]]) -> VectorIndex:
+    """
+    Loads the index from disk, or rebuilds it if missing or incompatible.
+    A stale index keeps serving while refresh() runs in a background thread.
+    """
+    global _refresh_started
+    index = _index
+    if index is None:
+        try:
+            index = _swap(VectorIndex.load(MANUAL_VECTOR_DIR, make_embedder()))
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("no usable index on disk, rebuilding", extra={"error": repr(e)})
+            with _build_lock:
+                if _index is not None:
+                    return _index  # built by another request while this one waited
+                return _rebuild_locked(load_catalog)
+    if (
+        _is_stale(index)
+        and not _build_lock.locked()
+        and time.monotonic() - _refresh_started > _REFRESH_RETRY_SECONDS
+    ):
+        _refresh_started = time.monotonic()
+        threading.Thread(target=refresh, args=(load_catalog,), daemon=True).start()
+    return index
+
+
+def upsert_manual(manual: dict):
+    """
+    Called after save_manual. The save is also kept until a rebuild that
+    includes it, so it survives the next swap (and reaches an index that is
+    loaded later).
+    """
+    with _swap_lock:
+        _recent_saves[manual["manual_id"]] = (time.time(), manual)
+        index = _index
+    if index is not None:
+        index.upsert_manual(manual)
+
+
+def semantic_search(
+    queries: List[str], load_catalog: Callable[[], List[dict]], k: int = 5, kind: str | None = None
+) -> List[List[dict]]:
+    return ensure_ready(load_catalog).search(queries, k=k, kind=kind)
+
+
+if __name__ == "__main__":
+    # Full rebuild: python manual_vectors.py
+    from manual_store_gcp import load_catalog
+
+    rebuild_from_catalog(load_catalog)
@@ -0,0 +1,289 @@
+# metrics.py - In-process metrics, exposed at /metrics in Prometheus text format
+"""
+Counters, histograms and summaries for the request path, with no extra
+dependency. render() produces the Prometheus text exposition format
+(version 0.0.4), served by GET /metrics.
+
+What is recorded (label names in braces):
+
+- http_requests_total / http_request_duration_seconds {method, route, status}:
+  every endpoint (middleware in main.py).
+- ask_duration_seconds {endpoint, route}: /ask and /ask/stream end to end, as a
+  summary with p50 / p95 / p99 over the last requests. route is agents,
+  cached, fast_path or rejected.
+- agent_model_duration_seconds / agent_model_tokens_total / agent_model_errors_total
+  {agent, model}: each Gemini call of each agent (agent_telemetry plugin).
+- tool_duration_seconds / tool_errors_total {agent, tool}: each tool call.
+- storage_operation_seconds / storage_errors_total {operation}: every store
+  call made from async code, plus the BigQuery jobs and GCS uploads inside
+  it (bq_query, bq_insert, gcs_upload).
+- dependency_events_total {dependency, event}: retries, hedges, hedges that
+  won, missed deadlines, calls rejected by an open circuit and circuits
+  opened, for model, bigquery and gcs (resilience.py).
+- scheduler_running / scheduler_queued / circuits_open: read when /metrics
+  is scraped.
+
+Metrics are per process: with several workers, Prometheus scrapes each one.
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+_QUANTILES = (0.5, 0.95, 0.99)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = sorted(self._values.items())
+            lines += self._render_items(items)
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_items(self, items):
+        return [
+            f"{self.name}{_labels_text(self.labelnames, key)} {_number(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=_LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_items(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(
+                    f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Summary(_Metric):
+    """Quantiles over the last `window` observations, plus sum and count."""
+
+    kind = "summary"
+
+    def __init__(self, name, help_text, labelnames=(), window: int = 1024):
+        super().__init__(name, help_text, labelnames)
+        self.window = window
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [deque(maxlen=self.window), 0.0, 0]
+            state[0].append(value)
+            state[1] += value
+            state[2] += 1
+
+    def quantiles(self, **labels) -> dict:
+        with _lock:
+            state = self._values.get(self._key(labels))
+            recent = sorted(state[0]) if state else []
+        return {q: _quantile(recent, q) for q in _QUANTILES}
+
+    def _render_items(self, items):
+        lines = []
+        for key, (recent, total, count) in items:
+            ordered = sorted(recent)
+            for q in _QUANTILES:
+                quantile = f'quantile="{q}"'
+                lines.append(
+                    f"{self.name}{_labels_text(self.labelnames, key, quantile)} "
+                    f"{_number(_quantile(ordered, q))}"
+                )
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value read from `fn()` when the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn):
+        super().__init__(name, help_text)
+        self.fn = fn
+
+    def render(self) -> list:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name} {_number(value)}",
+        ]
+
+
+def _quantile(ordered, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(histogram: Histogram, errors: Counter | None = None, **labels):
+    """Observes the duration of the block; counts it in `errors` if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        if errors is not None:
+            errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+# ------------------------------------------------------------
+# Metrics of the application
+# ------------------------------------------------------------
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests handled.", ("method", "route", "status")
+)
+http_duration = Histogram(
+    "http_request_duration_seconds",
+    "Time to the response start (whole body for non-streaming responses).",
+    ("method", "route", "status"),
+)
+ask_duration = Summary(
+    "ask_duration_seconds",
+    "End-to-end /ask and /ask/stream time, by how the answer was produced.",
+    ("endpoint", "route"),
+)
+model_duration = Histogram(
+    "agent_model_duration_seconds", "Model call latency per agent.", ("agent", "model")
+)
+model_tokens = Counter(
+    "agent_model_tokens_total",
+    "Tokens per agent and kind (prompt, output, cached, thoughts).",
+    ("agent", "model", "kind"),
+)
+model_errors = Counter(
+    "agent_model_errors_total", "Failed model calls per agent.", ("agent", "model")
+)
+tool_duration = Histogram(
+    "tool_duration_seconds", "Tool call duration.", ("agent", "tool")
+)
+tool_errors = Counter(
+    "tool_errors_total",
+    "Tool calls that raised or returned a non-ok status.",
+    ("agent", "tool"),
+)
+storage_duration = Histogram(
+    "storage_operation_seconds", "Storage operation duration.", ("operation",)
+)
+storage_errors = Counter(
+    "storage_errors_total", "Storage operations that raised.", ("operation",)
+)
+dependency_events = Counter(
+    "dependency_events_total",
+    "Retries, hedges, missed deadlines and circuit breaker events per dependency.",
+    ("dependency", "event"),
+)
+
+
+def _scheduler_stat(name: str):
+    from agent_scheduler import scheduler
+
+    return scheduler.stats()[name]
+
+
+Gauge("scheduler_running", "Agent runs executing now.", lambda: _scheduler_stat("running"))
+Gauge("scheduler_queued", "Agent runs waiting for a slot.", lambda: _scheduler_stat("queued"))
+
+
+def _open_circuits():
+    import resilience
+
+    return resilience.open_circuits()
+
+
+Gauge("circuits_open", "Dependencies failing fast now (circuit open or half open).", _open_circuits)
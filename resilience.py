@@ -0,0 +1,417 @@
+# resilience.py - Deadlines, retries, hedging and circuit breakers for Gemini, BigQuery and GCS
+"""
+Every call to a remote dependency goes through call() (the store's
+BigQuery jobs and GCS transfers) or agent_resilience.ResilientLlm (the
+agents' Gemini calls). Each of the three dependencies ("model",
+"bigquery", "gcs") has:
+
+- A deadline per call, covering all attempts. It is passed to the client
+  as its request timeout, so a stuck call cannot hold a thread forever.
+  It fails with DeadlineExceeded.
+- Retries of transient errors (timeouts, connection errors, 408 / 429 /
+  5xx), with full-jitter exponential backoff, up to *_ATTEMPTS. They come
+  out of a retry budget: in the last 10 s, retries and hedges stay under
+  RETRY_BUDGET_RATIO of the calls (or RETRY_BUDGET_MIN). An outage is
+  therefore not multiplied by the retries. Calls that are not idempotent
+  (streaming inserts, DML) are never retried.
+- Hedging of idempotent reads. A call still running after the
+  HEDGE_PERCENTILE latency of its recent calls (same operation) gets a
+  duplicate, and the first answer wins. This cuts the tail left by one
+  slow request, and the hedges come out of the same budget.
+- A circuit breaker. After BREAKER_FAILURES consecutive failed calls it
+  opens, and calls fail at once with CircuitOpenError for
+  BREAKER_RESET_SECONDS. Then one trial call decides whether it closes.
+  Errors that are answers (not found, bad request) do not count.
+
+The client libraries' own retries are turned off where this layer
+retries, so attempts do not multiply. stats() is reported in /health, and
+the events (retry, hedge, hedge_win, deadline_exceeded, rejected, opened)
+are counted in dependency_events_total.
+"""
+import concurrent.futures
+import contextvars
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from settings import (
+    BQ_ATTEMPTS,
+    BQ_TIMEOUT_SECONDS,
+    BREAKER_FAILURES,
+    BREAKER_RESET_SECONDS,
+    GCS_ATTEMPTS,
+    GCS_TIMEOUT_SECONDS,
+    HEDGE_ENABLED,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    MODEL_ATTEMPTS,
+    MODEL_DEADLINE_SECONDS,
+    RETRY_BUDGET_MIN,
+    RETRY_BUDGET_RATIO,
+    STORE_MAX_WORKERS,
+)
+
+log = logging.getLogger("resilience")
+
+# HTTP statuses worth another attempt
+_TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+# Backoff before retry n: random between 0 and min(max, base * 2^(n-1))
+_BACKOFF_BASE_SECONDS = 0.2
+_BACKOFF_MAX_SECONDS = 5.0
+# Latencies kept per operation for the hedging delay
+_LATENCY_WINDOW = 200
+_BUDGET_WINDOW_SECONDS = 10.0
+
+
+class CircuitOpenError(RuntimeError):
+    """The dependency is failing: the call was rejected without being made."""
+
+    def __init__(self, dependency: str, retry_after: float):
+        self.dependency = dependency
+        self.retry_after = max(1, round(retry_after))
+        super().__init__(f"{dependency} is failing, retry in {self.retry_after} s")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call did not finish within its deadline (all attempts)."""
+
+
+def _transient_types() -> tuple:
+    types = [TimeoutError, ConnectionError, concurrent.futures.TimeoutError]
+    try:
+        import requests
+
+        types += [requests.exceptions.ConnectionError, requests.exceptions.Timeout]
+    except ImportError:
+        pass
+    try:
+        import httpx
+
+        types.append(httpx.TransportError)
+    except ImportError:
+        pass
+    return tuple(types)
+
+
+_transient = None
+
+
+def is_transient(error: Exception) -> bool:
+    """Timeouts, connection errors and 408 / 429 / 5xx (google.api_core and genai errors)."""
+    global _transient
+    if _transient is None:
+        _transient = _transient_types()
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, _transient):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in _TRANSIENT_STATUS
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures -> half_open after `reset_seconds`."""
+
+    def __init__(self, name: str, failures: int, reset_seconds: float):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.opened = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Raises CircuitOpenError while open; lets one trial call through when half open."""
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                wait_for = self._opened_at + self.reset_seconds - time.monotonic()
+                if wait_for > 0:
+                    raise CircuitOpenError(self.name, wait_for)
+                self.state = "half_open"
+                self._trial = False
+            if self._trial:
+                raise CircuitOpenError(self.name, 1)
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._trial = False
+            if self.state != "closed":
+                log.info("circuit closed", extra={"dependency": self.name})
+                self.state = "closed"
+
+    def failure(self) -> bool:
+        """Counts a failed call; True if it opened the circuit."""
+        with self._lock:
+            self._consecutive += 1
+            self._trial = False
+            if self.state == "half_open" or (
+                self.state == "closed" and self._consecutive >= self.failures
+            ):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.opened += 1
+                return True
+            return False
+
+
+class RetryBudget:
+    """Retries and hedges in the last `window` seconds: at most `ratio` of the calls, or `minimum`."""
+
+    def __init__(self, ratio: float, minimum: int, window: float = _BUDGET_WINDOW_SECONDS):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._calls = deque()
+        self._spent = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        for times in (self._calls, self._spent):
+            while times and times[0] < now - self.window:
+                times.popleft()
+
+    def record_call(self):
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._calls.append(now)
+
+    def try_spend(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if len(self._spent) >= max(self.minimum, self.ratio * len(self._calls)):
+                return False
+            self._spent.append(now)
+            return True
+
+
+class Dependency:
+    """Policy and state of one remote dependency."""
+
+    def __init__(self, name: str, deadline: float, attempts: int):
+        self.name = name
+        self.deadline = deadline
+        self.attempts = max(1, attempts)
+        self.breaker = CircuitBreaker(name, BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+        self.budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN)
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self.counts = {
+            "calls": 0,
+            "failures": 0,
+            "retry": 0,
+            "hedge": 0,
+            "hedge_win": 0,
+            "deadline_exceeded": 0,
+            "rejected": 0,
+        }
+
+    def count(self, event: str):
+        with self._lock:
+            self.counts[event] += 1
+        if event != "calls":
+            metrics.dependency_events.inc(dependency=self.name, event=event)
+
+    def admit(self):
+        """Start of a call: fails fast while the circuit is open."""
+        try:
+            self.breaker.admit()
+        except CircuitOpenError:
+            self.count("rejected")
+            raise
+        self.count("calls")
+        self.budget.record_call()
+
+    def succeeded(self, operation: str, seconds: float):
+        with self._lock:
+            window = self._latencies.get(operation)
+            if window is None:
+                window = self._latencies[operation] = deque(maxlen=_LATENCY_WINDOW)
+            window.append(seconds)
+        self.breaker.success()
+
+    def answered(self):
+        """The dependency answered with an error that is not an outage (not found, bad request)."""
+        self.breaker.success()
+
+    def failed(self, error: Exception):
+        self.count("failures")
+        if self.breaker.failure():
+            metrics.dependency_events.inc(dependency=self.name, event="opened")
+            log.warning(
+                "circuit opened",
+                extra={"dependency": self.name, "seconds": self.breaker.reset_seconds, "error": repr(error)},
+            )
+
+    def hedge_delay(self, operation: str) -> float | None:
+        """HEDGE_PERCENTILE latency of the operation's recent calls (None: too few, or off)."""
+        if not HEDGE_ENABLED:
+            return None
+        with self._lock:
+            window = self._latencies.get(operation)
+            if window is None or len(window) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(window)
+        return ordered[min(len(ordered) - 1, int(HEDGE_PERCENTILE * len(ordered)))]
+
+    def retry_delay(self, error: Exception, attempt: int, idempotent: bool, deadline: float) -> float | None:
+        """Backoff before another attempt, or None if the call must fail now."""
+        if not idempotent or not is_transient(error) or attempt >= self.attempts:
+            return None
+        delay = random.uniform(0, min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+        if time.monotonic() + delay >= deadline or not self.budget.try_spend():
+            return None
+        self.count("retry")
+        log.info(
+            "retrying",
+            extra={"dependency": self.name, "attempt": attempt + 1, "error": repr(error)},
+        )
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+            p95 = {
+                operation: round(sorted(w)[min(len(w) - 1, int(0.95 * len(w)))] * 1000, 1)
+                for operation, w in self._latencies.items()
+                if w
+            }
+        return {"state": self.breaker.state, "opened": self.breaker.opened, **counts, "p95_ms": p95}
+
+
+_dependencies = {
+    "model": Dependency("model", MODEL_DEADLINE_SECONDS, MODEL_ATTEMPTS),
+    "bigquery": Dependency("bigquery", BQ_TIMEOUT_SECONDS, BQ_ATTEMPTS),
+    "gcs": Dependency("gcs", GCS_TIMEOUT_SECONDS, GCS_ATTEMPTS),
+}
+
+
+def dependency(name: str) -> Dependency:
+    return _dependencies[name]
+
+
+def stats() -> dict:
+    return {name: dep.stats() for name, dep in _dependencies.items()}
+
+
+def open_circuits() -> int:
+    return sum(dep.breaker.state != "closed" for dep in _dependencies.values())
+
+
+# ------------------------------------------------------------
+# Blocking calls (store threads)
+# ------------------------------------------------------------
+
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def hedge_workers() -> int:
+    """
+    Size of the hedge pool: a first attempt and a hedge for every store
+    thread that can be calling at once, so attempts do not queue for a thread.
+    """
+    import manual_store_gcp  # already loaded: only the store hedges
+
+    return 2 * (STORE_MAX_WORKERS + manual_store_gcp._IO_WORKERS)
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    """Own pool: the store's pools may be the ones waiting for the result."""
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hedge_pool_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(
+                    max_workers=hedge_workers(), thread_name_prefix="hedge"
+                )
+    return _hedge_pool
+
+
+def _attempt(dep: Dependency, operation: str, fn, deadline: float, hedge: bool):
+    """One attempt (plus its hedge, if any) -> (result, seconds it ran)."""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        dep.count("deadline_exceeded")
+        raise DeadlineExceeded(f"{dep.name} {operation}: deadline exceeded")
+    delay = dep.hedge_delay(operation) if hedge else None
+    if delay is None or delay >= remaining:
+        # The client enforces the deadline (request timeout)
+        started = time.monotonic()
+        return fn(timeout=remaining), time.monotonic() - started
+
+    starts = []
+    running = threading.Event()
+
+    def run():
+        starts.append(time.monotonic())
+        running.set()
+        return fn(timeout=max(0.001, deadline - time.monotonic()))
+
+    pool = _get_hedge_pool()
+    first = pool.submit(contextvars.copy_context().run, run)
+    # The hedge delay counts from when the attempt runs, not from when it
+    # waited for a thread: queueing is not a slow dependency
+    running.wait(max(0.0, deadline - time.monotonic()))
+    done, _ = wait([first], timeout=delay)
+    if done:
+        return first.result(), time.monotonic() - starts[0]
+    pending = {first}
+    if dep.budget.try_spend():
+        dep.count("hedge")
+        pending.add(pool.submit(contextvars.copy_context().run, run))
+    error = None
+    while pending:
+        done, pending = wait(
+            pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED
+        )
+        if not done:
+            dep.count("deadline_exceeded")
+            raise DeadlineExceeded(f"{dep.name} {operation}: deadline exceeded")
+        for future in done:
+            if future.exception() is None:
+                if future is not first:
+                    dep.count("hedge_win")
+                return future.result(), time.monotonic() - starts[0]
+            error = future.exception()
+    raise error
+
+
+def call(dependency_name: str, operation: str, fn, *, idempotent: bool = True, hedge: bool = False):
+    """
+    Runs `fn(timeout=seconds)` (a blocking client call) under the
+    dependency's deadline, retries, hedging (if `hedge`) and circuit
+    breaker. `fn` must pass `timeout` on to the client.
+    """
+    dep = _dependencies[dependency_name]
+    dep.admit()
+    deadline = time.monotonic() + dep.deadline
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            result, seconds = _attempt(dep, operation, fn, deadline, hedge and idempotent)
+        except Exception as e:
+            if not is_transient(e):
+                dep.answered()
+                raise
+            delay = dep.retry_delay(e, attempt, idempotent, deadline)
+            if delay is None:
+                dep.failed(e)
+                raise
+            time.sleep(delay)
+            continue
+        dep.succeeded(operation, seconds)
+        return result
@@ -0,0 +1,233 @@
+# session_store.py - Persistent, bounded conversation sessions for the runner
+"""
+Session service used by the agent runner.
+
+- Backend: ADK's DatabaseSessionService on SESSION_DB_URL (a SQLite file by
+  default), so a conversation survives restarts and every uvicorn worker on
+  the host sees the same sessions. With SESSION_DB_URL empty, sessions live
+  in memory (InMemorySessionService) and stay in one process.
+- Hot set: the sessions used recently are kept in an LRU with TTL
+  (SESSION_CACHE_MAX / SESSION_CACHE_TTL_SECONDS). A hit skips reloading
+  and deserializing the whole event history; for a database backend it
+  only reads the session's update time and last event id, so a turn
+  handled by another worker is never missed.
+- With the memory backend, a session evicted from the hot set is also
+  deleted, so RAM stays bounded.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from google.adk.sessions import (
+    BaseSessionService,
+    DatabaseSessionService,
+    InMemorySessionService,
+)
+from google.adk.sessions.base_session_service import GetSessionConfig, ListSessionsResponse
+
+from settings import SESSION_CACHE_MAX, SESSION_CACHE_TTL_SECONDS, SESSION_DB_URL
+
+
+class BoundedSessionService(BaseSessionService):
+    """Wraps a session service with an LRU/TTL set of hot sessions."""
+
+    def __init__(
+        self,
+        backend: BaseSessionService,
+        max_sessions: int,
+        ttl_seconds: float,
+        durable: bool,
+    ):
+        self.backend = backend
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        # durable: the backend keeps sessions after they leave the hot set
+        self.durable = durable
+        self._hot = OrderedDict()  # (app, user, id) -> (expires_at, session)
+        self._lock = threading.Lock()  # the runner may call us from other threads
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _put(self, session) -> list:
+        """Stores a session in the hot set; returns the evicted keys."""
+        key = (session.app_name, session.user_id, session.id)
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            self._hot[key] = (now + self.ttl_seconds, session)
+            self._hot.move_to_end(key)
+            for old_key, (expires_at, _) in list(self._hot.items()):
+                if len(self._hot) <= self.max_sessions and expires_at >= now:
+                    break
+                del self._hot[old_key]
+                evicted.append(old_key)
+            self.evictions += len(evicted)
+        return evicted
+
+    def _take(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._hot.get(key)
+            if item is None or item[0] < now:
+                self.misses += 1
+                return None
+            self._hot[key] = (now + self.ttl_seconds, item[1])
+            self._hot.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def _drop(self, key):
+        with self._lock:
+            self._hot.pop(key, None)
+
+    async def _evict(self, keys: list):
+        if self.durable:
+            return
+        for app_name, user_id, session_id in keys:
+            await self.backend.delete_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            )
+
+    @staticmethod
+    def _version(session) -> tuple:
+        return (
+            session.last_update_time,
+            session.events[-1].id if session.events else None,
+        )
+
+    def _stored_version(self, key) -> tuple:
+        """
+        (update time, id of the last event) of the stored session: two small
+        reads, instead of loading every event. The update time alone is not
+        enough, it only changes when an event changes the session state.
+        """
+        from google.adk.sessions.database_session_service import (
+            StorageEvent,
+            StorageSession,
+        )
+
+        app_name, user_id, session_id = key
+        with self.backend.database_session_factory() as sql_session:
+            row = sql_session.get(StorageSession, key)
+            if row is None:
+                return (None, None)
+            last_event = (
+                sql_session.query(StorageEvent.id)
+                .filter(
+                    StorageEvent.app_name == app_name,
+                    StorageEvent.user_id == user_id,
+                    StorageEvent.session_id == session_id,
+                )
+                .order_by(StorageEvent.timestamp.desc())
+                .limit(1)
+                .scalar()
+            )
+            return (row.update_timestamp_tz, last_event)
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ):
+        session = await self.backend.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+        await self._evict(self._put(session))
+        return session
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ):
+        key = (app_name, user_id, session_id)
+        if config is None:
+            session = self._take(key)
+            if session is not None:
+                if not isinstance(self.backend, DatabaseSessionService):
+                    return session
+                # Another worker may have added turns since we cached it
+                if self._stored_version(key) == self._version(session):
+                    return session
+                self._drop(key)
+
+        session = await self.backend.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+        if session is not None and config is None:
+            await self._evict(self._put(session))
+        return session
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: Optional[str] = None
+    ) -> ListSessionsResponse:
+        return await self.backend.list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str):
+        self._drop((app_name, user_id, session_id))
+        await self.backend.delete_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+
+    async def append_event(self, session, event):
+        # The backend updates `session` in place (events, state, update time),
+        # which is the object held in the hot set
+        event = await self.backend.append_event(session=session, event=event)
+        if not event.partial:
+            await self._evict(self._put(session))
+        return event
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "hot_sessions": len(self._hot),
+                "max_sessions": self.max_sessions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def _sqlite_setup(db_url: str) -> dict:
+    """Creates the SQLite directory; WAL + busy timeout for several workers."""
+    path = db_url.split("///", 1)[1] if "///" in db_url else ""
+    if path and path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return {"connect_args": {"timeout": 10, "check_same_thread": False}}
+
+
+def create_session_service() -> BoundedSessionService:
+    if not SESSION_DB_URL:
+        return BoundedSessionService(
+            InMemorySessionService(),
+            SESSION_CACHE_MAX,
+            SESSION_CACHE_TTL_SECONDS,
+            durable=False,
+        )
+
+    kwargs = _sqlite_setup(SESSION_DB_URL) if SESSION_DB_URL.startswith("sqlite") else {}
+    backend = DatabaseSessionService(SESSION_DB_URL, **kwargs)
+    if backend.db_engine.dialect.name == "sqlite":
+        with backend.db_engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            # Events of one session, newest first (freshness check + loading)
+            conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_events_session"
+                " ON events (app_name, user_id, session_id, timestamp)"
+            )
+            conn.commit()
+    return BoundedSessionService(
+        backend, SESSION_CACHE_MAX, SESSION_CACHE_TTL_SECONDS, durable=True
+    )
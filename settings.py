@@ -19,3 +19,104 @@ GCP_CREDENTIALS_PATH = os.getenv("GCP_CREDENTIALS_PATH", None)
 # Set credentials if path is provided
 if GCP_CREDENTIALS_PATH and os.path.exists(GCP_CREDENTIALS_PATH):
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GCP_CREDENTIALS_PATH
+
+# Manual cache: in-process LRU + optional SQLite file shared by all workers
+MANUAL_CACHE_TTL_SECONDS = int(os.getenv("MANUAL_CACHE_TTL_SECONDS", "300"))
+MANUAL_CACHE_MAX_ENTRIES = int(os.getenv("MANUAL_CACHE_MAX_ENTRIES", "512"))
+MANUAL_CACHE_SHARED_PATH = os.getenv("MANUAL_CACHE_SHARED_PATH", None)
+
+# Idempotent saves: a save with the same content as one made within this
+# window returns that save's record without writing (0 = off)
+SAVE_DEDUP_WINDOW_SECONDS = int(os.getenv("SAVE_DEDUP_WINDOW_SECONDS", "600"))
+
+# Local search index: full rebuild interval (picks up saves from other workers)
+MANUAL_INDEX_REFRESH_SECONDS = int(os.getenv("MANUAL_INDEX_REFRESH_SECONDS", "600"))
+
+# Semantic vector index: embedder ("hashing" offline, or "gemini"), size, location
+MANUAL_VECTOR_EMBEDDER = os.getenv("MANUAL_VECTOR_EMBEDDER", "hashing")
+MANUAL_VECTOR_DIM = int(os.getenv("MANUAL_VECTOR_DIM", "1024"))
+MANUAL_VECTOR_DIR = os.getenv("MANUAL_VECTOR_DIR", ".cache/manual_vectors")
+# Age after which the vector index is rebuilt (or reloaded, if another worker rebuilt it)
+MANUAL_VECTOR_REFRESH_SECONDS = int(os.getenv("MANUAL_VECTOR_REFRESH_SECONDS", "600"))
+
+# Local disk cache of rendered, precompressed manual HTML (served by /manuals/{id}/html)
+MANUAL_HTML_CACHE_DIR = os.getenv("MANUAL_HTML_CACHE_DIR", ".cache/manual_html")
+
+# Bounded thread pool for blocking BigQuery / GCS calls made from async code
+STORE_MAX_WORKERS = int(os.getenv("STORE_MAX_WORKERS", "16"))
+
+# Startup: build agents / clients in the background when the server starts,
+# and warn if importing main takes longer than this
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+# Conversation sessions: database shared by all workers (empty = in memory,
+# one process) and the LRU/TTL set of hot sessions kept per process
+SESSION_DB_URL = os.getenv("SESSION_DB_URL", "sqlite:///.cache/sessions.sqlite")
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "256"))
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "1800"))
+
+# Agent-run scheduler (per worker): concurrent runs, queue bounds and the
+# longest a request may wait for a slot before getting 429
+ASK_MAX_CONCURRENT = int(os.getenv("ASK_MAX_CONCURRENT", "4"))
+ASK_MAX_QUEUE = int(os.getenv("ASK_MAX_QUEUE", "32"))
+ASK_MAX_QUEUE_PER_USER = int(os.getenv("ASK_MAX_QUEUE_PER_USER", "4"))
+ASK_MAX_WAIT_SECONDS = float(os.getenv("ASK_MAX_WAIT_SECONDS", "30"))
+
+# Answer cache for repeated first questions (invalidated when a manual it read changes)
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+# Summary / checklist / message derived in the background once per manual version
+MANUAL_DERIVATIONS_ENABLED = os.getenv("MANUAL_DERIVATIONS_ENABLED", "true").lower() == "true"
+MANUAL_DERIVATIONS_MODEL = os.getenv("MANUAL_DERIVATIONS_MODEL", "gemini-2.5-flash-lite")
+MANUAL_DERIVED_CACHE_DIR = os.getenv("MANUAL_DERIVED_CACHE_DIR", ".cache/manual_derived")
+
+# Fast path: answer obvious list / search / open requests from the store
+# without the agents, and how many manuals a list answer shows
+FAST_ROUTER_ENABLED = os.getenv("FAST_ROUTER_ENABLED", "true").lower() == "true"
+FAST_ROUTER_LIST_LIMIT = int(os.getenv("FAST_ROUTER_LIST_LIMIT", "20"))
+
+# Token budget of each model request (history rolled into a summary above it)
+# and of one tool result (projected / truncated above it); estimated tokens
+CONTEXT_BUDGET_ENABLED = os.getenv("CONTEXT_BUDGET_ENABLED", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "16000"))
+CONTEXT_TOOL_RESULT_TOKENS = int(os.getenv("CONTEXT_TOOL_RESULT_TOKENS", "3000"))
+
+# Logging: DEBUG / INFO / WARNING / ERROR, and "text" or "json" lines
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Tracing: "none", "file" (OTLP/JSON lines in TRACE_FILE) or "otlp" (collector
+# at OTEL_EXPORTER_OTLP_ENDPOINT); prompts / answers in spans only if asked
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", ".cache/traces.jsonl")
+TRACE_CAPTURE_CONTENT = os.getenv("TRACE_CAPTURE_CONTENT", "false").lower() == "true"
+
+# Record / replay of the agents' model and tool calls: "off", "record" or
+# "replay" (one cassette per conversation in CASSETTE_DIR), replayed with the
+# "original" or "zero" latency
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", ".cache/cassettes")
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "original").lower()
+
+# Resilience of the Gemini / BigQuery / GCS calls (resilience.py): deadline of
+# one call, all attempts included, and attempts on transient errors
+MODEL_DEADLINE_SECONDS = float(os.getenv("MODEL_DEADLINE_SECONDS", "60"))
+MODEL_ATTEMPTS = int(os.getenv("MODEL_ATTEMPTS", "3"))
+BQ_TIMEOUT_SECONDS = float(os.getenv("BQ_TIMEOUT_SECONDS", "30"))
+BQ_ATTEMPTS = int(os.getenv("BQ_ATTEMPTS", "3"))
+GCS_TIMEOUT_SECONDS = float(os.getenv("GCS_TIMEOUT_SECONDS", "20"))
+GCS_ATTEMPTS = int(os.getenv("GCS_ATTEMPTS", "3"))
+# Duplicate of an idempotent read still running after this percentile of the
+# latency of its recent calls (needs HEDGE_MIN_SAMPLES of them)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# Retries + hedges in the last 10 s: at most this share of the calls, or the minimum
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = int(os.getenv("RETRY_BUDGET_MIN", "10"))
+# Circuit breaker: consecutive failed calls that open it, and seconds failing
+# fast before a trial call
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
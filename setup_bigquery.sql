@@ -20,8 +20,11 @@ CREATE TABLE IF NOT EXISTS manuals_dataset.manuals_dict (
   requirements STRING OPTIONS(description="Prerequisites and requirements"),
   permissions STRING OPTIONS(description="Required permissions and access"),
   outputs STRING OPTIONS(description="Expected outputs and deliverables"),
-  keywords ARRAY<STRING> OPTIONS(description="Search keywords/tags")
+  keywords ARRAY<STRING> OPTIONS(description="Search keywords/tags"),
+  version INT64 OPTIONS(description="Manual version; each changed save appends a row with version + 1"),
+  record_hash STRING OPTIONS(description="sha256 of metadata + steps, without timestamps")
 )
+CLUSTER BY manual_id
 OPTIONS(
   description = "Main table storing manual metadata and dictionary information"
 );
@@ -35,8 +38,11 @@ CREATE TABLE IF NOT EXISTS manuals_dataset.manual_steps (
   expected_output STRING OPTIONS(description="Expected result from this step"),
   required_tools STRING OPTIONS(description="Tools or systems needed"),
   estimated_time STRING OPTIONS(description="Estimated time to complete"),
-  is_critical BOOL OPTIONS(description="Whether this is a critical step")
+  is_critical BOOL OPTIONS(description="Whether this is a critical step"),
+  version INT64 OPTIONS(description="Version of the manuals_dict row these steps belong to"),
+  record_hash STRING OPTIONS(description="record_hash of the manuals_dict row these steps belong to")
 )
+CLUSTER BY manual_id
 OPTIONS(
   description = "Table storing step-by-step procedures for each manual"
 );
@@ -48,12 +54,63 @@ CREATE TABLE IF NOT EXISTS manuals_dataset.manual_files (
   file_path STRING OPTIONS(description="GCS path to the file, e.g., gs://bucket/path"),
   format STRING OPTIONS(description="File format, e.g., html, pdf, markdown"),
   created_at TIMESTAMP OPTIONS(description="File creation timestamp"),
-  created_by STRING OPTIONS(description="User who created this version")
+  created_by STRING OPTIONS(description="User who created this version"),
+  content_hash STRING OPTIONS(description="sha256 of the rendered HTML (blob is manuals/blobs/{hash}.html)")
 )
 OPTIONS(
   description = "Table storing file versions and their GCS locations"
 );
 
+-- Migration for tables created before content-addressed storage
+ALTER TABLE manuals_dataset.manual_files
+  ADD COLUMN IF NOT EXISTS content_hash STRING;
+
+-- Migration for tables created before versioned rows.
+-- Existing rows become version 1 (run once, when no save happened in the
+-- last ~30 minutes: rows in the streaming buffer cannot be updated).
+ALTER TABLE manuals_dataset.manuals_dict
+  ADD COLUMN IF NOT EXISTS version INT64,
+  ADD COLUMN IF NOT EXISTS record_hash STRING;
+ALTER TABLE manuals_dataset.manual_steps
+  ADD COLUMN IF NOT EXISTS version INT64,
+  ADD COLUMN IF NOT EXISTS record_hash STRING;
+UPDATE manuals_dataset.manuals_dict SET version = 1 WHERE version IS NULL;
+UPDATE manuals_dataset.manual_steps SET version = 1 WHERE version IS NULL;
+
+-- 5. Create manual_derivations table (summary / checklist / message per manual version)
+CREATE TABLE IF NOT EXISTS manuals_dataset.manual_derivations (
+  manual_id STRING NOT NULL OPTIONS(description="Foreign key to manuals_dict"),
+  version INT64 OPTIONS(description="Manual version the artifacts were derived from"),
+  record_hash STRING OPTIONS(description="record_hash of that version (key of the JSON blob)"),
+  summary STRING OPTIONS(description="Short summary (Markdown)"),
+  checklist STRING OPTIONS(description="Operational checklist (Markdown)"),
+  message STRING OPTIONS(description="Suggested communication message"),
+  model STRING OPTIONS(description="Model that generated them"),
+  created_at TIMESTAMP OPTIONS(description="Generation timestamp"),
+  file_path STRING OPTIONS(description="GCS copy, gs://bucket/manuals/derived/{record_hash}.json")
+)
+CLUSTER BY manual_id
+OPTIONS(
+  description = "Artifacts generated in the background once per manual version"
+);
+
+-- 6. Latest version of each manual (what the app reads)
+CREATE OR REPLACE VIEW manuals_dataset.manuals_latest AS
+SELECT *
+FROM manuals_dataset.manuals_dict
+WHERE TRUE
+QUALIFY ROW_NUMBER() OVER (
+  PARTITION BY manual_id ORDER BY version DESC, last_updated DESC
+) = 1;
+
+CREATE OR REPLACE VIEW manuals_dataset.manual_steps_latest AS
+SELECT s.*
+FROM manuals_dataset.manual_steps s
+JOIN manuals_dataset.manuals_latest m
+  ON s.manual_id = m.manual_id
+ AND s.version IS NOT DISTINCT FROM m.version
+ AND s.record_hash IS NOT DISTINCT FROM m.record_hash;
+
 -- Optional: Create indexes for better query performance
 -- Note: BigQuery doesn't have traditional indexes, but clustering helps
 
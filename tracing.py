@@ -0,0 +1,193 @@
+# tracing.py - OpenTelemetry traces: one per /ask, down to each BigQuery job
+"""
+Each /ask and /ask/stream request opens a root span ("ask"). Everything
+the request does is nested under it:
+
+- ADK's own spans: `invocation`, `invoke_agent <agent>` for the coordinator
+  and each sub-agent, `call_llm` for each model call and
+  `execute_tool <tool>` for each tool call. ADK emits them once a
+  TracerProvider is installed.
+- `store.<function>` for each storage call (manual_store_async), with
+  `storage.bq_query`, `storage.bq_insert`, `storage.gcs_upload` and
+  `storage.gcs_download` below it for each BigQuery job and GCS transfer.
+  The store runs on thread pools, so the context is copied to the worker
+  thread with every call.
+
+TRACING_EXPORTER chooses where spans go:
+- "none" (default): no provider, no spans, no cost.
+- "file": OTLP/JSON lines (one ExportTraceServiceRequest per batch) appended
+  to TRACE_FILE. The collector's otlpjsonfile receiver reads this format.
+- "otlp": OTLP over HTTP to a collector, configured with the standard
+  OTEL_EXPORTER_OTLP_ENDPOINT / OTEL_EXPORTER_OTLP_TRACES_ENDPOINT variables.
+
+The trace ID is returned with every /ask answer (`trace_id`), and added to
+the log lines written while the trace is active.
+The OpenTelemetry SDK is only imported when tracing is on.
+"""
+import base64
+import contextlib
+import os
+import threading
+
+from settings import TRACE_CAPTURE_CONTENT, TRACE_FILE, TRACING_EXPORTER
+
+SERVICE_NAME = "manuel-el-manual"
+
+_provider = None
+_setup_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return TRACING_EXPORTER in ("file", "otlp")
+
+
+class OtlpJsonFileExporter:
+    """
+    Appends spans to a file as OTLP/JSON, one export request per line.
+    Implements the SpanExporter interface (duck-typed, so the SDK is only
+    imported when spans are exported).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        import json
+
+        from google.protobuf.json_format import MessageToDict
+        from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+        from opentelemetry.sdk.trace.export import SpanExportResult
+
+        payload = MessageToDict(encode_spans(spans), use_integers_for_enums=True)
+        _hex_ids(payload)
+        line = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        return None
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def _hex_ids(payload: dict):
+    """OTLP/JSON writes trace / span IDs as hex, protobuf JSON as base64."""
+    for resource_spans in payload.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                for item in [span] + span.get("links", []):
+                    for key in ("traceId", "spanId", "parentSpanId"):
+                        if item.get(key):
+                            item[key] = base64.b64decode(item[key]).hex()
+
+
+def setup():
+    """Installs the global TracerProvider once (no-op when tracing is off)."""
+    global _provider
+    if _provider is not None or not enabled():
+        return
+    with _setup_lock:
+        if _provider is not None:
+            return
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        # Prompts and answers stay out of the spans unless asked for
+        os.environ.setdefault(
+            "ADK_CAPTURE_MESSAGE_CONTENT_IN_SPANS", "true" if TRACE_CAPTURE_CONTENT else "false"
+        )
+
+        if TRACING_EXPORTER == "otlp":
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            exporter = OTLPSpanExporter()
+        else:
+            exporter = OtlpJsonFileExporter(TRACE_FILE)
+
+        provider = TracerProvider(resource=Resource.create({"service.name": SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _provider = provider
+
+
+def shutdown():
+    """Flushes the spans still buffered (server shutdown)."""
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def _tracer():
+    setup()
+    from opentelemetry import trace
+
+    return trace.get_tracer("manuel-el-manual")
+
+
+def _clean(attributes: dict | None) -> dict:
+    return {k: v for k, v in (attributes or {}).items() if v is not None}
+
+
+def start_span(name: str, attributes: dict | None = None):
+    """A new span (not made current), or None when tracing is off."""
+    if not enabled():
+        return None
+    return _tracer().start_span(name, attributes=_clean(attributes))
+
+
+@contextlib.contextmanager
+def use_span(span, end_on_exit: bool = True):
+    """Makes `span` current for the block; records an exception that escapes it."""
+    if span is None:
+        yield None
+        return
+    from opentelemetry import trace
+
+    with trace.use_span(span, end_on_exit=end_on_exit):
+        yield span
+
+
+@contextlib.contextmanager
+def span(name: str, attributes: dict | None = None):
+    """Child span of the current one for the block (nothing when tracing is off)."""
+    if not enabled():
+        yield None
+        return
+    with _tracer().start_as_current_span(name, attributes=_clean(attributes)) as current:
+        yield current
+
+
+def end_span(span):
+    if span is not None and span.is_recording():
+        span.end()
+
+
+def set_attributes(span, attributes: dict):
+    if span is not None and span.is_recording():
+        span.set_attributes(_clean(attributes))
+
+
+def trace_id(span) -> str | None:
+    """Hex trace ID of `span`, as trace backends show it."""
+    if span is None:
+        return None
+    context = span.get_span_context()
+    return format(context.trace_id, "032x") if context.is_valid else None
+
+
+def current_trace_id() -> str | None:
+    if _provider is None:
+        return None
+    from opentelemetry import trace
+
+    return trace_id(trace.get_current_span())